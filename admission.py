@@ -0,0 +1,208 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# -----------------------------------
+# Admission Control for LLM-bound Routes
+# -----------------------------------
+# Requests pass a per-user and a global token bucket, then wait in a fair queue
+# for one of a fixed number of LLM slots. Waiting users are served round-robin,
+# so one user's burst cannot starve the others. Whatever cannot be admitted
+# quickly is rejected with a Retry-After hint instead of queueing without bound.
+
+USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "0.5"))        # requests/second per user
+USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "5"))
+GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", "5"))      # requests/second overall
+GLOBAL_BURST = int(os.getenv("ADMISSION_GLOBAL_BURST", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "2"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "20"))
+
+# Per-user buckets kept in memory; idle users beyond this are forgotten (a full bucket)
+MAX_TRACKED_USERS = 10000
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> Tuple[bool, float]:
+        """Take one token. Returns (acquired, seconds until one is available)."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def refund(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class FairQueue:
+    """Limits concurrent holders; waiters are granted slots round-robin by user."""
+
+    def __init__(self, concurrency: int, max_queue: int, max_per_user: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.in_flight = 0
+        self.waiting: "OrderedDict[str, Deque[threading.Event]]" = OrderedDict()
+        self.queued = 0
+        self.lock = threading.Lock()
+        # Moving average of slot hold time, used for Retry-After estimates
+        self.avg_service_seconds = 5.0
+
+    def estimated_wait(self) -> float:
+        return self.avg_service_seconds * (self.queued + 1) / max(self.concurrency, 1)
+
+    def acquire(self, user: str, timeout: float) -> None:
+        with self.lock:
+            if self.in_flight < self.concurrency and not self.queued:
+                self.in_flight += 1
+                return
+            if self.queued >= self.max_queue:
+                raise AdmissionRejected("queue_full", self.estimated_wait())
+            user_queue = self.waiting.setdefault(user, deque())
+            if len(user_queue) >= self.max_per_user:
+                raise AdmissionRejected("user_queue_full", self.estimated_wait())
+            granted = threading.Event()
+            user_queue.append(granted)
+            self.queued += 1
+
+        if granted.wait(timeout):
+            return
+
+        with self.lock:
+            if granted.is_set():
+                # Granted between the timeout and taking the lock
+                return
+            user_queue = self.waiting.get(user)
+            if user_queue and granted in user_queue:
+                user_queue.remove(granted)
+                self.queued -= 1
+                if not user_queue:
+                    del self.waiting[user]
+            raise AdmissionRejected("queue_timeout", self.estimated_wait())
+
+    def release(self, held_seconds: float) -> None:
+        with self.lock:
+            self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * held_seconds
+            if not self.waiting:
+                self.in_flight -= 1
+                return
+            # Hand the slot to the user at the head of the rotation, then move them to the back
+            user, user_queue = next(iter(self.waiting.items()))
+            granted = user_queue.popleft()
+            self.queued -= 1
+            del self.waiting[user]
+            if user_queue:
+                self.waiting[user] = user_queue
+            granted.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "queued_by_user": {user: len(queue) for user, queue in self.waiting.items()},
+                "avg_service_seconds": round(self.avg_service_seconds, 2)
+            }
+
+
+class AdmissionController:
+    def __init__(self, user_rate: float = USER_RATE, user_burst: int = USER_BURST,
+                 global_rate: float = GLOBAL_RATE, global_burst: int = GLOBAL_BURST,
+                 concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 max_queued_per_user: int = LLM_MAX_QUEUED_PER_USER,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.queue_timeout = queue_timeout
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.queue = FairQueue(concurrency, max_queue, max_queued_per_user)
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "admitted": 0, "user_rate": 0, "global_rate": 0,
+            "queue_full": 0, "user_queue_full": 0, "queue_timeout": 0
+        }
+
+    def _user_bucket(self, user: str) -> TokenBucket:
+        bucket = self.user_buckets.pop(user, None) or TokenBucket(self.user_rate, self.user_burst)
+        self.user_buckets[user] = bucket
+        if len(self.user_buckets) > MAX_TRACKED_USERS:
+            self.user_buckets.popitem(last=False)
+        return bucket
+
+    def _count(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] += 1
+
+    def admit(self, user: str) -> None:
+        """Block until the request may run or raise AdmissionRejected."""
+        with self.lock:
+            user_bucket = self._user_bucket(user)
+            allowed, retry_after = user_bucket.try_acquire()
+            if not allowed:
+                self.counters["user_rate"] += 1
+                raise AdmissionRejected("user_rate", retry_after)
+            allowed, retry_after = self.global_bucket.try_acquire()
+            if not allowed:
+                user_bucket.refund()
+                self.counters["global_rate"] += 1
+                raise AdmissionRejected("global_rate", retry_after)
+
+        try:
+            self.queue.acquire(user, self.queue_timeout)
+        except AdmissionRejected as e:
+            self._count(e.reason)
+            raise
+        self._count("admitted")
+
+    def release(self, held_seconds: float) -> None:
+        self.queue.release(held_seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            "limits": {
+                "user_rate": self.user_rate,
+                "user_burst": self.user_burst,
+                "global_rate": self.global_bucket.rate,
+                "global_burst": self.global_bucket.capacity,
+                "concurrency": self.queue.concurrency,
+                "max_queue": self.queue.max_queue,
+                "max_queued_per_user": self.queue.max_per_user,
+                "queue_timeout_seconds": self.queue_timeout
+            },
+            "counters": counters,
+            "tracked_users": len(self.user_buckets),
+            **self.queue.snapshot()
+        }
+
+
+admission = AdmissionController()
+
+
+def request_user(headers: Any, client_host: Optional[str]) -> str:
+    """Identity used for per-user limits: the X-Username header, else the client address."""
+    return headers.get("x-username") or f"ip:{client_host or 'unknown'}"
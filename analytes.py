@@ -0,0 +1,225 @@
+import re
+import heapq
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+# -----------------------------------
+# Canonical Analyte Registry
+# -----------------------------------
+
+# canonical name -> aliases and default unit. Aliases are matched after normalize_name().
+ANALYTES: Dict[str, Dict] = {
+    # Complete blood count
+    "hemoglobin": {"aliases": ["hb", "hgb", "haemoglobin", "hemoglobin hb", "hemoglobin hgb"], "unit": "g/dL"},
+    "hematocrit": {"aliases": ["hct", "pcv", "packed cell volume", "haematocrit"], "unit": "%"},
+    "rbc count": {"aliases": ["rbc", "red blood cell count", "erythrocyte count", "total rbc count"], "unit": "million/cumm"},
+    "wbc count": {"aliases": ["wbc", "tlc", "total leucocyte count", "total leukocyte count", "white blood cell count", "total wbc count"], "unit": "cells/cumm"},
+    "platelet count": {"aliases": ["plt", "platelets", "platelet"], "unit": "lakhs/cumm"},
+    "mcv": {"aliases": ["mean corpuscular volume"], "unit": "fL"},
+    "mch": {"aliases": ["mean corpuscular hemoglobin", "mean corpuscular haemoglobin"], "unit": "pg"},
+    "mchc": {"aliases": ["mean corpuscular hemoglobin concentration", "mean corpuscular haemoglobin concentration"], "unit": "g/dL"},
+    "rdw": {"aliases": ["rdw cv", "red cell distribution width"], "unit": "%"},
+    "neutrophils": {"aliases": ["neutrophil", "polymorphs"], "unit": "%"},
+    "lymphocytes": {"aliases": ["lymphocyte"], "unit": "%"},
+    "monocytes": {"aliases": ["monocyte"], "unit": "%"},
+    "eosinophils": {"aliases": ["eosinophil"], "unit": "%"},
+    "basophils": {"aliases": ["basophil"], "unit": "%"},
+    "esr": {"aliases": ["erythrocyte sedimentation rate"], "unit": "mm/hr"},
+    # Diabetes
+    "glucose fasting": {"aliases": ["fbs", "fasting blood sugar", "fasting glucose", "fasting plasma glucose", "blood sugar fasting"], "unit": "mg/dL"},
+    "glucose postprandial": {"aliases": ["ppbs", "post prandial blood sugar", "postprandial glucose", "blood sugar pp"], "unit": "mg/dL"},
+    "glucose random": {"aliases": ["rbs", "random blood sugar", "random glucose"], "unit": "mg/dL"},
+    "hba1c": {"aliases": ["glycated hemoglobin", "glycosylated hemoglobin", "hb a1c", "glycated haemoglobin"], "unit": "%"},
+    # Lipid profile
+    "total cholesterol": {"aliases": ["cholesterol", "cholesterol total", "serum cholesterol"], "unit": "mg/dL"},
+    "hdl cholesterol": {"aliases": ["hdl", "hdl c", "cholesterol hdl"], "unit": "mg/dL"},
+    "ldl cholesterol": {"aliases": ["ldl", "ldl c", "cholesterol ldl", "ldl direct", "ldl cholesterol direct"], "unit": "mg/dL"},
+    "vldl cholesterol": {"aliases": ["vldl", "cholesterol vldl"], "unit": "mg/dL"},
+    "triglycerides": {"aliases": ["tg", "triglyceride", "serum triglycerides"], "unit": "mg/dL"},
+    # Kidney function
+    "creatinine": {"aliases": ["serum creatinine", "creatinine serum"], "unit": "mg/dL"},
+    "urea": {"aliases": ["blood urea", "serum urea"], "unit": "mg/dL"},
+    "bun": {"aliases": ["blood urea nitrogen", "urea nitrogen"], "unit": "mg/dL"},
+    "uric acid": {"aliases": ["serum uric acid"], "unit": "mg/dL"},
+    "egfr": {"aliases": ["gfr", "estimated gfr", "estimated glomerular filtration rate"], "unit": "mL/min/1.73m2"},
+    "sodium": {"aliases": ["na", "serum sodium"], "unit": "mmol/L"},
+    "potassium": {"aliases": ["k", "serum potassium"], "unit": "mmol/L"},
+    "chloride": {"aliases": ["cl", "serum chloride"], "unit": "mmol/L"},
+    "calcium": {"aliases": ["ca", "serum calcium", "total calcium"], "unit": "mg/dL"},
+    # Liver function
+    "bilirubin total": {"aliases": ["total bilirubin", "serum bilirubin total"], "unit": "mg/dL"},
+    "bilirubin direct": {"aliases": ["direct bilirubin", "conjugated bilirubin"], "unit": "mg/dL"},
+    "bilirubin indirect": {"aliases": ["indirect bilirubin", "unconjugated bilirubin"], "unit": "mg/dL"},
+    "alt": {"aliases": ["sgpt", "alanine aminotransferase", "alt sgpt", "sgpt alt"], "unit": "U/L"},
+    "ast": {"aliases": ["sgot", "aspartate aminotransferase", "ast sgot", "sgot ast"], "unit": "U/L"},
+    "alkaline phosphatase": {"aliases": ["alp", "alk phos"], "unit": "U/L"},
+    "ggt": {"aliases": ["gamma gt", "gamma glutamyl transferase", "ggtp"], "unit": "U/L"},
+    "total protein": {"aliases": ["protein total", "serum protein"], "unit": "g/dL"},
+    "albumin": {"aliases": ["serum albumin"], "unit": "g/dL"},
+    "globulin": {"aliases": ["serum globulin"], "unit": "g/dL"},
+    # Thyroid
+    "tsh": {"aliases": ["thyroid stimulating hormone", "tsh ultrasensitive", "ultrasensitive tsh"], "unit": "uIU/mL"},
+    "t3": {"aliases": ["total t3", "triiodothyronine", "t3 total"], "unit": "ng/dL"},
+    "t4": {"aliases": ["total t4", "thyroxine", "t4 total"], "unit": "ug/dL"},
+    "free t3": {"aliases": ["ft3"], "unit": "pg/mL"},
+    "free t4": {"aliases": ["ft4"], "unit": "ng/dL"},
+    # Vitamins, iron and inflammation
+    "vitamin d": {"aliases": ["25 oh vitamin d", "vitamin d3", "25 hydroxy vitamin d", "vitamin d 25 hydroxy", "vit d", "vit d3"], "unit": "ng/mL"},
+    "vitamin b12": {"aliases": ["b12", "cobalamin", "vit b12", "cyanocobalamin"], "unit": "pg/mL"},
+    "ferritin": {"aliases": ["serum ferritin"], "unit": "ng/mL"},
+    "iron": {"aliases": ["serum iron", "fe"], "unit": "ug/dL"},
+    "tibc": {"aliases": ["total iron binding capacity"], "unit": "ug/dL"},
+    "crp": {"aliases": ["c reactive protein", "hs crp", "hscrp"], "unit": "mg/L"},
+}
+
+# A fuzzy match may differ by at most one edit per FUZZY_CHARS_PER_EDIT characters
+# of the longer name (similarity >= 0.8), compared in integers to avoid rounding
+FUZZY_CHARS_PER_EDIT = 5
+# Names shorter than this are matched exactly only ("k" must not become "ca")
+FUZZY_MIN_LENGTH = 4
+# How many trigram candidates are verified with edit distance
+FUZZY_CANDIDATES = 5
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Normalize a test name for grouping: lowercase, no punctuation, single spaces."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (name or "").lower()).split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up with limit + 1 once it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _tokens_agree(a: str, b: str) -> bool:
+    """
+    Same number of words, and single-letter and numeric words identical, so a
+    near spelling cannot turn "vitamin a" into "vitamin d" or "b6" into "b12".
+    """
+    tokens_a, tokens_b = a.split(), b.split()
+    if len(tokens_a) != len(tokens_b):
+        return False
+    for x, y in zip(tokens_a, tokens_b):
+        distinctive = len(x) == 1 or len(y) == 1 or any(c.isdigit() for c in x + y)
+        if distinctive and x != y:
+            return False
+    return True
+
+
+class AnalyteMatcher:
+    """
+    Maps raw test names to canonical analytes.
+
+    Lookup order: exact hash lookup on the normalized name, then on the name
+    with and without its parenthesised part ("Hemoglobin (HGB)"), then a
+    trigram index whose best candidates are verified by edit distance.
+    """
+
+    def __init__(self, analytes: Dict[str, Dict]):
+        self.analytes = analytes
+        self.lookup: Dict[str, str] = {}
+        self.trigram_index: Dict[str, Set[str]] = defaultdict(set)
+        self.trigram_counts: Dict[str, int] = {}
+
+        for canonical, entry in analytes.items():
+            for alias in [canonical, *entry.get("aliases", [])]:
+                key = normalize_name(alias)
+                self.lookup[key] = canonical
+                grams = _trigrams(key)
+                self.trigram_counts[key] = len(grams)
+                for gram in grams:
+                    self.trigram_index[gram].add(key)
+
+        # Names that are also a word of another analyte ("cholesterol" in "hdl cholesterol")
+        self.shared_keys: Set[str] = {
+            key for key, canonical in self.lookup.items()
+            if any(other != canonical and f" {key} " in f" {other} " for other in analytes)
+        }
+
+        self._match = lru_cache(maxsize=4096)(self._match_uncached)
+
+    def default_unit(self, canonical: str) -> str:
+        return self.analytes.get(canonical, {}).get("unit", "")
+
+    def match(self, name: Optional[str]) -> Optional[str]:
+        """Return the canonical analyte for a raw test name, or None if unmatched."""
+        return self._match(name or "")
+
+    def match_exact(self, name: Optional[str], specific: bool = False) -> Optional[str]:
+        """
+        Canonical analyte only when the name is a canonical name or alias (no fuzzy step).
+        With specific=True, names shared with other analytes ("cholesterol", "t3") are unmatched.
+        """
+        for key in self._candidate_keys(name or ""):
+            if key in self.lookup:
+                if specific and key in self.shared_keys:
+                    return None
+                return self.lookup[key]
+        return None
+
+    def _match_uncached(self, name: str) -> Optional[str]:
+        exact = self.match_exact(name)
+        if exact:
+            return exact
+
+        key = normalize_name(name)
+        if len(key) < FUZZY_MIN_LENGTH:
+            return None
+        return self._fuzzy_match(key)
+
+    def _candidate_keys(self, name: str) -> List[str]:
+        keys = [normalize_name(name)]
+        inner = re.findall(r"\(([^)]*)\)", name)
+        if inner:
+            keys.append(normalize_name(re.sub(r"\([^)]*\)", " ", name)))
+            keys.extend(normalize_name(part) for part in inner)
+        return [key for key in keys if key]
+
+    def _fuzzy_match(self, key: str) -> Optional[str]:
+        grams = _trigrams(key)
+        overlap: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for alias in self.trigram_index.get(gram, ()):
+                overlap[alias] += 1
+
+        # Rank by trigram Jaccard similarity, then verify the best few by edit distance
+        ranked: List[Tuple[float, str]] = heapq.nlargest(
+            FUZZY_CANDIDATES,
+            ((shared / (len(grams) + self.trigram_counts[alias] - shared), alias) for alias, shared in overlap.items())
+        )
+
+        best_alias, best_distance = None, None
+        for _, alias in ranked:
+            if not _tokens_agree(key, alias):
+                continue
+            limit = max(len(key), len(alias)) // FUZZY_CHARS_PER_EDIT
+            distance = _edit_distance(key, alias, limit)
+            # A capped distance only says "more than limit", so it is never a match
+            if distance <= limit and (best_distance is None or distance < best_distance):
+                best_alias, best_distance = alias, distance
+
+        return self.lookup[best_alias] if best_alias else None
+
+
+analyte_matcher = AnalyteMatcher(ANALYTES)
+
+
+def canonical_test_name(name: Optional[str]) -> str:
+    """Canonical analyte for a test name, falling back to the normalized name when unmatched."""
+    return analyte_matcher.match(name) or normalize_name(name)
@@ -1,52 +1,49 @@
 import streamlit as st
-import os
-import tempfile
+import json
+import time
 import requests
-import pandas as pd
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
-from preprocessing import MedicalReportProcessor
-from utils import save_uploaded_file
-from auth import show_my_reports
-from database import get_conversation_history, update_conversation_history
-from chatbot import analyze_report
+from utils import fetch_report_data, report_version, retry_ingestion, upload_report, wait_for_ingestion
+
+# Heavy modules (pandas, auth and the chat stack)
+# are imported where they are first used so the login page renders quickly.
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB setup
-client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
-db = client["mediway"]
-patients_collection = db["patients"]
-tests_collection = db["tests"]
-
 API_BASE_URL = "http://127.0.0.1:8080"  # FastAPI base URL
 
 
-@st.cache_data(show_spinner=False)
-def fetch_report_data(report_id):
-    try:
-        response = requests.get(f"{API_BASE_URL}/report/{report_id}")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error fetching report: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"API connection error: {e}")
-        return None
+# How long the dashboard keeps polling an analysis that is still being generated
+ANALYSIS_POLL_LIMIT_SECONDS = 90
 
 
 def get_analysis(report_id):
     try:
         with st.spinner("Analyzing report with AI..."):
-            response = requests.post(
-                f"{API_BASE_URL}/analyze/{report_id}",
-                json={"patient_context": st.session_state.get("patient_context", {})}
-            )
+            deadline = time.monotonic() + ANALYSIS_POLL_LIMIT_SECONDS
+            while True:
+                response = requests.post(
+                    f"{API_BASE_URL}/analyze/{report_id}",
+                    json={"patient_context": st.session_state.get("patient_context", {})},
+                    headers={"X-Username": st.session_state.get("username", "")}
+                )
+                # 202: the analysis started at upload is still being generated
+                if response.status_code != 202 or time.monotonic() >= deadline:
+                    break
+                time.sleep(int(response.headers.get("Retry-After", "2")))
+            if response.status_code == 202:
+                st.info("⏳ The analysis is still being prepared. Please check back in a moment.")
+                return None
             if response.status_code == 200:
                 return response.json()["analysis"]
+            elif response.status_code == 429:
+                if "usage limit" in response.text:
+                    st.warning("⏳ You've reached today's limit for AI answers. It resets at midnight UTC.")
+                else:
+                    st.warning(f"⏳ The assistant is busy. Please try again in {response.headers.get('Retry-After', 'a few')} seconds.")
+                return None
             else:
                 st.error(f"Error getting analysis: {response.text}")
                 return None
@@ -55,6 +52,61 @@ def get_analysis(report_id):
         return None
 
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def test_results_frame(report_id, report_version, _tests):
+    # Keyed by the report's ETag, which changes with its stored version; _tests is not hashed
+    import pandas as pd
+
+    return pd.DataFrame([
+        {
+            "Test Name": test["Name"],
+            "Result": test["Value"],
+            "Unit": test["Unit"],
+            "Reference Range": test["Reference Interval"],
+            "Flag": test.get("Flag") or ""
+        } for test in _tests
+    ])
+
+
+@st.fragment
+def test_results_table(report_id, report_data):
+    from lab_values import ABNORMAL_FLAGS
+
+    # Without an ETag the rows themselves are the cache key
+    version = report_version(report_id) or json.dumps(report_data["Tests"], sort_keys=True)
+    df = test_results_frame(report_id, version, report_data["Tests"])
+    if st.toggle("Show abnormal results only", key=f"abnormal_only_{report_id}"):
+        df = df[df["Flag"].isin(ABNORMAL_FLAGS)]
+    st.dataframe(df, use_container_width=True)
+
+
+@st.fragment
+def chat_panel(report_id):
+    # A chat turn reruns only this panel, not the report list, table or sidebar
+    from database import get_conversation_history
+    from chatbot import analyze_report
+
+    for msg in get_conversation_history(report_id):
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+    if prompt := st.chat_input("Ask about your test results...", key=f"chat_input_{report_id}"):
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                # analyze_report stores the turn in the conversation history itself
+                response = analyze_report(
+                    report_id,
+                    custom_prompt=prompt,
+                    patient_context=st.session_state.get("patient_context", {}),
+                    username=st.session_state.get("username"),
+                    endpoint="dashboard_chat"
+                )
+                st.markdown(response)
+
+
 def display_report_and_insights(report_data, report_id):
     st.header("Patient Information")
     patient = report_data["Patient Details"]
@@ -70,16 +122,7 @@ def display_report_and_insights(report_data, report_id):
         st.markdown(f"**Report ID:** `{report_id}`")
 
     st.header("Test Results")
-    test_data = [
-        {
-            "Test Name": test["Name"],
-            "Result": test["Value"],
-            "Unit": test["Unit"],
-            "Reference Range": test["Reference Interval"]
-        } for test in report_data["Tests"]
-    ]
-    df = pd.DataFrame(test_data)
-    st.dataframe(df, use_container_width=True)
+    test_results_table(report_id, report_data)
 
     st.header("AI Analysis")
     analysis_key = f"analysis_{report_id}"
@@ -92,30 +135,7 @@ def display_report_and_insights(report_data, report_id):
         st.markdown(st.session_state[analysis_key])
 
     st.header("Chat with MediWay")
-
-    # Step 1: Load and display previous conversation from DB
-    history = get_conversation_history(report_id)
-
-    for msg in history:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-
-    # Step 2: Handle new input
-    if prompt := st.chat_input("Ask about your test results...", key=f"chat_input_{report_id}"):
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = analyze_report(
-                    report_id,
-                    custom_prompt=prompt,
-                    patient_context=st.session_state.get("patient_context", {})
-                )
-                st.markdown(response)
-
-        # Step 3: Save to MongoDB for persistence
-        update_conversation_history(report_id, prompt, response)
+    chat_panel(report_id)
 
 
 def app_dashboard():
@@ -160,6 +180,7 @@ def app_dashboard():
         st.info("MediWay helps you understand your blood test results through AI-powered analysis and personalized insights.")
 
     # Show User Reports
+    from auth import show_my_reports
     show_my_reports()
 
     # Handle New Upload
@@ -170,21 +191,37 @@ def app_dashboard():
         st.session_state.upload_handled = True
         st.success("File uploaded successfully!")
 
+        # The PDF is streamed to the backend, which stores and processes it; this
+        # process only polls the ingestion instead of running OCR on its own copy
+        username = st.session_state.get("username")
+        report_id = None
         with st.spinner("\U0001F50D Processing the blood report..."):
-            temp_path = save_uploaded_file(uploaded_file)
-            processor = MedicalReportProcessor(username=st.session_state.get("username"))
-            ctx = st.session_state.get("patient_context", {})
-            report_id = processor.process_report(temp_path, name=ctx.get("name", ""), age=ctx.get("age", 0), gender=ctx.get("gender", ""))
-            os.unlink(temp_path)
+            upload = upload_report(uploaded_file, username, st.session_state.get("patient_context", {}))
+            job = wait_for_ingestion(upload["content_hash"], username) if upload else None
+        if job and job.get("status") == "complete":
+            report_id = job["report_id"]
 
         if report_id:
             st.session_state.pop(f"analysis_{report_id}", None)
             st.session_state.pop(f"messages_{report_id}", None)
+            st.session_state.pop("failed_upload_hash", None)
             st.session_state.current_report_id = report_id
             st.success(f"✅ Report processed! Report ID: `{report_id}`")
             st.rerun()
-        else:
-            st.error("❌ Failed to process the report. Try uploading a clearer scan.")
+        elif upload:
+            # Extracted text and parsed JSON are kept, so a retry resumes from the failed stage
+            st.session_state.failed_upload_hash = upload["content_hash"]
+
+    failed_hash = st.session_state.get("failed_upload_hash")
+    if failed_hash:
+        st.error("❌ Failed to process the report. You can retry without uploading it again.")
+        if st.button("🔁 Retry processing", key="retry_ingestion"):
+            with st.spinner("\U0001F50D Retrying the blood report..."):
+                report_id = retry_ingestion(failed_hash, st.session_state.get("username"))
+            if report_id:
+                st.session_state.pop("failed_upload_hash", None)
+                st.session_state.current_report_id = report_id
+                st.rerun()
 
     report_id = st.session_state.get("current_report_id")
     if report_id:
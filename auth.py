@@ -1,22 +1,13 @@
 import streamlit as st
 import bcrypt
 import re
-from pymongo import MongoClient
 from datetime import datetime
-import os
-from dotenv import load_dotenv
-from database import delete_report_and_related_data  # Make sure this is at the top
+from database import collection, delete_report_and_related_data, list_user_reports, user_reports_key  # Make sure this is at the top
+from chatbot import invalidate_prompt_prefix
 
 
-# --- Load Environment Variables ---
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-
-# --- MongoDB Connection ---
-client = MongoClient(MONGO_URI)
-db = client["mediway"]
-users_col = db["users"]
-patients_col = db["patients"]
+# --- MongoDB Collections (connected on first use) ---
+users_col = collection("users")
 
 # --- Validators ---
 def validate_email(email: str) -> bool:
@@ -125,6 +116,14 @@ def signup_page():
 
 # --- Report Viewer (My Reports) ---
 
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_user_reports(username: str, reports_key: str):
+    # reports_key is read from the database on every run, so uploads and deletions
+    # from any session or the API miss the cache
+    return list_user_reports(username)
+
+# Reruns on its own for search input and paging; opening or deleting a report reruns the app
+@st.fragment
 def show_my_reports():
     st.markdown("## 📄 My Uploaded Reports")
 
@@ -133,7 +132,17 @@ def show_my_reports():
         st.warning("⚠️ Please login to view your uploaded reports.")
         return
 
-    reports = list(patients_col.find({"username": username}).sort("reported_date", -1))
+    col_query, col_abnormal = st.columns([3, 1])
+    with col_query:
+        query = st.text_input("🔎 Search by test name", key="report_search_query",
+                              placeholder="e.g. TSH, vitamin D, cholesterol")
+    with col_abnormal:
+        abnormal_only = st.checkbox("Abnormal only", key="report_search_abnormal")
+    if query.strip() or abnormal_only:
+        show_report_search(username, query.strip(), abnormal_only)
+        return
+
+    reports = cached_user_reports(username, user_reports_key(username))
 
     if not reports:
         st.info("📝 You haven’t uploaded any reports yet.")
@@ -158,6 +167,7 @@ def show_my_reports():
             with col2:
                 if st.button("🗑️ Delete", key=f"delete_{report_id}"):
                     success = delete_report_and_related_data(report_id)
+                    invalidate_prompt_prefix(report_id)
 
                     # Clean session state
                     st.session_state.pop(f"analysis_{report_id}", None)
@@ -171,3 +181,48 @@ def show_my_reports():
                     else:
                         st.error(f"❌ Failed to delete report `{report_id}`.")
                     st.rerun()
+
+
+def show_report_search(username: str, query: str, abnormal_only: bool):
+    from utils import search_reports
+
+    # A new search starts again from the first page
+    if st.session_state.get("report_search_key") != (query, abnormal_only):
+        st.session_state.report_search_key = (query, abnormal_only)
+        st.session_state.report_search_page = 1
+    page = st.session_state.report_search_page
+    result = search_reports(username, q=query, abnormal_only=abnormal_only, page=page, page_size=10)
+    if not result:
+        return
+    if not result["results"]:
+        st.info("No reports match your search.")
+        return
+
+    st.caption(f"{result['total']} matching report(s)")
+    for report in result["results"]:
+        report_id = report["report_id"]
+        findings = ", ".join(
+            f"{m['test_name']} {m['result']} {m.get('unit') or ''}{' (' + m['flag'] + ')' if m.get('flag') and m['flag'] != 'N' else ''}".strip()
+            for m in report["matches"]
+        )
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{report.get('name') or 'Unknown'}** | {report.get('reported_date') or 'Date N/A'}  \n{findings}")
+        with col2:
+            if st.button("📊 View", key=f"search_view_{report_id}"):
+                st.session_state.current_report_id = report_id
+                st.session_state.page = "dashboard"
+                st.rerun()
+
+    if result["pages"] > 1:
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("◀ Previous", disabled=page <= 1, key="report_search_prev"):
+                st.session_state.report_search_page = page - 1
+                st.rerun(scope="fragment")
+        with col_page:
+            st.caption(f"Page {page} of {result['pages']}")
+        with col_next:
+            if st.button("Next ▶", disabled=page >= result["pages"], key="report_search_next"):
+                st.session_state.report_search_page = page + 1
+                st.rerun(scope="fragment")
@@ -1,19 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, Optional, List
-from pymongo import MongoClient
-from chatbot import analyze_report
-import os
+from datetime import date, datetime, timedelta
+from collections import defaultdict
+from functools import lru_cache
+from contextlib import contextmanager
+from chatbot import (INITIAL_ANALYSIS_RETRY_AFTER, analyze_report, context_hash, generate_initial_analysis,
+                     initial_analysis_state, is_error_reply)
+from database import NOT_DELETED, collection, clear_conversation_history, deleted_report_ids, update_conversation_history
+from analytes import canonical_test_name
+from admission import AdmissionRejected, admission, request_user
+from usage import QuotaExceeded, check_quota, usage_summary
+from ingestion import MAX_UPLOAD_BYTES, STAGE_STORED, PDFUploadReceiver, UploadRejected, check_page_count
+from profiling import PROFILING_ENABLED, profile, stage
+import json
+import hashlib
+import time
+import re
 
 # ------------------------- MongoDB Setup -------------------------
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-client = MongoClient(MONGO_URI)
-db = client["mediway"]
+# Collections resolve the shared client on first use; nothing connects at import time
+patients_collection = collection("patients")
+tests_collection = collection("tests")
+conversations_collection = collection("conversations")
+unmatched_analytes_collection = collection("unmatched_analytes")
+ingestion_jobs_collection = collection("ingestion_jobs")
+population_stats_collection = collection("population_stats")
 
-patients_collection = db["patients"]
-tests_collection = db["tests"]
-conversations_collection = db["conversations"]
+@lru_cache(maxsize=None)
+def get_semantic_cache():
+    # numpy and the embedding model are only loaded once /chat is used
+    from semantic_cache import SemanticCache
+    return SemanticCache(collection("semantic_cache"))
 
 # ------------------------- FastAPI App Setup -------------------------
 app = FastAPI(
@@ -31,6 +54,33 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+# Compress larger payloads (full reports, trends) when the client accepts gzip
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+@app.on_event("startup")
+def start_background_workers():
+    # Removes the data of deleted reports; PURGE_INTERVAL_SECONDS=0 leaves it to `python purge.py`
+    from purge import start_purge_worker
+    start_purge_worker()
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    # Opt-in per request with an X-Profile header when PROFILING_ENABLED=1; otherwise one header check
+    if not (PROFILING_ENABLED and request.headers.get("x-profile")):
+        return await call_next(request)
+
+    name = re.sub(r"[^A-Za-z0-9]+", "_", f"{request.method}{request.url.path}").strip("_")
+    # Route code runs in the threadpool, so the event loop thread itself is not sampled
+    with profile(name, sample_caller=False) as current:
+        response = await call_next(request)
+    response.headers["X-Profile-Id"] = current.profile_id
+    return response
+
+# Clients may keep report responses but must revalidate them with If-None-Match
+REPORT_CACHE_CONTROL = "private, no-cache"
+
+MAX_BATCH_REPORTS = 100
+
 # ------------------------- Request Models -------------------------
 class PatientContext(BaseModel):
     patient_context: Dict[str, Any]
@@ -39,14 +89,35 @@ class UserMessage(BaseModel):
     message: str
     patient_context: Optional[Dict[str, Any]] = None
 
+class ReportBatch(BaseModel):
+    report_ids: List[str]
+    abnormal_only: bool = False
+    flag: Optional[str] = None
+
 # ------------------------- Utility Functions -------------------------
-def fetch_patient_data(report_id: str) -> Optional[Dict[str, Any]]:
-    patient = patients_collection.find_one({"report_id": report_id})
+def build_test_filter(abnormal_only: bool = False, flag: Optional[str] = None) -> Dict[str, Any]:
+    from lab_values import ABNORMAL_FLAGS
+
+    if flag:
+        return {"flag": flag}
+    if abnormal_only:
+        return {"flag": {"$in": ABNORMAL_FLAGS}}
+    return {}
+
+def fetch_patient_data(report_id: str, abnormal_only: bool = False, flag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    with stage("mongo"):
+        patient = patients_collection.find_one({"report_id": report_id, **NOT_DELETED})
     if not patient:
         return None
+    return fetch_report_tests(patient, abnormal_only, flag)
 
-    tests = list(tests_collection.find({"report_id": report_id}))
+def fetch_report_tests(patient: Dict[str, Any], abnormal_only: bool = False, flag: Optional[str] = None) -> Dict[str, Any]:
+    test_filter = {"report_id": patient["report_id"], **build_test_filter(abnormal_only, flag)}
+    with stage("mongo"):
+        tests = list(tests_collection.find(test_filter))
+    return format_report(patient, tests)
 
+def format_report(patient: Dict[str, Any], tests: List[Dict[str, Any]]) -> Dict[str, Any]:
     return {
         "Patient Details": {
             "Name": patient.get("name"),
@@ -60,13 +131,78 @@ def fetch_patient_data(report_id: str) -> Optional[Dict[str, Any]]:
                 "Name": test.get("test_name"),
                 "Value": test.get("result"),
                 "Unit": test.get("unit"),
-                "Reference Interval": test.get("reference_interval")
+                "Reference Interval": test.get("reference_interval"),
+                "Flag": test.get("flag")
             } for test in tests
         ]
     }
 
-def clear_conversation_history(report_id: str):
-    conversations_collection.delete_many({"report_id": report_id})
+def fetch_reports_batch(report_ids: List[str], abnormal_only: bool = False, flag: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Two $in queries for the whole batch, grouped in memory and returned in request order
+    unique_ids = list(dict.fromkeys(report_ids))
+    patients = {p["report_id"]: p for p in patients_collection.find({"report_id": {"$in": unique_ids}, **NOT_DELETED})}
+
+    tests_by_report: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    if patients:
+        test_filter = {"report_id": {"$in": list(patients)}, **build_test_filter(abnormal_only, flag)}
+        for test in tests_collection.find(test_filter):
+            tests_by_report[test["report_id"]].append(test)
+
+    return [
+        {"report_id": report_id, "found": True, "report": format_report(patients[report_id], tests_by_report[report_id])}
+        if report_id in patients else
+        {"report_id": report_id, "found": False}
+        for report_id in report_ids
+    ]
+
+@contextmanager
+def llm_slot(request: Request):
+    # Token buckets and the fair queue in front of every LLM call; overload is
+    # answered at once with 429 instead of tying up worker threads
+    user = request_user(request.headers, request.client.host if request.client else None)
+    try:
+        admission.admit(user)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"❌ Too many requests ({e.reason}). Please try again shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        admission.release(time.perf_counter() - start)
+
+def quota_user(request: Request) -> str:
+    # Checked before the LLM call so an exhausted quota costs no tokens; the same
+    # identity is passed on to analyze_report for the usage records
+    user = request_user(request.headers, request.client.host if request.client else None)
+    try:
+        check_quota(user)
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"❌ Daily AI usage limit reached ({e.used}/{e.limit} tokens). It resets at midnight UTC.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return user
+
+def exclude_deleted(username: str) -> Dict[str, Any]:
+    # Tests of deleted reports remain until the background purge has run
+    deleted = deleted_report_ids(username)
+    return {"report_id": {"$nin": deleted}} if deleted else {}
+
+def report_etag(patient: Dict[str, Any], *variant: Any) -> str:
+    # Strong validator: changes whenever the stored report version or the requested view changes
+    key = ":".join(str(part) for part in (patient["report_id"], patient.get("version", 1), *variant))
+    return '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
 
 # ------------------------- API Routes -------------------------
 
@@ -78,52 +214,277 @@ def home():
     }
 
 @app.get("/report/{report_id}", tags=["Report"])
-def get_report(report_id: str):
-    data = fetch_patient_data(report_id)
-    if not data:
+def get_report(report_id: str, request: Request, abnormal_only: bool = False, flag: Optional[str] = None):
+    patient = patients_collection.find_one({"report_id": report_id, **NOT_DELETED})
+    if not patient:
         raise HTTPException(status_code=404, detail="❌ Report not found.")
-    return data
 
-@app.get("/analyze/{report_id}", tags=["Analysis"])
-def get_initial_analysis(report_id: str):
-    data = fetch_patient_data(report_id)
-    if not data:
-        raise HTTPException(status_code=404, detail="❌ Report not found.")
+    # Validate before loading the tests so a revalidation costs one indexed lookup
+    etag = report_etag(patient, abnormal_only, flag)
+    headers = {"ETag": etag, "Cache-Control": REPORT_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data = fetch_report_tests(patient, abnormal_only=abnormal_only, flag=flag)
+    return JSONResponse(content=jsonable_encoder(data), headers=headers)
 
-    analysis = analyze_report(report_id)
+@app.post("/reports/batch", tags=["Report"])
+def get_reports_batch(payload: ReportBatch):
+    if len(payload.report_ids) > MAX_BATCH_REPORTS:
+        raise HTTPException(status_code=400, detail=f"❌ At most {MAX_BATCH_REPORTS} reports per batch.")
     return {
-        "report_id": report_id,
-        "analysis": analysis
+        "reports": fetch_reports_batch(payload.report_ids, abnormal_only=payload.abnormal_only, flag=payload.flag)
     }
 
-@app.post("/analyze/{report_id}", tags=["Analysis"])
-def analyze_with_context(report_id: str, payload: PatientContext):
-    data = fetch_patient_data(report_id)
-    if not data:
-        raise HTTPException(status_code=404, detail="❌ Report not found.")
+@app.get("/users/{username}/tests", tags=["Report"])
+def get_user_tests(username: str, test_name: Optional[str] = None, abnormal_only: bool = False, flag: Optional[str] = None):
+    test_filter = {"username": username, **build_test_filter(abnormal_only, flag), **exclude_deleted(username)}
+    if test_name:
+        test_filter["test_name"] = test_name
 
-    analysis = analyze_report(report_id, patient_context=payload.patient_context)
+    tests = tests_collection.find(test_filter, {"_id": 0})
     return {
-        "report_id": report_id,
-        "analysis": analysis
+        "username": username,
+        "tests": list(tests)
+    }
+
+@app.get("/users/{username}/trends", tags=["Report"])
+def get_user_trends(username: str, analyte: Optional[str] = None):
+    trend_filter = {"username": username, **exclude_deleted(username)}
+    if analyte:
+        trend_filter["canonical_name"] = canonical_test_name(analyte)
+
+    # Served from the (username, canonical_name, collected_at) index
+    tests = tests_collection.find(
+        trend_filter,
+        {"_id": 0, "report_id": 1, "canonical_name": 1, "test_name": 1, "unit": 1,
+         "collected_at": 1, "result_value": 1, "flag": 1}
+    ).sort([("canonical_name", 1), ("collected_at", 1)])
+
+    from lab_values import compute_trends
+
+    return {
+        "username": username,
+        "trends": compute_trends(list(tests))
     }
 
+SEARCH_MAX_PAGE_SIZE = 100
+# Matching tests returned per report in search results
+SEARCH_MATCHES_PER_REPORT = 10
+
+def build_search_filter(username: str, q: Optional[str], analyte: Optional[str], flag: Optional[str],
+                        abnormal_only: bool, start: Optional[date], end: Optional[date]) -> Dict[str, Any]:
+    from analytes import analyte_matcher
+
+    search_filter: Dict[str, Any] = {"username": username, **build_test_filter(abnormal_only, flag), **exclude_deleted(username)}
+    if analyte:
+        search_filter["canonical_name"] = canonical_test_name(analyte)
+    if q:
+        # Exact analyte names and aliases ("TSH", "vit D3") use the compound indexes; anything
+        # else ("cholesterol", "liver") is a text search, which also finds every analyte containing it
+        matched = analyte_matcher.match_exact(q, specific=True)
+        if matched and not analyte:
+            search_filter["canonical_name"] = matched
+        else:
+            # Quotes would end the phrase early and let the rest through as loose terms
+            terms = " ".join(q.replace('"', " ").split())
+            if terms:
+                search_filter["$text"] = {"$search": f'"{terms}"' if " " in terms else terms}
+    if start or end:
+        search_filter["collected_at"] = {}
+        if start:
+            search_filter["collected_at"]["$gte"] = datetime.combine(start, datetime.min.time())
+        if end:
+            search_filter["collected_at"]["$lt"] = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    return search_filter
+
+@app.get("/users/{username}/search", tags=["Report"])
+def search_user_reports(username: str, q: Optional[str] = None, analyte: Optional[str] = None,
+                        flag: Optional[str] = None, abnormal_only: bool = False,
+                        start: Optional[date] = None, end: Optional[date] = None,
+                        page: int = 1, page_size: int = 20):
+    """
+    Reports of a user with tests matching all given filters, newest first. One
+    aggregation: indexed match on tests, grouped per report, paginated with the
+    total count, and joined to the report summary.
+    """
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), SEARCH_MAX_PAGE_SIZE)
+    search_filter = build_search_filter(username, q, analyte, flag, abnormal_only, start, end)
+
+    pipeline = [
+        {"$match": search_filter},
+        {"$group": {
+            "_id": "$report_id",
+            "collected_at": {"$first": "$collected_at"},
+            "match_count": {"$sum": 1},
+            "matches": {"$push": {"test_name": "$test_name", "canonical_name": "$canonical_name",
+                                  "result": "$result", "unit": "$unit", "flag": "$flag"}}
+        }},
+        {"$sort": {"collected_at": -1, "_id": 1}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "results": [
+                {"$skip": (page - 1) * page_size},
+                {"$limit": page_size},
+                {"$lookup": {"from": "patients", "localField": "_id", "foreignField": "report_id", "as": "patient"}},
+                {"$project": {
+                    "_id": 0,
+                    "report_id": "$_id",
+                    "collected_at": 1,
+                    "match_count": 1,
+                    "matches": {"$slice": ["$matches", SEARCH_MATCHES_PER_REPORT]},
+                    "name": {"$arrayElemAt": ["$patient.name", 0]},
+                    "collected_date": {"$arrayElemAt": ["$patient.collected_date", 0]},
+                    "reported_date": {"$arrayElemAt": ["$patient.reported_date", 0]}
+                }}
+            ]
+        }}
+    ]
+    with stage("mongo"):
+        facets = next(tests_collection.aggregate(pipeline), {"total": [], "results": []})
+
+    total = facets["total"][0]["count"] if facets["total"] else 0
+    return {
+        "username": username,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "pages": (total + page_size - 1) // page_size,
+        "results": facets["results"]
+    }
+
+@app.get("/users/{username}/export", tags=["Report"])
+def export_user_tests(username: str, format: str = "csv", start: Optional[date] = None, end: Optional[date] = None):
+    # pyarrow is only loaded for exports
+    from export import EXPORT_FORMATS, MEDIA_TYPES, export_filter, stream_export
+
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"❌ Format must be one of: {', '.join(EXPORT_FORMATS)}.")
+
+    query = export_filter(
+        username,
+        datetime.combine(start, datetime.min.time()) if start else None,
+        datetime.combine(end, datetime.min.time()) if end else None
+    )
+    return StreamingResponse(
+        stream_export(query, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{username}_tests.{format}"'}
+    )
+
+@app.get("/stats/{analyte}", tags=["Analytes"])
+def get_population_stats(analyte: str, age: Optional[str] = None, gender: Optional[str] = None,
+                         unit: Optional[str] = None, value: Optional[float] = None):
+    from analytes import analyte_matcher
+    from population_stats import age_band, normalize_gender, stats_key, summarize
+
+    canonical = canonical_test_name(analyte)
+    key = stats_key(canonical, unit or analyte_matcher.default_unit(canonical), age_band(age), normalize_gender(gender))
+    # Single primary-key lookup on the materialized statistics
+    doc = population_stats_collection.find_one({"_id": key})
+    if not doc or doc.get("count", 0) <= 0:
+        raise HTTPException(status_code=404, detail="❌ No statistics for this analyte and group.")
+    return summarize(doc, value)
+
+@app.get("/analytes/unmatched", tags=["Analytes"])
+def get_unmatched_analytes(limit: int = 100):
+    # Test names the canonical registry could not match, most frequent first, for curation
+    names = unmatched_analytes_collection.find({}).sort("count", -1).limit(limit)
+    return {
+        "unmatched": [
+            {"name": doc["_id"], "count": doc.get("count", 0), "example": doc.get("example"),
+             "last_seen": doc.get("last_seen")}
+            for doc in names
+        ]
+    }
+
+def initial_analysis(report_id: str, patient_context: Optional[Dict[str, Any]], request: Request) -> Dict[str, Any]:
+    if not patients_collection.find_one({"report_id": report_id, **NOT_DELETED}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="❌ Report not found.")
+
+    # Usually generated during ingestion; only a changed patient context needs the LLM here
+    analysis, running = initial_analysis_state(report_id, patient_context)
+    if analysis:
+        return {"report_id": report_id, "analysis": analysis, "cached": True}
+    if running:
+        # Polled by the client instead of holding a worker thread until it is done
+        return JSONResponse(
+            status_code=202,
+            content={"report_id": report_id, "status": "pending"},
+            headers={"Retry-After": str(INITIAL_ANALYSIS_RETRY_AFTER)}
+        )
+
+    # Quota first, so a user over quota does not use up an admission token
+    user = quota_user(request)
+    with llm_slot(request):
+        analysis = generate_initial_analysis(report_id, patient_context, username=user, quota_checked=True)
+    return {"report_id": report_id, "analysis": analysis, "cached": False}
+
+@app.get("/analyze/{report_id}", tags=["Analysis"])
+def get_initial_analysis(report_id: str, request: Request):
+    return initial_analysis(report_id, None, request)
+
+@app.post("/analyze/{report_id}", tags=["Analysis"])
+def analyze_with_context(report_id: str, payload: PatientContext, request: Request):
+    return initial_analysis(report_id, payload.patient_context, request)
+
 @app.post("/chat/{report_id}", tags=["Chat"])
-def chat(report_id: str, payload: UserMessage):
-    data = fetch_patient_data(report_id)
-    if not data:
+def chat(report_id: str, payload: UserMessage, request: Request):
+    patient = patients_collection.find_one({"report_id": report_id, **NOT_DELETED}, {"version": 1})
+    if not patient:
         raise HTTPException(status_code=404, detail="❌ Report not found.")
 
-    response = analyze_report(
-        report_id,
-        custom_prompt=payload.message,
-        patient_context=payload.patient_context
-    )
+    # Answers are only reused for the same report version and patient context;
+    # follow-up questions that depend on the conversation bypass the cache
+    scope = f"{patient.get('version', 1)}:{context_hash(payload.patient_context)}"
+    semantic_cache = get_semantic_cache()
+    with stage("semantic_cache"):
+        cached, embedding = semantic_cache.lookup(report_id, scope, payload.message)
+    if cached:
+        update_conversation_history(report_id, payload.message, cached)
+        return {
+            "report_id": report_id,
+            "response": cached,
+            "cached": True
+        }
+
+    # Cached answers are free; quota and admission only guard calls that reach the
+    # LLM, and the quota is checked once, before an admission token is taken
+    user = quota_user(request)
+    start = time.perf_counter()
+    with llm_slot(request):
+        response = analyze_report(
+            report_id,
+            custom_prompt=payload.message,
+            patient_context=payload.patient_context,
+            username=user,
+            endpoint="chat",
+            report_version=patient.get("version", 1),
+            quota_checked=True
+        )
+    if not is_error_reply(response):
+        latency_ms = (time.perf_counter() - start) * 1000
+        semantic_cache.store(report_id, scope, payload.message, response, latency_ms, embedding)
     return {
         "report_id": report_id,
-        "response": response
+        "response": response,
+        "cached": False
     }
 
+@app.get("/users/{username}/usage", tags=["Status"])
+def get_user_usage(username: str, days: int = 7):
+    # Daily token rollups per endpoint and model, plus today's quota status
+    return usage_summary(username, days=min(max(days, 1), 90))
+
+@app.get("/metrics/semantic-cache", tags=["Status"])
+def semantic_cache_metrics():
+    return get_semantic_cache().metrics()
+
+@app.get("/metrics/admission", tags=["Status"])
+def admission_metrics():
+    return admission.metrics()
+
 @app.delete("/chat/{report_id}", tags=["Chat"])
 def reset_chat(report_id: str):
     clear_conversation_history(report_id)
@@ -131,3 +492,101 @@ def reset_chat(report_id: str):
         "report_id": report_id,
         "status": "🗑️ Conversation history cleared."
     }
+
+def register_upload(username: str, upload: Dict[str, Any]):
+    # Imported here so the OCR stack is only loaded when a report is uploaded
+    from preprocessing import MedicalReportProcessor
+
+    pages = check_page_count(upload["path"])
+    fields = upload["fields"]
+    try:
+        age = int(float(fields.get("age") or 0))
+    except ValueError:
+        raise UploadRejected(400, "Age must be a number.")
+    try:
+        patient_context = json.loads(fields.get("patient_context") or "{}")
+    except ValueError:
+        patient_context = None
+    if not isinstance(patient_context, dict):
+        raise UploadRejected(400, "patient_context must be a JSON object.")
+    processor = MedicalReportProcessor(username=username)
+    # Same metadata as MedicalReportProcessor._process_report, so the initial
+    # analysis is generated with the uploader's context
+    job = processor.ingestions.save_upload(
+        upload["path"], username,
+        {"name": fields.get("name", ""), "age": age, "gender": fields.get("gender", ""),
+         "patient_context": patient_context},
+        content_hash=upload["content_hash"], move=True
+    )
+    return processor, job, pages
+
+@app.post("/upload", tags=["Ingestion"], status_code=202)
+async def upload_report(request: Request, background_tasks: BackgroundTasks, username: str):
+    """
+    Multipart upload of one PDF ("file" field, optional name/age/gender fields and
+    a patient_context field holding a JSON object).
+    The body is streamed to disk; processing continues in the background and is
+    followed with GET /ingestions/{content_hash}.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"❌ File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+
+    receiver = None
+    try:
+        receiver = PDFUploadReceiver(request.headers.get("content-type", ""))
+        # Parsing, hashing and disk writes run in the threadpool so a large upload
+        # never blocks the event loop
+        async for chunk in request.stream():
+            await run_in_threadpool(receiver.feed, chunk)
+        upload = await run_in_threadpool(receiver.finish)
+        processor, job, pages = await run_in_threadpool(register_upload, username, upload)
+    except UploadRejected as e:
+        if receiver:
+            receiver.discard()
+        raise HTTPException(status_code=e.status_code, detail=f"❌ {e.reason}")
+    except Exception:
+        # Client disconnects and storage errors must not leave partial files behind
+        if receiver:
+            receiver.discard()
+        raise
+
+    if job["stage"] != STAGE_STORED:
+        background_tasks.add_task(processor.run_ingestion, job)
+    return {
+        "content_hash": job["content_hash"],
+        "report_id": job["report_id"],
+        "stage": job["stage"],
+        "status": job["status"],
+        "bytes": upload["bytes"],
+        "pages": pages
+    }
+
+@app.get("/ingestions/{content_hash}", tags=["Ingestion"])
+def get_ingestion(content_hash: str, username: str):
+    job = ingestion_jobs_collection.find_one(
+        {"username": username, "content_hash": content_hash},
+        {"_id": 0, "page_text": 0, "parsed_data": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="❌ Ingestion not found.")
+    return job
+
+@app.post("/ingestions/{content_hash}/retry", tags=["Ingestion"])
+def retry_ingestion(content_hash: str, username: str):
+    # Imported here so the OCR stack is only loaded when a retry is requested
+    from preprocessing import MedicalReportProcessor
+
+    processor = MedicalReportProcessor(username=username)
+    report_id = processor.retry_ingestion(content_hash)
+    job = ingestion_jobs_collection.find_one(
+        {"username": username, "content_hash": content_hash},
+        {"_id": 0, "stage": 1, "status": 1, "error": 1, "attempts": 1}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="❌ Ingestion not found.")
+    return {
+        "content_hash": content_hash,
+        "report_id": report_id,
+        **job
+    }
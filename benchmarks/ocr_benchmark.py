@@ -0,0 +1,111 @@
+"""
+OCR benchmark: rasterization + Tesseract time and extraction accuracy,
+comparing the original fixed 300 DPI colour render with the preprocessing stage.
+
+Fixture layout (one set per report):
+    <fixtures>/report1.pdf
+    <fixtures>/report1.json   expected parse in the LLM format ({"Tests": [{"Name", "Result"}, ...]})
+    <fixtures>/report1.txt    or: ground-truth text of the first page
+
+Usage:
+    python benchmarks/ocr_benchmark.py --fixtures benchmarks/fixtures/reports
+"""
+
+import argparse
+import difflib
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+import pytesseract
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytes import normalize_name
+from ocr_preprocessing import OCRPreprocessingConfig, rasterize_page
+
+VARIANTS = {
+    "baseline (300 DPI, colour)": OCRPreprocessingConfig.disabled(),
+    "grayscale + binarize": OCRPreprocessingConfig(adaptive_dpi=False, crop_to_table=False),
+    "adaptive DPI": OCRPreprocessingConfig(crop_to_table=False),
+    "adaptive DPI + crop": OCRPreprocessingConfig(),
+}
+
+
+def score_against_tests(text, expected):
+    """Fraction of expected tests whose name and result both appear in the OCR text."""
+    tests = expected.get("Tests", [])
+    if not tests:
+        return None
+    haystack = normalize_name(text)
+    found = sum(
+        1 for test in tests
+        if normalize_name(test.get("Name")) in haystack and normalize_name(str(test.get("Result", ""))) in haystack
+    )
+    return found / len(tests)
+
+
+def score_accuracy(text, pdf_path):
+    stem = os.path.splitext(pdf_path)[0]
+    if os.path.exists(stem + ".json"):
+        with open(stem + ".json") as f:
+            return score_against_tests(text, json.load(f))
+    if os.path.exists(stem + ".txt"):
+        with open(stem + ".txt") as f:
+            return difflib.SequenceMatcher(None, normalize_name(f.read()), normalize_name(text)).ratio()
+    return None
+
+
+def run_variant(pdf_path, config):
+    start = time.perf_counter()
+    image = rasterize_page(pdf_path, page=1, config=config)
+    rasterized = time.perf_counter()
+    text = pytesseract.image_to_string(image)
+    finished = time.perf_counter()
+    return {
+        "rasterize_s": rasterized - start,
+        "ocr_s": finished - rasterized,
+        "total_s": finished - start,
+        "pixels": image.width * image.height,
+        "accuracy": score_accuracy(text, pdf_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(__file__), "fixtures", "reports"))
+    parser.add_argument("--output", help="Optional JSON file for the per-report results")
+    args = parser.parse_args()
+
+    pdfs = sorted(glob.glob(os.path.join(args.fixtures, "*.pdf")))
+    if not pdfs:
+        print(f"No PDFs found in {args.fixtures}")
+        return
+
+    results = []
+    for pdf_path in pdfs:
+        for name, config in VARIANTS.items():
+            result = run_variant(pdf_path, config)
+            result.update({"report": os.path.basename(pdf_path), "variant": name})
+            results.append(result)
+            print(f"{result['report']:<30} {name:<28} {result['total_s']:6.2f}s  accuracy={result['accuracy']}")
+
+    print()
+    print(f"{'Variant':<28} {'Mean time (s)':>14} {'Mean OCR (s)':>13} {'Mean accuracy':>14}")
+    for name in VARIANTS:
+        rows = [r for r in results if r["variant"] == name]
+        accuracies = [r["accuracy"] for r in rows if r["accuracy"] is not None]
+        mean_accuracy = f"{statistics.mean(accuracies):.3f}" if accuracies else "n/a"
+        print(f"{name:<28} {statistics.mean(r['total_s'] for r in rows):>14.2f} "
+              f"{statistics.mean(r['ocr_s'] for r in rows):>13.2f} {mean_accuracy:>14}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
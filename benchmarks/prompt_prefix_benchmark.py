@@ -0,0 +1,97 @@
+"""
+Prompt prefix benchmark: per-turn prompt construction CPU time and, with --live,
+upstream time-to-first-token, with the prefix cache on and off.
+
+Usage:
+    python benchmarks/prompt_prefix_benchmark.py --report-id <id> --turns 20 [--live]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot
+from database import get_conversation_history
+
+QUESTIONS = [
+    "Is my cholesterol high?",
+    "What does my hemoglobin result mean?",
+    "Should I be worried about anything in this report?",
+    "What lifestyle changes would help?",
+]
+
+
+def build_turn(report_id, patient_context, question):
+    cpu_start = time.process_time()
+    prefix_messages, first_name = chatbot.get_prompt_prefix(report_id, patient_context)
+    history = get_conversation_history(report_id)
+    messages = chatbot.build_messages(prefix_messages, first_name, history, question)
+    return messages, (time.process_time() - cpu_start) * 1000
+
+
+def time_to_first_token(messages):
+    """Stream a completion and return seconds until the first content delta arrives."""
+    start = time.perf_counter()
+    with requests.post(
+        chatbot.GROQ_API_URL,
+        headers={"Authorization": f"Bearer {chatbot.GROQ_API_KEY}", "Content-Type": "application/json"},
+        json={"model": chatbot.CHAT_MODEL, "messages": messages, "max_tokens": 64, "stream": True},
+        stream=True,
+        timeout=60
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                continue
+            delta = json.loads(line[6:])["choices"][0]["delta"]
+            if delta.get("content"):
+                return time.perf_counter() - start
+    return None
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def run(report_id, turns, live, cached):
+    chatbot.PROMPT_PREFIX_CACHE = cached
+    chatbot._prefix_cache.clear()
+    patient_context = {"age": 45, "gender": "Female", "symptoms": ["fatigue"], "history": "None"}
+
+    cpu_ms, ttft = [], []
+    for turn in range(turns):
+        messages, elapsed = build_turn(report_id, patient_context, QUESTIONS[turn % len(QUESTIONS)])
+        cpu_ms.append(elapsed)
+        if live:
+            first_token = time_to_first_token(messages)
+            if first_token is not None:
+                ttft.append(first_token * 1000)
+    return cpu_ms, ttft
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--report-id", required=True)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="Also measure upstream time-to-first-token")
+    args = parser.parse_args()
+
+    print(f"{'Mode':<16} {'CPU p50 (ms)':>13} {'CPU p95 (ms)':>13} {'TTFT p50 (ms)':>14} {'TTFT p95 (ms)':>14}")
+    for label, cached in (("prefix cache", True), ("no cache", False)):
+        cpu_ms, ttft = run(args.report_id, args.turns, args.live, cached)
+        ttft_p50 = f"{statistics.median(ttft):.0f}" if ttft else "n/a"
+        ttft_p95 = f"{percentile(ttft, 0.95):.0f}" if ttft else "n/a"
+        print(f"{label:<16} {statistics.median(cpu_ms):>13.3f} {percentile(cpu_ms, 0.95):>13.3f} "
+              f"{ttft_p50:>14} {ttft_p95:>14}")
+
+
+if __name__ == "__main__":
+    main()
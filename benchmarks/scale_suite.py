@@ -0,0 +1,175 @@
+"""
+Scale regression suite for the data layer: grows a synthetic dataset through
+several sizes and, at each size, times the data-access functions used by the
+backend and the dashboard, checks their latency budgets and verifies with
+explain() that every query is served from an index.
+
+Needs a local MongoDB; the data goes to a separate database (default
+mediway_scale) and is reused between runs.
+
+Usage:
+    python benchmarks/scale_suite.py --scales 1000,10000,100000 [--samples 200]
+Exits non-zero when a budget, an index check or the growth limit fails.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class Case:
+    def __init__(self, name, run, collection, query, sort=None, budget_ms=20.0, sample="report"):
+        self.name = name
+        self.run = run                  # callable(sample id)
+        self.collection = collection    # explain() target
+        self.query = query              # callable(sample id) -> filter
+        self.sort = sort
+        self.budget_ms = budget_ms      # p95 budget
+        self.sample = sample            # "report" or "user"
+
+
+def build_cases():
+    # Imported after MONGO_URI / MONGO_DB_NAME point at the synthetic database
+    import backend
+    import database
+    from lab_values import ABNORMAL_FLAGS
+
+    def conversation_history(report_id):
+        database.conversation_cache.pop(report_id, None)
+        return database.get_conversation_history(report_id)
+
+    not_deleted = database.NOT_DELETED
+    return [
+        Case("fetch_patient_data", database.fetch_patient_data,
+             "patients", lambda r: {"report_id": r, **not_deleted}, budget_ms=15),
+        Case("report tests (abnormal only)", lambda r: backend.fetch_patient_data(r, abnormal_only=True),
+             "tests", lambda r: {"report_id": r, "flag": {"$in": ABNORMAL_FLAGS}}, budget_ms=15),
+        Case("list_user_reports (My Reports)", database.list_user_reports,
+             "patients", lambda u: {"username": u, **not_deleted}, sort=[("reported_date", -1)],
+             budget_ms=15, sample="user"),
+        Case("get_conversation_history", conversation_history,
+             "conversations", lambda r: {"report_id": r}, budget_ms=10),
+        Case("get_conversation_transcript", database.get_conversation_transcript,
+             "conversation_archive", lambda r: {"report_id": r}, sort=[("turn", 1), ("position", 1)], budget_ms=15),
+        Case("user tests (GET /users/{u}/tests)", lambda u: backend.get_user_tests(u, abnormal_only=True),
+             "tests", lambda u: {"username": u, "flag": {"$in": ABNORMAL_FLAGS}}, budget_ms=40, sample="user"),
+        Case("report search (abnormal only)", lambda u: backend.search_user_reports(u, abnormal_only=True),
+             "tests", lambda u: {"username": u, "flag": {"$in": ABNORMAL_FLAGS}}, budget_ms=40, sample="user"),
+        Case("user trends (GET /users/{u}/trends)", backend.get_user_trends,
+             "tests", lambda u: {"username": u}, sort=[("canonical_name", 1), ("collected_at", 1)],
+             budget_ms=80, sample="user"),
+    ]
+
+
+def plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+
+def check_index_usage(db, case, sample_id):
+    cursor = db[case.collection].find(case.query(sample_id))
+    if case.sort:
+        cursor = cursor.sort(case.sort)
+    explain = cursor.explain()
+    stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+    stats = explain.get("executionStats", {})
+    examined, returned = stats.get("totalDocsExamined", 0), stats.get("nReturned", 0)
+
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append("collection scan")
+    if "SORT" in stages:
+        problems.append("in-memory sort")
+    if examined > 2 * returned + 10:
+        problems.append(f"examined {examined} docs for {returned}")
+    return problems
+
+
+def measure(case, ids, samples):
+    timings = []
+    for sample_id in random.choices(ids, k=samples):
+        start = time.perf_counter()
+        case.run(sample_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(0.95 * (len(timings) - 1))]
+
+
+def sample_ids(db, samples):
+    reports = [doc["report_id"] for doc in db["patients"].aggregate([
+        {"$sample": {"size": samples}}, {"$project": {"report_id": 1}}])]
+    users = [doc["username"] for doc in db["users"].aggregate([
+        {"$sample": {"size": samples}}, {"$project": {"username": 1}}])]
+    return {"report": reports, "user": users}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="mediway_scale")
+    parser.add_argument("--scales", default="1000,10000,100000", help="Comma-separated user counts")
+    parser.add_argument("--samples", type=int, default=200, help="Timed calls per function and scale")
+    parser.add_argument("--max-growth", type=float, default=3.0,
+                        help="Largest allowed p95 ratio between the largest and smallest scale")
+    args = parser.parse_args()
+
+    if args.db_name == "mediway":
+        parser.error("refusing to run against the production database name 'mediway'")
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_DB_NAME"] = args.db_name
+
+    from pymongo import MongoClient
+    from synthetic_data import generate
+
+    db = MongoClient(args.mongo_uri)[args.db_name]
+    cases = build_cases()
+    random.seed(0)
+
+    failures, results = [], {case.name: [] for case in cases}
+    for scale in [int(s) for s in args.scales.split(",")]:
+        started = time.perf_counter()
+        generate(db, args.mongo_uri, scale)
+        print(f"\n== {scale} users, {db['tests'].estimated_document_count()} tests "
+              f"(loaded in {time.perf_counter() - started:.0f}s) ==")
+        ids = sample_ids(db, args.samples)
+        print(f"{'Function':<38} {'p50 ms':>8} {'p95 ms':>8} {'budget':>8}  index")
+
+        for case in cases:
+            if not ids[case.sample]:
+                continue
+            p50, p95 = measure(case, ids[case.sample], args.samples)
+            problems = check_index_usage(db, case, ids[case.sample][0])
+            results[case.name].append(p95)
+            status = "ok" if not problems else ", ".join(problems)
+            print(f"{case.name:<38} {p50:>8.2f} {p95:>8.2f} {case.budget_ms:>8.0f}  {status}")
+            if p95 > case.budget_ms:
+                failures.append(f"{case.name} at {scale} users: p95 {p95:.1f} ms > {case.budget_ms} ms")
+            for problem in problems:
+                failures.append(f"{case.name} at {scale} users: {problem}")
+
+    for name, p95s in results.items():
+        # Floored at 2 ms so timer noise on tiny datasets does not count as growth
+        if len(p95s) > 1 and p95s[-1] > args.max_growth * max(p95s[0], 2.0):
+            failures.append(f"{name}: p95 grew from {p95s[0]:.1f} to {p95s[-1]:.1f} ms across scales")
+
+    print()
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("All data-access functions within budget and index-backed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Startup benchmark: cold import time of the backend and frontend modules,
+measured with `python -X importtime`, checked against a regression budget.
+
+Each module is imported in a fresh interpreter with MONGO_URI pointing at an
+unreachable host, so the run also fails if an import needs a live database.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--repeat 5] [--top 10]
+Exits non-zero when a module's median import time exceeds its budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median cumulative import time budgets in milliseconds
+BUDGETS_MS = {
+    "backend": 1000,
+    "app": 2500,
+    "auth": 2500,
+}
+
+# Modules that must not be pulled in by importing the given module
+FORBIDDEN_IMPORTS = {
+    "backend": ["pandas", "pytesseract", "pdf2image", "sentence_transformers"],
+    "app": ["pandas", "pytesseract", "pdf2image"],
+    "auth": ["pandas", "pytesseract", "pdf2image"],
+}
+
+
+def import_profile(module):
+    """Run one cold import; return {imported module: (self_us, cumulative_us)}."""
+    env = dict(os.environ, MONGO_URI="mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Show the N slowest imports per module")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS_MS))
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        median_ms = statistics.median(run[module][1] for run in runs) / 1000
+        budget = BUDGETS_MS.get(module)
+        status = "ok" if budget is None or median_ms <= budget else "OVER BUDGET"
+        print(f"{module}: {median_ms:.0f} ms (budget {budget} ms) {status}")
+        if status != "ok":
+            failures.append(f"{module} took {median_ms:.0f} ms, budget {budget} ms")
+
+        leaked = [name for name in FORBIDDEN_IMPORTS.get(module, []) if name in runs[-1]]
+        if leaked:
+            failures.append(f"{module} eagerly imports {', '.join(leaked)}")
+
+        slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+        for name, (self_us, cumulative_us) in slowest:
+            print(f"    {self_us / 1000:8.1f} ms self  {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    if failures:
+        print("\n".join(["", "Startup regressions:"] + failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
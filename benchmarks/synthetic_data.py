@@ -0,0 +1,237 @@
+"""
+Synthetic data generator: bulk-loads users, patients, tests with realistic
+analyte panels and conversations into MongoDB for scale testing.
+
+Documents have the same shape as those written by preprocessing.py and
+database.py, and the production indexes are created first. Generation is
+incremental: users are numbered, so a larger --users continues where an
+earlier run stopped.
+
+Usage:
+    python benchmarks/synthetic_data.py --users 100000 --db-name mediway_scale
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import bcrypt
+import numpy as np
+from pymongo import ASCENDING, MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytes import ANALYTES
+from lab_values import compute_flags
+
+DEFAULT_DB_NAME = "mediway_scale"
+
+# canonical analyte -> (population mean, standard deviation, reference lower, reference upper)
+PROFILES = {
+    "hemoglobin": (13.8, 1.6, 12.0, 16.5), "hematocrit": (41, 4.5, 36, 48),
+    "rbc count": (4.8, 0.5, 4.2, 5.6), "wbc count": (7200, 2000, 4000, 11000),
+    "platelet count": (2.6, 0.7, 1.5, 4.1), "mcv": (88, 6, 80, 100), "mch": (29.5, 2.2, 27, 32),
+    "mchc": (33.5, 1.2, 32, 36), "rdw": (13.2, 1.1, 11.5, 14.5), "neutrophils": (58, 9, 40, 75),
+    "lymphocytes": (32, 8, 20, 45), "monocytes": (6, 2, 2, 10), "eosinophils": (3, 1.8, 1, 6),
+    "basophils": (0.6, 0.4, 0, 2), "esr": (12, 8, 0, 20),
+    "glucose fasting": (98, 22, 70, 100), "glucose postprandial": (128, 35, 70, 140),
+    "hba1c": (5.7, 0.9, 4.0, 5.6),
+    "total cholesterol": (188, 38, 0, 200), "hdl cholesterol": (48, 11, 40, 60),
+    "ldl cholesterol": (112, 32, 0, 100), "vldl cholesterol": (27, 10, 5, 40), "triglycerides": (145, 65, 0, 150),
+    "creatinine": (0.95, 0.25, 0.6, 1.3), "urea": (28, 9, 15, 40), "bun": (13, 4, 7, 20),
+    "uric acid": (5.4, 1.4, 3.5, 7.2), "egfr": (95, 20, 90, 200), "sodium": (139, 3, 135, 145),
+    "potassium": (4.3, 0.45, 3.5, 5.1), "chloride": (102, 3, 98, 107), "calcium": (9.4, 0.5, 8.6, 10.3),
+    "bilirubin total": (0.8, 0.4, 0.3, 1.2), "bilirubin direct": (0.2, 0.1, 0, 0.3),
+    "bilirubin indirect": (0.6, 0.3, 0.2, 0.8), "alt": (28, 16, 7, 56), "ast": (25, 11, 10, 40),
+    "alkaline phosphatase": (85, 28, 44, 147), "ggt": (30, 20, 9, 48), "total protein": (7.1, 0.5, 6.0, 8.3),
+    "albumin": (4.3, 0.4, 3.5, 5.2), "globulin": (2.8, 0.4, 2.0, 3.5),
+    "tsh": (2.3, 1.4, 0.4, 4.0), "t3": (120, 25, 80, 200), "t4": (8.2, 1.7, 5.1, 14.1),
+    "vitamin d": (24, 11, 30, 100), "vitamin b12": (380, 160, 200, 900), "ferritin": (110, 80, 20, 250),
+    "iron": (95, 35, 60, 170), "crp": (3, 4, 0, 5),
+}
+
+# Panels ordered together, with how often a report contains each
+PANELS = {
+    "cbc": (0.8, ["hemoglobin", "hematocrit", "rbc count", "wbc count", "platelet count", "mcv", "mch",
+                  "mchc", "rdw", "neutrophils", "lymphocytes", "monocytes", "eosinophils", "basophils"]),
+    "lipid": (0.45, ["total cholesterol", "hdl cholesterol", "ldl cholesterol", "vldl cholesterol", "triglycerides"]),
+    "liver": (0.35, ["bilirubin total", "bilirubin direct", "bilirubin indirect", "alt", "ast",
+                     "alkaline phosphatase", "ggt", "total protein", "albumin", "globulin"]),
+    "kidney": (0.35, ["creatinine", "urea", "bun", "uric acid", "egfr", "sodium", "potassium", "chloride", "calcium"]),
+    "diabetes": (0.4, ["glucose fasting", "glucose postprandial", "hba1c"]),
+    "thyroid": (0.3, ["tsh", "t3", "t4"]),
+    "vitamins": (0.25, ["vitamin d", "vitamin b12", "ferritin", "iron", "crp", "esr"]),
+}
+
+QUESTIONS = [
+    "Is my {name} level something to worry about?",
+    "What can I do to improve my {name}?",
+    "Why would {name} be out of range?",
+    "Should I see a doctor about my {name}?",
+]
+
+# Every synthetic user logs in with this password; hashed once, with few rounds, to keep loading fast
+PASSWORD_HASH = bcrypt.hashpw(b"Password123", bcrypt.gensalt(rounds=4))
+
+
+def ensure_indexes(db, mongo_uri):
+    """The indexes production code creates, on the synthetic database."""
+    from preprocessing import MedicalReportProcessor
+
+    # The processor creates the patients, tests and ingestion indexes on construction
+    MedicalReportProcessor("synthetic", mongo_uri=mongo_uri, db_name=db.name)
+    db["users"].create_index("username", unique=True)
+    db["conversations"].create_index("report_id", unique=True)
+    db["conversation_archive"].create_index([("report_id", ASCENDING), ("turn", ASCENDING), ("position", ASCENDING)])
+
+
+def existing_users(db):
+    return db["users"].estimated_document_count()
+
+
+class Generator:
+    def __init__(self, db, seed=0, reports_per_user=3.0, conversation_fraction=0.3, batch_size=10000):
+        self.db = db
+        self.rng = np.random.default_rng(seed)
+        self.reports_per_user = reports_per_user
+        self.conversation_fraction = conversation_fraction
+        self.batch_size = batch_size
+        self.aliases = {name: [name, *entry["aliases"]] for name, entry in ANALYTES.items()}
+        self.buffers = {"users": [], "patients": [], "tests": [], "conversations": [], "conversation_archive": []}
+        self.counts = dict.fromkeys(self.buffers, 0)
+
+    def flush(self, name, force=False):
+        buffer = self.buffers[name]
+        if buffer and (force or len(buffer) >= self.batch_size):
+            if name == "tests":
+                self._flag(buffer)
+            self.db[name].insert_many(buffer, ordered=False)
+            self.counts[name] += len(buffer)
+            self.buffers[name] = []
+
+    def add(self, name, doc):
+        self.buffers[name].append(doc)
+        self.flush(name)
+
+    @staticmethod
+    def _flag(tests):
+        # Flags are computed for the whole batch at once, as in lab_values.parse_tests
+        flags = compute_flags(
+            [t["result_value"] for t in tests], [t["ref_lower"] for t in tests], [t["ref_upper"] for t in tests]
+        )
+        for test, flag in zip(tests, flags):
+            test["flag"] = flag
+
+    def report_tests(self, report_id, username, collected_at):
+        analytes = [name for probability, names in PANELS.values() if self.rng.random() < probability for name in names]
+        if not analytes:
+            analytes = PANELS["cbc"][1]
+        for name in analytes:
+            mean, sd, lower, upper = PROFILES[name]
+            value = round(max(float(self.rng.normal(mean, sd)), 0.0), 2)
+            aliases = self.aliases[name]
+            yield {
+                "test_name": aliases[int(self.rng.integers(len(aliases)))].title(),
+                "result": str(value),
+                "unit": ANALYTES[name]["unit"],
+                "analyte_matched": True,
+                "canonical_name": name,
+                "reference_interval": f"{lower} - {upper}",
+                "result_value": value,
+                "ref_lower": float(lower),
+                "ref_upper": float(upper),
+                "report_id": report_id,
+                "username": username,
+                "collected_at": collected_at,
+            }
+
+    def conversation(self, report_id, analyte_names):
+        turns = int(self.rng.integers(1, 9))
+        history, archive = [], []
+        now = datetime.utcnow()
+        for turn in range(1, turns + 1):
+            name = analyte_names[int(self.rng.integers(len(analyte_names)))]
+            question = QUESTIONS[int(self.rng.integers(len(QUESTIONS)))].format(name=name)
+            entries = [{"role": "user", "content": question},
+                       {"role": "assistant", "content": f"Your {name} result is explained here in plain language. " * 6}]
+            history.extend(entries)
+            archive.extend({"report_id": report_id, "turn": turn, "position": i, "archived_at": now, **entry}
+                           for i, entry in enumerate(entries))
+        self.add("conversations", {"report_id": report_id, "conversation_data": history[-10:],
+                                   "version": turns, "last_updated": now})
+        for doc in archive:
+            self.add("conversation_archive", doc)
+
+    def user(self, index):
+        username = f"user{index:07d}"
+        self.add("users", {"username": username, "email": f"{username}@example.com", "password": PASSWORD_HASH,
+                           "reports": [], "created_at": datetime.utcnow()})
+
+        gender = "Male" if self.rng.random() < 0.5 else "Female"
+        age = int(self.rng.integers(18, 85))
+        for _ in range(int(self.rng.poisson(self.reports_per_user))):
+            report_id = str(uuid.uuid4())
+            collected_at = datetime(2021, 1, 1) + timedelta(days=int(self.rng.integers(0, 4 * 365)))
+            self.add("patients", {
+                "report_id": report_id, "username": username, "name": f"Patient {index}", "age": age,
+                "gender": gender, "collected_date": collected_at.strftime("%d/%m/%Y"),
+                "reported_date": (collected_at + timedelta(days=1)).strftime("%d/%m/%Y"),
+                "collected_at": collected_at, "ingestion": {}, "version": 1
+            })
+            names = []
+            for test in self.report_tests(report_id, username, collected_at):
+                names.append(test["canonical_name"])
+                self.add("tests", test)
+            if self.rng.random() < self.conversation_fraction:
+                self.conversation(report_id, names)
+
+    def generate(self, start, end):
+        started = time.perf_counter()
+        for index in range(start, end):
+            self.user(index)
+            if (index + 1) % 10000 == 0:
+                print(f"  {index + 1} users ({time.perf_counter() - started:.0f}s)")
+        for name in self.buffers:
+            self.flush(name, force=True)
+        return self.counts
+
+
+def generate(db, mongo_uri, users, seed=0, **options):
+    """Grow the synthetic dataset to `users` users; returns the documents inserted per collection."""
+    ensure_indexes(db, mongo_uri)
+    start = existing_users(db)
+    if start >= users:
+        return {}
+    # Seeded by the starting point, so growing 1k -> 10k -> 100k is reproducible
+    return Generator(db, seed=seed + start, **options).generate(start, users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--reports-per-user", type=float, default=3.0)
+    parser.add_argument("--conversation-fraction", type=float, default=0.3)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drop", action="store_true", help="Drop the database first")
+    args = parser.parse_args()
+
+    if args.db_name == "mediway":
+        parser.error("refusing to load synthetic data into the production database name 'mediway'")
+
+    client = MongoClient(args.mongo_uri)
+    if args.drop:
+        client.drop_database(args.db_name)
+    started = time.perf_counter()
+    counts = generate(client[args.db_name], args.mongo_uri, args.users, seed=args.seed, reports_per_user=args.reports_per_user,
+                      conversation_fraction=args.conversation_fraction, batch_size=args.batch_size)
+    print(f"Inserted {counts} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,49 @@
 import os
 import json
+import time
+import hashlib
+import threading
 import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 
 from database import (
+    NOT_DELETED,
     fetch_patient_data,
+    patients_collection,
     get_conversation_history,
     update_conversation_history
 )
+from profiling import stage
+from usage import QuotaExceeded, check_quota, record_usage
 
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+CHAT_MODEL = "llama3-8b-8192"
+# Sampling settings for every chat call; shared with evaluation/model_tester.py
+CHAT_SAMPLING = {
+    "temperature": 0.85,
+    "top_p": 0.9,
+    "max_tokens": 1000,
+    "frequency_penalty": 0.2,
+    "presence_penalty": 0.1
+}
+
+# Bump when the system prompt or background layout changes so cached prefixes are rebuilt
+PROMPT_VERSION = "1"
+PROMPT_PREFIX_CACHE = os.getenv("PROMPT_PREFIX_CACHE", "1") != "0"
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "256"))
+PROMPT_PREFIX_TTL_SECONDS = int(os.getenv("PROMPT_PREFIX_TTL_SECONDS", "600"))
+
+# (report_id, context hash, prompt version) -> (created_at, prefix messages, first name)
+_prefix_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, List[Dict[str, str]], str]]" = OrderedDict()
+_prefix_lock = threading.Lock()
+prefix_cache_stats = {"hits": 0, "misses": 0}
 
 
 def format_patient_context(patient_context: Optional[Dict[str, Any]]) -> str:
@@ -52,34 +82,29 @@ Additional Patient Context:
 """.strip()
 
 
-def analyze_report(
-        report_id: str,
-        custom_prompt: Optional[str] = None,
-        patient_context: Optional[Dict[str, Any]] = None
-) -> str:
-    """
-    Generates a medical explanation or response using LLM based on the report.
+def context_hash(patient_context: Optional[Dict[str, Any]]) -> str:
+    """Stable hash of the patient context, independent of key order."""
+    encoded = json.dumps(patient_context or {}, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
 
-    Args:
-        report_id: Unique ID of the patient's report
-        custom_prompt: Optional question the patient asks
-        patient_context: Optional additional data for personalization
 
-    Returns:
-        LLM-generated message as string
+def build_prompt_prefix(
+        report_data: Dict[str, Any],
+        patient_context: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, str]], str]:
     """
-    # Step 1: Fetch patient report from DB
-    report_data = fetch_patient_data(report_id)
-    if not report_data:
-        return "❌ No patient data found for this report ID."
+    Render the static part of every chat turn: persona and report background.
 
+    Returns the prefix messages and the patient's first name. The output depends
+    only on its inputs, so it is byte-identical across turns and can be reused
+    by upstream prompt-prefix caching.
+    """
     patient_details = report_data.get("Patient Details", {})
     patient_name = patient_details.get("Name", "there")
     first_name = patient_name.split()[0] if patient_name else "there"
     age = patient_details.get("Age", "unknown age")
     gender = patient_details.get("Gender", "unspecified")
 
-    # Step 2: Format background
     context_str = format_patient_context(patient_context)
     full_report_json = json.dumps(report_data, indent=2)
 
@@ -94,7 +119,6 @@ Lab Report:
 {context_str}
 """.strip()
 
-    # Step 3: System prompt
     system_prompt = f"""
 You are Dr. {first_name}'s AI health assistant.
 You specialize in analyzing blood test results and explaining them in empathetic, simple language.
@@ -108,14 +132,65 @@ ALWAYS follow these:
 - Use paragraph breaks for readability
 """
 
-    # Step 4: Assemble messages
-    messages: List[Dict[str, str]] = [
+    messages = [
         {"role": "system", "content": system_prompt},
         {"role": "system", "content": background_context}
     ]
+    return messages, first_name
+
+
+def get_prompt_prefix(
+        report_id: str,
+        patient_context: Optional[Dict[str, Any]] = None,
+        report_version: Optional[int] = None
+) -> Optional[Tuple[List[Dict[str, str]], str]]:
+    """
+    Prompt prefix for a report, memoized per (report_id, report version, context hash,
+    prompt version), so a re-ingested report is never answered from its old data.
+    The version is read with a projection when the caller has not already loaded it.
+    """
+    if report_version is None:
+        patient = patients_collection.find_one({"report_id": report_id}, {"_id": 0, "version": 1})
+        report_version = (patient or {}).get("version", 1)
+    key = (report_id, report_version, context_hash(patient_context), PROMPT_VERSION)
+
+    if PROMPT_PREFIX_CACHE:
+        with _prefix_lock:
+            entry = _prefix_cache.get(key)
+            if entry and time.monotonic() - entry[0] < PROMPT_PREFIX_TTL_SECONDS:
+                _prefix_cache.move_to_end(key)
+                prefix_cache_stats["hits"] += 1
+                return entry[1], entry[2]
+
+    report_data = fetch_patient_data(report_id)
+    if not report_data:
+        return None
+    messages, first_name = build_prompt_prefix(report_data, patient_context)
+
+    if PROMPT_PREFIX_CACHE:
+        with _prefix_lock:
+            prefix_cache_stats["misses"] += 1
+            _prefix_cache[key] = (time.monotonic(), messages, first_name)
+            while len(_prefix_cache) > PROMPT_PREFIX_CACHE_SIZE:
+                _prefix_cache.popitem(last=False)
+
+    return messages, first_name
+
+
+def invalidate_prompt_prefix(report_id: str) -> None:
+    with _prefix_lock:
+        for key in [key for key in _prefix_cache if key[0] == report_id]:
+            del _prefix_cache[key]
 
-    # Add chat history if present
-    history = get_conversation_history(report_id)
+
+def build_messages(
+        prefix_messages: List[Dict[str, str]],
+        first_name: str,
+        history: List[Dict[str, str]],
+        custom_prompt: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """Static prefix first, then conversation history, then this turn's input."""
+    messages = list(prefix_messages)
     messages.extend(history)
 
     if custom_prompt:
@@ -130,35 +205,221 @@ ALWAYS follow these:
                 "and ask how they're feeling. Offer some positive next steps."
             )
         })
+    return messages
+
+
+def is_error_reply(reply: str) -> bool:
+    """True for the fallback messages analyze_report returns instead of an LLM answer."""
+    return reply.startswith(("❌", "Apologies "))
+
+
+def analyze_report(
+        report_id: str,
+        custom_prompt: Optional[str] = None,
+        patient_context: Optional[Dict[str, Any]] = None,
+        username: Optional[str] = None,
+        endpoint: str = "chat",
+        report_version: Optional[int] = None,
+        quota_checked: bool = False
+) -> str:
+    """
+    Generates a medical explanation or response using LLM based on the report.
+
+    Args:
+        report_id: Unique ID of the patient's report
+        custom_prompt: Optional question the patient asks
+        patient_context: Optional additional data for personalization
+        username: User the call's tokens are accounted to and whose daily quota applies
+        endpoint: Label of the calling path in the usage records
+        report_version: Version of the report, when the caller has already read it
+        quota_checked: The caller has already checked the user's quota for this call
+
+    Returns:
+        LLM-generated message as string
+    """
+    # Step 1: Static prefix (persona + report + context), memoized across turns
+    cpu_start = time.process_time()
+    with stage("prompt"):
+        prefix = get_prompt_prefix(report_id, patient_context, report_version)
+        if not prefix:
+            return "❌ No patient data found for this report ID."
+        prefix_messages, first_name = prefix
+
+        # Step 2: Assemble messages with chat history after the prefix
+        history = get_conversation_history(report_id)
+        messages = build_messages(prefix_messages, first_name, history, custom_prompt)
+    prompt_cpu_ms = (time.process_time() - cpu_start) * 1000
 
-    # Step 5: API call
+    try:
+        if not quota_checked:
+            check_quota(username)
+    except QuotaExceeded:
+        return (f"Apologies {first_name}, you've reached today's limit for AI answers. "
+                "Please come back tomorrow.")
+
+    # Step 3: API call
     headers = {
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json"
     }
 
     payload = {
-        "model": "llama3-8b-8192",
+        "model": CHAT_MODEL,
         "messages": messages,
-        "temperature": 0.85,
-        "top_p": 0.9,
-        "max_tokens": 1000,
-        "frequency_penalty": 0.2,
-        "presence_penalty": 0.1
+        **CHAT_SAMPLING
     }
 
+    upstream_start = time.perf_counter()
+    result = None
     try:
-        response = requests.post(GROQ_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        bot_reply = response.json()["choices"][0]["message"]["content"]
+        with stage("llm"):
+            response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+            response.raise_for_status()
+            result = response.json()
+            bot_reply = result["choices"][0]["message"]["content"]
+        upstream_ms = (time.perf_counter() - upstream_start) * 1000
+        print(f"[chat] report={report_id} prompt_cpu_ms={prompt_cpu_ms:.2f} upstream_ms={upstream_ms:.0f}")
+        record_usage(username, report_id, endpoint, CHAT_MODEL, result.get("usage"), upstream_ms)
 
         # Store only user-initiated interactions
         if custom_prompt:
-            update_conversation_history(report_id, custom_prompt, bot_reply)
+            with stage("mongo"):
+                update_conversation_history(report_id, custom_prompt, bot_reply)
 
         return bot_reply
 
     except requests.exceptions.RequestException as e:
+        record_usage(username, report_id, endpoint, CHAT_MODEL, None,
+                     (time.perf_counter() - upstream_start) * 1000, ok=False)
         return f"Apologies {first_name}, I'm facing technical difficulties reaching the AI model. ({str(e)})"
     except (KeyError, IndexError, json.JSONDecodeError) as e:
+        # The tokens of a malformed reply were still spent
+        usage = result.get("usage") if isinstance(result, dict) else None
+        record_usage(username, report_id, endpoint, CHAT_MODEL, usage,
+                     (time.perf_counter() - upstream_start) * 1000, ok=False)
         return f"Apologies {first_name}, something went wrong while processing the response. ({str(e)})"
+
+
+# -----------------------------------
+# Eager Initial Analysis
+# -----------------------------------
+# Ingestion schedules the first analysis as soon as a report is stored, so it is
+# usually ready by the time the dashboard opens the report. It is kept on the
+# patient document together with the report version, patient-context hash and
+# prompt version it was generated with, and reused only while all three match.
+
+INITIAL_ANALYSIS_WORKERS = int(os.getenv("INITIAL_ANALYSIS_WORKERS", "2"))
+# A background generation running longer than this is treated as stalled and redone on demand
+INITIAL_ANALYSIS_PENDING_SECONDS = float(os.getenv("INITIAL_ANALYSIS_PENDING_SECONDS", "60"))
+# Seconds a client is asked to wait before polling a pending analysis again
+INITIAL_ANALYSIS_RETRY_AFTER = 2
+
+_analysis_executor: Optional[ThreadPoolExecutor] = None
+_analysis_executor_lock = threading.Lock()
+
+
+def _get_analysis_executor() -> ThreadPoolExecutor:
+    global _analysis_executor
+    with _analysis_executor_lock:
+        if _analysis_executor is None:
+            _analysis_executor = ThreadPoolExecutor(
+                max_workers=INITIAL_ANALYSIS_WORKERS, thread_name_prefix="initial-analysis"
+            )
+        return _analysis_executor
+
+
+def _matching_analysis(patient: Optional[Dict[str, Any]], patient_context: Optional[Dict[str, Any]]) -> Optional[str]:
+    analysis = (patient or {}).get("initial_analysis") or {}
+    if (analysis.get("text")
+            and analysis.get("report_version") == patient.get("version", 1)
+            and analysis.get("context_hash") == context_hash(patient_context)
+            and analysis.get("prompt_version") == PROMPT_VERSION):
+        return analysis["text"]
+    return None
+
+
+def initial_analysis_state(
+        report_id: str,
+        patient_context: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[str], bool]:
+    """
+    The stored initial analysis for this patient context if still valid, and whether
+    a background generation for the same context is still running. Never waits, so
+    request threads are not held while the LLM works.
+    """
+    patient = patients_collection.find_one(
+        {"report_id": report_id, **NOT_DELETED},
+        {"_id": 0, "version": 1, "initial_analysis": 1, "initial_analysis_pending": 1}
+    )
+    text = _matching_analysis(patient, patient_context)
+    pending = (patient or {}).get("initial_analysis_pending") or {}
+    running = (not text
+               and pending.get("context_hash") == context_hash(patient_context)
+               and (datetime.utcnow() - pending["started_at"]).total_seconds() <= INITIAL_ANALYSIS_PENDING_SECONDS)
+    return text, running
+
+
+def generate_initial_analysis(
+        report_id: str,
+        patient_context: Optional[Dict[str, Any]] = None,
+        username: Optional[str] = None,
+        endpoint: str = "analyze",
+        scheduled: bool = False,
+        quota_checked: bool = False
+) -> str:
+    """
+    Run the initial analysis and store it for reuse; error replies are returned but not stored.
+    A scheduled run only stores its result while its pending marker is still in place, so it
+    never overwrites an analysis generated on demand in the meantime.
+    """
+    patient = patients_collection.find_one({"report_id": report_id, **NOT_DELETED}, {"_id": 0, "version": 1})
+    analysis = analyze_report(report_id, patient_context=patient_context, username=username, endpoint=endpoint,
+                              report_version=patient.get("version", 1) if patient else None,
+                              quota_checked=quota_checked)
+    if not patient:
+        return analysis
+
+    query: Dict[str, Any] = {"report_id": report_id, "version": patient.get("version", 1)}
+    if scheduled:
+        query["initial_analysis_pending.context_hash"] = context_hash(patient_context)
+    update: Dict[str, Any] = {"$unset": {"initial_analysis_pending": ""}}
+    if not is_error_reply(analysis):
+        update["$set"] = {"initial_analysis": {
+            "text": analysis,
+            "report_version": patient.get("version", 1),
+            "context_hash": context_hash(patient_context),
+            "prompt_version": PROMPT_VERSION,
+            "model": CHAT_MODEL,
+            "generated_at": datetime.utcnow()
+        }}
+    # Only stored against the version it was generated from; a re-ingested report is left alone
+    patients_collection.update_one(query, update)
+    return analysis
+
+
+def schedule_initial_analysis(
+        report_id: str,
+        username: Optional[str] = None,
+        patient_context: Optional[Dict[str, Any]] = None
+) -> None:
+    """Generate the initial analysis in the background (INITIAL_ANALYSIS_WORKERS=0 disables this)."""
+    if INITIAL_ANALYSIS_WORKERS <= 0:
+        return
+    patients_collection.update_one(
+        {"report_id": report_id},
+        {"$set": {"initial_analysis_pending": {
+            "context_hash": context_hash(patient_context), "started_at": datetime.utcnow()
+        }}}
+    )
+
+    def run():
+        try:
+            generate_initial_analysis(report_id, patient_context, username, endpoint="initial_analysis", scheduled=True)
+        except Exception as e:
+            print(f"Initial analysis for {report_id} failed: {e}")
+            patients_collection.update_one(
+                {"report_id": report_id, "initial_analysis_pending.context_hash": context_hash(patient_context)},
+                {"$unset": {"initial_analysis_pending": ""}}
+            )
+
+    _get_analysis_executor().submit(run)
@@ -1,24 +1,64 @@
-from pymongo import MongoClient
 import bcrypt
-from typing import Dict, List
+import hashlib
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
+from functools import lru_cache
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("MONGO_DB_NAME", "mediway")
 
-# Reusable MongoDB connection
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client["mediway"]
-users_collection = db["users"]
-patients_collection = db["patients"]
-tests_collection = db["tests"]
-conversations_collection = db["conversations"]
 
-# In-memory conversation cache
-conversation_cache: Dict[str, List[Dict[str, str]]] = {}
+# -----------------------------------
+# Lazy MongoDB Connection
+# -----------------------------------
+# Nothing connects at import time: the client is created on first use and shared
+# by every module in the process, so imports stay fast and work without Mongo.
+
+@lru_cache(maxsize=None)
+def _client_for(mongo_uri: str):
+    from pymongo import MongoClient
+    return MongoClient(mongo_uri)
+
+
+def get_client(mongo_uri: Optional[str] = None):
+    return _client_for(mongo_uri or MONGO_URI)
+
+
+def get_db(mongo_uri: Optional[str] = None, db_name: str = DB_NAME):
+    return get_client(mongo_uri)[db_name]
+
+
+class LazyCollection:
+    """Stand-in for a collection that resolves the shared client on first attribute access."""
+
+    def __init__(self, name: str, db_name: str = DB_NAME):
+        self.name = name
+        self.db_name = db_name
+
+    def __getattr__(self, attr):
+        return getattr(get_db(db_name=self.db_name)[self.name], attr)
+
+
+def collection(name: str) -> LazyCollection:
+    return LazyCollection(name)
+
+
+users_collection = collection("users")
+patients_collection = collection("patients")
+tests_collection = collection("tests")
+conversations_collection = collection("conversations")
+semantic_cache_collection = collection("semantic_cache")
+purge_jobs_collection = collection("purge_jobs")
+
+# Reports marked deleted stay hidden until the background purge removes them
+NOT_DELETED = {"deleted": {"$ne": True}}
+
+# In-memory conversation cache: report_id -> (version, history)
+conversation_cache: Dict[str, Tuple[int, List[Dict[str, str]]]] = {}
 
 
 # -----------------------------------
@@ -61,7 +101,7 @@ class UserDatabase:
 
 def fetch_patient_data(report_id: str) -> Dict:
     try:
-        patient = patients_collection.find_one({"report_id": report_id})
+        patient = patients_collection.find_one({"report_id": report_id, **NOT_DELETED})
         if not patient:
             return None
 
@@ -80,7 +120,8 @@ def fetch_patient_data(report_id: str) -> Dict:
                     "Name": test["test_name"],
                     "Value": test["result"],
                     "Unit": test["unit"],
-                    "Reference Interval": test.get("reference_interval", "")
+                    "Reference Interval": test.get("reference_interval", ""),
+                    "Flag": test.get("flag")
                 }
                 for test in tests
             ]
@@ -94,70 +135,236 @@ def fetch_patient_data(report_id: str) -> Dict:
 # Conversation Management
 # -----------------------------------
 
+# Each turn is appended with a single atomic $push/$slice, so the live window stays
+# capped at MAX_HISTORY_ENTRIES and concurrent workers never overwrite each other's
+# turns. Every turn is also appended to conversation_archive, which keeps the full
+# transcript for audit and analytics until the retention TTL expires it. Documents
+# carry a version that every write increments; cached histories are revalidated
+# against it before use.
+
+MAX_HISTORY_ENTRIES = 10
+# Days archived turns are kept; 0 keeps them forever
+CONVERSATION_RETENTION_DAYS = int(os.getenv("CONVERSATION_RETENTION_DAYS", "365"))
+
+conversation_archive_collection = collection("conversation_archive")
+
+_conversation_indexes_ensured = False
+
+
+def ensure_ttl_index(target, field: str, expire_after_seconds: int) -> None:
+    """Create a TTL index, or change its expiry in place when it exists with another one."""
+    from pymongo.errors import OperationFailure
+
+    try:
+        target.create_index(field, expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        # IndexOptionsConflict: the retention setting changed since the index was built
+        if e.code != 85:
+            raise
+        target.database.command("collMod", target.name,
+                                index={"keyPattern": {field: 1}, "expireAfterSeconds": expire_after_seconds})
+
+
+def _ensure_conversation_indexes() -> None:
+    global _conversation_indexes_ensured
+    if not _conversation_indexes_ensured:
+        conversations_collection.create_index("report_id", unique=True)
+        conversation_archive_collection.create_index([("report_id", 1), ("turn", 1), ("position", 1)])
+        if CONVERSATION_RETENTION_DAYS:
+            ensure_ttl_index(conversation_archive_collection, "archived_at", CONVERSATION_RETENTION_DAYS * 86400)
+        _conversation_indexes_ensured = True
+
+
 def get_conversation_history(report_id: str) -> List[Dict[str, str]]:
-    if report_id not in conversation_cache:
-        conversation_cache[report_id] = _load_conversation_from_db(report_id)
-    return conversation_cache[report_id]
+    cached = conversation_cache.get(report_id)
+    if cached and cached[0] == _load_conversation_version(report_id):
+        return list(cached[1])
+
+    version, history = _load_conversation_from_db(report_id)
+    conversation_cache[report_id] = (version, history)
+    return list(history)
 
 
 def update_conversation_history(report_id: str, user_message: str, bot_response: str) -> None:
-    history = get_conversation_history(report_id)
-    history.append({"role": "user", "content": user_message})
-    history.append({"role": "assistant", "content": bot_response})
+    new_entries = [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": bot_response}
+    ]
 
-    # Keep only last 10 entries
-    conversation_cache[report_id] = history[-10:]
-    _save_conversation_to_db(report_id, conversation_cache[report_id])
+    version = _append_conversation_turn(report_id, new_entries)
+    if version is None:
+        conversation_cache.pop(report_id, None)
+        return
 
+    cached = conversation_cache.get(report_id)
+    if cached and cached[0] == version - 1:
+        # No other worker wrote in between, so the cached window can be advanced locally
+        conversation_cache[report_id] = (version, (cached[1] + new_entries)[-MAX_HISTORY_ENTRIES:])
+    else:
+        conversation_cache.pop(report_id, None)
 
-def clear_conversation_history(report_id: str) -> None:
-    if report_id in conversation_cache:
-        del conversation_cache[report_id]
-    conversations_collection.delete_one({"report_id": report_id})
+    _archive_conversation_turn(report_id, version, new_entries)
 
 
-def _save_conversation_to_db(report_id: str, conversation_data: List[Dict[str, str]]) -> None:
-    try:
-        conversations_collection.update_one(
+def clear_conversation_history(report_id: str) -> None:
+    # Emptied rather than deleted so the version keeps increasing and stale caches are
+    # detected. The archived transcript is kept.
+    conversation_cache.pop(report_id, None)
+    conversations_collection.update_one(
+        {"report_id": report_id},
+        {"$set": {"conversation_data": [], "last_updated": datetime.utcnow()}, "$inc": {"version": 1}}
+    )
+
+
+def _append_conversation_turn(report_id: str, entries: List[Dict[str, str]]) -> Optional[int]:
+    """Append entries to the live window in one atomic update. Returns the new version."""
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+
+    def append():
+        return conversations_collection.find_one_and_update(
             {"report_id": report_id},
             {
-                "$set": {
-                    "conversation_data": conversation_data,
-                    "last_updated": datetime.utcnow()
-                }
+                "$push": {"conversation_data": {"$each": entries, "$slice": -MAX_HISTORY_ENTRIES}},
+                "$set": {"last_updated": datetime.utcnow()},
+                "$inc": {"version": 1}
             },
-            upsert=True
-        )
+            projection={"_id": 0, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )["version"]
+
+    try:
+        _ensure_conversation_indexes()
+    except Exception as e:
+        # Retried on the next turn; saving the conversation does not depend on it
+        print("Error creating conversation indexes:", e)
+    try:
+        try:
+            return append()
+        except DuplicateKeyError:
+            # Two first turns raced on the upsert; the document exists now, so this updates it
+            return append()
     except Exception as e:
         print("Error saving conversation:", e)
+        return None
+
+
+def _archive_conversation_turn(report_id: str, turn: int, entries: List[Dict[str, str]]) -> None:
+    now = datetime.utcnow()
+    try:
+        conversation_archive_collection.insert_many([
+            {"report_id": report_id, "turn": turn, "position": i, "archived_at": now, **entry}
+            for i, entry in enumerate(entries)
+        ])
+    except Exception as e:
+        print("Error archiving conversation:", e)
+
 
+def get_conversation_transcript(report_id: str) -> List[Dict]:
+    """Full archived transcript of a report's conversation, oldest first."""
+    return list(conversation_archive_collection.find(
+        {"report_id": report_id},
+        {"_id": 0, "report_id": 0}
+    ).sort([("turn", 1), ("position", 1)]))
 
-def _load_conversation_from_db(report_id: str) -> List[Dict[str, str]]:
+
+def _load_conversation_version(report_id: str) -> int:
+    try:
+        doc = conversations_collection.find_one({"report_id": report_id}, {"_id": 0, "version": 1})
+        if doc:
+            return doc.get("version", 0)
+    except Exception as e:
+        print("Error loading conversation version:", e)
+    return 0
+
+
+def _load_conversation_from_db(report_id: str) -> Tuple[int, List[Dict[str, str]]]:
     try:
         doc = conversations_collection.find_one({"report_id": report_id})
         if doc:
-            return doc.get("conversation_data", [])
+            return doc.get("version", 0), doc.get("conversation_data", [])
     except Exception as e:
         print("Error loading conversation:", e)
-    return []
+    return 0, []
 
-def delete_report_and_related_data(report_id: str) -> bool:
+
+# -----------------------------------
+# Report Listing & Deletion
+# -----------------------------------
+
+def list_user_reports(username: str) -> List[Dict]:
+    return list(patients_collection.find({"username": username, **NOT_DELETED}).sort("reported_date", -1))
+
+
+def user_reports_key(username: str) -> str:
+    """Hash of the user's live report ids; changes with every upload and deletion, from any session."""
+    report_ids = sorted(doc["report_id"] for doc in patients_collection.find(
+        {"username": username, **NOT_DELETED}, {"_id": 0, "report_id": 1}
+    ))
+    return hashlib.sha256("|".join(report_ids).encode()).hexdigest()
+
+
+def deleted_report_ids(username: Optional[str] = None) -> List[str]:
+    """Reports of this user, or of all users, that are marked deleted but not yet purged."""
+    query = {"username": username, "deleted": True} if username else {"deleted": True}
+    return [doc["report_id"] for doc in patients_collection.find(query, {"_id": 0, "report_id": 1})]
+
+
+def _run_in_transaction(callback):
+    """Run callback(session) in a transaction, or without one on servers that lack them."""
+    from pymongo.errors import OperationFailure
+
+    client = get_client()
     try:
-        # Delete patient record
-        patients_collection.delete_one({"report_id": report_id})
+        with client.start_session() as session:
+            return session.with_transaction(callback)
+    except OperationFailure as e:
+        # IllegalOperation: standalone servers only support transactions on replica sets
+        if e.code != 20:
+            raise
+    return callback(None)
 
-        # Delete related test results
-        tests_collection.delete_many({"report_id": report_id})
 
-        # Delete conversation history from cache and DB
-        clear_conversation_history(report_id)
+def delete_report_and_related_data(report_id: str) -> bool:
+    """
+    Mark a report deleted, detach it from its owner and queue its purge, in one
+    transaction. Tests, conversations and cached answers are removed later by
+    purge.py, so the cost here does not depend on report or user-base size.
+    """
+    db = get_db()
+
+    def mark_deleted(session) -> bool:
+        patient = db["patients"].find_one_and_update(
+            {"report_id": report_id, **NOT_DELETED},
+            {"$set": {"deleted": True, "deleted_at": datetime.utcnow()}, "$inc": {"version": 1}},
+            projection={"_id": 0, "username": 1},
+            session=session
+        )
+        if not patient:
+            return False
+
+        # Only the owning user's document is touched
+        db["users"].update_one({"username": patient.get("username")}, {"$pull": {"reports": report_id}}, session=session)
+        # A re-upload of the same PDF must start a new ingestion rather than resolve to this report
+        db["ingestion_jobs"].delete_many({"report_id": report_id}, session=session)
+        db["purge_jobs"].update_one(
+            {"report_id": report_id},
+            {"$setOnInsert": {"status": "pending", "attempts": 0, "created_at": datetime.utcnow()}},
+            upsert=True,
+            session=session
+        )
+        return True
 
-        # Optional: Remove from user's report list if tracking (not used currently)
-        users_collection.update_many({}, {"$pull": {"reports": report_id}})
+    try:
+        found = _run_in_transaction(mark_deleted)
+        conversation_cache.pop(report_id, None)
+        if not found:
+            print(f"❌ Report {report_id} not found or already deleted.")
+            return False
 
-        print(f"✅ Deleted report and related data for report_id: {report_id}")
+        print(f"✅ Deleted report {report_id}; related data queued for purge.")
         return True
     except Exception as e:
         print(f"❌ Error deleting report data for {report_id}: {e}")
         return False
-
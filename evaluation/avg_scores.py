@@ -11,6 +11,8 @@ def average_scores(input_file, output_file):
 
     # Aggregate scores for each model
     for entry in data:
+        if entry["similarity_score"] is None:
+            continue  # failed call
         model = entry["model"]
         score_sums[model] += entry["similarity_score"]
         count[model] += 1
@@ -0,0 +1,103 @@
+import os
+import json
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BOOTSTRAP_SAMPLES = 2000
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def bootstrap_ci(values, samples=BOOTSTRAP_SAMPLES, seed=0):
+    """95% bootstrap confidence interval of the mean."""
+    if len(values) < 2:
+        return None
+    rng = np.random.default_rng(seed)
+    means = rng.choice(values, size=(samples, len(values)), replace=True).mean(axis=1)
+    return [round(float(np.percentile(means, 2.5)), 3), round(float(np.percentile(means, 97.5)), 3)]
+
+
+def present(entries, field):
+    return [entry[field] for entry in entries if entry.get(field) is not None]
+
+
+def model_summary(entries, price):
+    scores = present(entries, "similarity_score")
+    prompt_tokens = present(entries, "prompt_tokens")
+    completion_tokens = present(entries, "completion_tokens")
+    summary = {
+        "calls": len(entries),
+        "error_rate": round(sum(1 for entry in entries if entry.get("error")) / len(entries), 3),
+        "quality_mean": round(float(np.mean(scores)), 3) if scores else None,
+        "quality_ci95": bootstrap_ci(scores),
+        "latency_p50_s": percentile(present(entries, "latency_s"), 50),
+        "latency_p95_s": percentile(present(entries, "latency_s"), 95),
+        "ttft_p50_s": percentile(present(entries, "ttft_s"), 50),
+        "ttft_p95_s": percentile(present(entries, "ttft_s"), 95),
+        "tokens_per_sec_p50": percentile(present(entries, "tokens_per_sec"), 50),
+        "prompt_tokens_mean": round(float(np.mean(prompt_tokens)), 1) if prompt_tokens else None,
+        "completion_tokens_mean": round(float(np.mean(completion_tokens)), 1) if completion_tokens else None,
+        "cost_per_1k_requests_usd": None
+    }
+    if price and prompt_tokens and completion_tokens:
+        per_request = (summary["prompt_tokens_mean"] * price["input"]
+                       + summary["completion_tokens_mean"] * price["output"]) / 1e6
+        summary["cost_per_1k_requests_usd"] = round(per_request * 1000, 4)
+    return summary
+
+
+def build_leaderboard(scores, prices):
+    by_model = defaultdict(list)
+    for entry in scores:
+        by_model[entry["model"]].append(entry)
+
+    board = [{"model": model, **model_summary(entries, prices.get(model))} for model, entries in by_model.items()]
+    # Best quality first; models without any successful call last
+    board.sort(key=lambda row: -(row["quality_mean"] if row["quality_mean"] is not None else -1))
+    return board
+
+
+def fmt(value, width, digits=2):
+    return f"{value:>{width}.{digits}f}" if isinstance(value, (int, float)) else f"{'-':>{width}}"
+
+
+def print_leaderboard(board):
+    print(f"{'Model':<32} {'n':>4} {'err%':>5} {'quality':>8} {'95% CI':>13} {'p50 s':>6} {'p95 s':>6} "
+          f"{'ttft50':>6} {'ttft95':>6} {'tok/s':>7} {'in tok':>7} {'out tok':>7} {'$/1k req':>9}")
+    for row in board:
+        ci = f"{row['quality_ci95'][0]:.2f}-{row['quality_ci95'][1]:.2f}" if row["quality_ci95"] else "-"
+        print(f"{row['model']:<32} {row['calls']:>4} {row['error_rate'] * 100:>5.0f} {fmt(row['quality_mean'], 8)} "
+              f"{ci:>13} {fmt(row['latency_p50_s'], 6)} {fmt(row['latency_p95_s'], 6)} "
+              f"{fmt(row['ttft_p50_s'], 6)} {fmt(row['ttft_p95_s'], 6)} {fmt(row['tokens_per_sec_p50'], 7, 0)} "
+              f"{fmt(row['prompt_tokens_mean'], 7, 0)} {fmt(row['completion_tokens_mean'], 7, 0)} "
+              f"{fmt(row['cost_per_1k_requests_usd'], 9, 3)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-model leaderboard of quality, latency, throughput and token cost.")
+    parser.add_argument("--scores", default=os.path.join(HERE, "model_scores.json"))
+    parser.add_argument("--prices", default=os.path.join(HERE, "model_prices.json"))
+    parser.add_argument("--output", default=os.path.join(HERE, "model_leaderboard.json"))
+    args = parser.parse_args()
+
+    with open(args.scores) as f:
+        scores = json.load(f)
+    with open(args.prices) as f:
+        prices = {model: price for model, price in json.load(f).items() if not model.startswith("_")}
+
+    board = build_leaderboard(scores, prices)
+    print_leaderboard(board)
+
+    with open(args.output, "w") as f:
+        json.dump(board, f, indent=4)
+    print(f"\nLeaderboard saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
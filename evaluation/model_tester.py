@@ -1,13 +1,25 @@
-import requests
+import os
+import sys
 import json
 import time
 import logging
+import argparse
+
+import requests
+from dotenv import load_dotenv
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# Same prompt construction and sampling settings as the production chat path
+from chatbot import CHAT_SAMPLING, build_messages, build_prompt_prefix
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # Groq API Key & URL
-GROQ_API_KEY = "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"
+load_dotenv()
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
 # Models to test
@@ -30,60 +42,111 @@ models_to_test = [
     # "distil-whisper-large-v3-en"
 ]
 
-# Load test cases
-with open("evaluation_data.json") as f:
-    test_cases = json.load(f)
-
-results = []
-
-for model in models_to_test:
-    logging.info(f"Testing model: {model}")
-
-    for case in test_cases:
-        lab_no = case["lab_no"]
-        question = case["question"]
-
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a medical AI expert analyzing blood test reports."},
-                {"role": "user", "content": f"Patient Report (Lab No: {lab_no}).\nUser Question: {question}"}
-            ],
-            "temperature": 0.5,
-            "max_tokens": 1000
-        }
-
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        try:
-            response = requests.post(GROQ_API_URL, headers=headers, json=payload)
-            response_json = response.json()
-
-            if "choices" in response_json:
-                model_response = response_json["choices"][0]["message"]["content"]
-            else:
-                model_response = f"Error: {response_json.get('error', 'Unknown API issue')}"
-
-        except Exception as e:
-            model_response = f"Error: {str(e)}"
-
-        results.append({
-            "model": model,
-            "lab_no": lab_no,
-            "question": question,
-            "response": model_response
-        })
-
-        logging.info(f"Model {model} - Lab No: {lab_no} - Response saved")
-
-        # Avoid rate limiting
-        time.sleep(1)
-
-# Save results to JSON
-with open("model_responses.json", "w") as f:
-    json.dump(results, f, indent=2)
 
-logging.info("All model responses saved successfully!")
+def timed_completion(model, messages):
+    """
+    Stream one chat completion and time it. Returns the response text plus
+    total latency, time to first token and the token usage reported by the API.
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        **CHAT_SAMPLING,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+    headers = {
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    record = {"response": "", "latency_s": None, "ttft_s": None,
+              "prompt_tokens": None, "completion_tokens": None, "tokens_per_sec": None, "error": None}
+    parts, usage = [], None
+    start = time.perf_counter()
+    try:
+        with requests.post(GROQ_API_URL, headers=headers, json=payload, stream=True, timeout=120) as response:
+            if response.status_code != 200:
+                record["error"] = f"HTTP {response.status_code}: {response.text[:300]}"
+                return record
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Usage arrives on the final chunk, either OpenAI-style or under x_groq
+                usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    text = choice.get("delta", {}).get("content")
+                    if text:
+                        if record["ttft_s"] is None:
+                            record["ttft_s"] = round(time.perf_counter() - start, 4)
+                        parts.append(text)
+    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        record["error"] = str(e)
+        return record
+
+    record["latency_s"] = round(time.perf_counter() - start, 4)
+    record["response"] = "".join(parts)
+    if usage:
+        record["prompt_tokens"] = usage.get("prompt_tokens")
+        record["completion_tokens"] = usage.get("completion_tokens")
+    # Decode rate after the first token, so queueing and prompt processing are not counted
+    generation_s = record["latency_s"] - (record["ttft_s"] or 0)
+    if record["completion_tokens"] and generation_s > 0:
+        record["tokens_per_sec"] = round(record["completion_tokens"] / generation_s, 1)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every model on the evaluation questions and record responses, timing and token usage.")
+    parser.add_argument("--models", default=None, help="Comma-separated models (default: all in models_to_test)")
+    parser.add_argument("--repeats", type=int, default=1, help="Calls per model and question, for latency percentiles")
+    parser.add_argument("--output", default=os.path.join(HERE, "model_responses.json"))
+    args = parser.parse_args()
+
+    if not GROQ_API_KEY:
+        parser.error("GROQ_API_KEY is not set")
+    models = args.models.split(",") if args.models else models_to_test
+
+    # Load test cases and the fixture report each question refers to
+    with open(os.path.join(HERE, "evaluation_data.json")) as f:
+        test_cases = json.load(f)
+    with open(os.path.join(HERE, "fixture_reports.json")) as f:
+        fixture_reports = json.load(f)
+
+    results = []
+
+    for model in models:
+        logging.info(f"Testing model: {model}")
+
+        for case in test_cases:
+            lab_no = case["lab_no"]
+            question = case["question"]
+            prefix_messages, first_name = build_prompt_prefix(fixture_reports[lab_no])
+            messages = build_messages(prefix_messages, first_name, [], question)
+
+            for repeat in range(args.repeats):
+                record = timed_completion(model, messages)
+                if record["error"]:
+                    logging.warning(f"Model {model} - Lab No: {lab_no} - {record['error']}")
+                    record["response"] = f"Error: {record['error']}"
+
+                results.append({"model": model, "lab_no": lab_no, "question": question, "repeat": repeat, **record})
+                logging.info(f"Model {model} - Lab No: {lab_no} - latency {record['latency_s']}s, "
+                             f"ttft {record['ttft_s']}s, tokens {record['prompt_tokens']}/{record['completion_tokens']}")
+
+                # Avoid rate limiting
+                time.sleep(1)
+
+    # Save results to JSON
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    logging.info("All model responses saved successfully!")
+
+
+if __name__ == "__main__":
+    main()
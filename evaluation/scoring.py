@@ -12,6 +12,9 @@ with open("evaluation_data.json") as f:
 # Load NLP model for text similarity
 embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
+# Timing and usage fields recorded by model_tester.py, passed through for leaderboard.py
+PASSTHROUGH_FIELDS = ["repeat", "latency_s", "ttft_s", "prompt_tokens", "completion_tokens", "tokens_per_sec", "error"]
+
 scores = []
 
 for result in model_results:
@@ -19,6 +22,13 @@ for result in model_results:
     lab_no = result["lab_no"]
     response = result["response"]
 
+    extra = {field: result[field] for field in PASSTHROUGH_FIELDS if field in result}
+
+    # Failed calls count toward the error rate, not the quality score
+    if result.get("error"):
+        scores.append({"model": model, "lab_no": lab_no, "similarity_score": None, **extra})
+        continue
+
     # Get expected response
     expected = next(item["expected_response"] for item in test_cases if item["lab_no"] == lab_no)
 
@@ -33,7 +43,8 @@ for result in model_results:
     scores.append({
         "model": model,
         "lab_no": lab_no,
-        "similarity_score": final_score
+        "similarity_score": final_score,
+        **extra
     })
 
 # Save final scores
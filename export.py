@@ -0,0 +1,172 @@
+import sys
+import argparse
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from database import collection, deleted_report_ids
+
+# -----------------------------------
+# Bulk Export of Test Results
+# -----------------------------------
+# Tests are read from a server-side cursor and converted one batch at a time into
+# Arrow tables, which are written out as CSV or Parquet chunks. Only one batch is
+# held in memory, so exports of any size run in constant memory.
+
+EXPORT_FORMATS = ("csv", "parquet")
+# Documents per cursor batch, Arrow chunk and Parquet row group
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_SCHEMA = pa.schema([
+    ("report_id", pa.string()),
+    ("username", pa.string()),
+    ("collected_at", pa.timestamp("ms")),
+    ("test_name", pa.string()),
+    ("canonical_name", pa.string()),
+    ("result", pa.string()),
+    ("result_value", pa.float64()),
+    ("unit", pa.string()),
+    ("ref_lower", pa.float64()),
+    ("ref_upper", pa.float64()),
+    ("reference_interval", pa.string()),
+    ("flag", pa.string()),
+])
+
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+tests_collection = collection("tests")
+
+
+def export_filter(username: Optional[str] = None, start: Optional[datetime] = None,
+                  end: Optional[datetime] = None) -> Dict[str, Any]:
+    """Tests of one user and/or collected in [start, end), leaving out deleted reports."""
+    query: Dict[str, Any] = {}
+    if username:
+        query["username"] = username
+    # Pending purges are few, so the exclusion list stays small even across all users
+    deleted = deleted_report_ids(username)
+    if deleted:
+        query["report_id"] = {"$nin": deleted}
+    if start or end:
+        query["collected_at"] = {}
+        if start:
+            query["collected_at"]["$gte"] = start
+        if end:
+            query["collected_at"]["$lt"] = end
+    return query
+
+
+def iter_test_batches(query: Dict[str, Any], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    projection = {"_id": 0, **{name: 1 for name in EXPORT_SCHEMA.names}}
+    cursor = tests_collection.find(query, projection).batch_size(batch_size)
+    batch: List[Dict[str, Any]] = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def to_arrow(batch: List[Dict[str, Any]]) -> pa.Table:
+    """Convert a batch of test documents to a table with the fixed export schema."""
+    columns = {}
+    for field in EXPORT_SCHEMA:
+        values = [doc.get(field.name) for doc in batch]
+        if pa.types.is_string(field.type):
+            # result and unit are free text from the parser and not always strings
+            values = [_to_str(value) for value in values]
+        columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+    return pa.Table.from_pydict(columns, schema=EXPORT_SCHEMA)
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the caller as they are produced."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_csv(batches: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    header = True
+    for batch in batches:
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(to_arrow(batch), sink, write_options=pa_csv.WriteOptions(include_header=header))
+        header = False
+        yield sink.getvalue().to_pybytes()
+    if header:
+        # No rows: still return the column names
+        yield (",".join(f'"{name}"' for name in EXPORT_SCHEMA.names) + "\n").encode()
+
+
+def stream_parquet(batches: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, EXPORT_SCHEMA)
+    try:
+        for batch in batches:
+            # One row group per batch
+            writer.write_table(to_arrow(batch))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(query: Dict[str, Any], fmt: str = "csv", batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    batches = iter_test_batches(query, batch_size)
+    return stream_csv(batches) if fmt == "csv" else stream_parquet(batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export test results as CSV or Parquet.")
+    parser.add_argument("--username", help="Only this user's tests")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Collected on or after (YYYY-MM-DD)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Collected before (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--output", help="Output file; defaults to stdout")
+    args = parser.parse_args()
+
+    query = export_filter(args.username, args.start, args.end)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in stream_export(query, args.format, args.batch_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from database import DB_NAME, get_db
+
+# -----------------------------------
+# Ingestion Stages
+# -----------------------------------
+# raw upload -> page text -> parsed JSON -> stored report. Each stage's output is
+# persisted on the job so that a failed stage can be retried without redoing the
+# earlier ones.
+
+STAGE_UPLOADED = "uploaded"
+STAGE_TEXT_EXTRACTED = "text_extracted"
+STAGE_PARSED = "parsed"
+STAGE_STORED = "stored"
+
+STATUS_PENDING = "pending"
+STATUS_FAILED = "failed"
+STATUS_COMPLETE = "complete"
+
+# Per-stage outputs kept on the job only until the report is stored
+INTERMEDIATE_ARTIFACTS = ("page_text", "parsed_data")
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_INGESTION_ATTEMPTS = int(os.getenv("MAX_INGESTION_ATTEMPTS", "5"))
+# Retry backoff for the sweeper: base * 2^attempts seconds
+RETRY_BACKOFF_SECONDS = 30
+
+
+def file_content_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class IngestionStore:
+    """Persists ingestion jobs and their intermediate artifacts, keyed by (username, content hash)."""
+
+    def __init__(self, db, upload_dir: str = UPLOAD_DIR):
+        self.jobs = db["ingestion_jobs"]
+        self.upload_dir = upload_dir
+
+    def ensure_indexes(self) -> None:
+        self.jobs.create_index([("username", ASCENDING), ("content_hash", ASCENDING)], unique=True)
+        self.jobs.create_index([("status", ASCENDING), ("next_retry_at", ASCENDING)])
+        self.jobs.create_index("report_id")
+
+    def raw_path(self, content_hash: str) -> str:
+        return os.path.join(self.upload_dir, f"{content_hash}.pdf")
+
+    def save_upload(self, pdf_path: str, username: str, metadata: Dict[str, Any],
+                    content_hash: Optional[str] = None, move: bool = False) -> Dict[str, Any]:
+        """
+        Persist the raw PDF and create its job, or return the existing job for the
+        same content. move=True renames pdf_path into place instead of copying it.
+        """
+        content_hash = content_hash or file_content_hash(pdf_path)
+        raw_path = self.raw_path(content_hash)
+        if not os.path.exists(raw_path):
+            os.makedirs(self.upload_dir, exist_ok=True)
+            if move:
+                os.replace(pdf_path, raw_path)
+            else:
+                shutil.copyfile(pdf_path, raw_path)
+        elif move:
+            os.remove(pdf_path)
+
+        now = datetime.utcnow()
+        return self.jobs.find_one_and_update(
+            {"username": username, "content_hash": content_hash},
+            {
+                "$setOnInsert": {
+                    "report_id": str(uuid.uuid4()),
+                    "stage": STAGE_UPLOADED,
+                    "status": STATUS_PENDING,
+                    "attempts": 0,
+                    "created_at": now
+                },
+                "$set": {"metadata": metadata, "updated_at": now}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def get(self, username: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.find_one({"username": username, "content_hash": content_hash})
+
+    def record_stage(self, job: Dict[str, Any], stage: str, **artifacts: Any) -> Dict[str, Any]:
+        status = STATUS_COMPLETE if stage == STAGE_STORED else STATUS_PENDING
+        update = {"stage": stage, "status": status, "error": None, "updated_at": datetime.utcnow(), **artifacts}
+        operations = {"$set": update}
+        if stage == STAGE_STORED:
+            # The stored report supersedes the intermediate artifacts; drop them from the job
+            for field in INTERMEDIATE_ARTIFACTS:
+                update.pop(field, None)
+                job.pop(field, None)
+            operations["$unset"] = {field: "" for field in INTERMEDIATE_ARTIFACTS}
+        self.jobs.update_one({"_id": job["_id"]}, operations)
+        job.update(update)
+        return job
+
+    def record_failure(self, job: Dict[str, Any], error: str) -> None:
+        attempts = job.get("attempts", 0) + 1
+        update = {
+            "status": STATUS_FAILED,
+            "error": error,
+            "attempts": attempts,
+            "updated_at": datetime.utcnow(),
+            "next_retry_at": datetime.utcnow() + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** attempts)
+        }
+        self.jobs.update_one({"_id": job["_id"]}, {"$set": update})
+        job.update(update)
+        print(f"Ingestion {job['content_hash'][:12]} failed at stage '{job['stage']}': {error}")
+
+    def retryable_jobs(self, max_attempts: int = MAX_INGESTION_ATTEMPTS) -> Iterator[Dict[str, Any]]:
+        return self.jobs.find({
+            "status": STATUS_FAILED,
+            "attempts": {"$lt": max_attempts},
+            "next_retry_at": {"$lte": datetime.utcnow()}
+        })
+
+    def discard_raw(self, content_hash: str) -> None:
+        raw_path = self.raw_path(content_hash)
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+
+# -----------------------------------
+# Streaming Uploads
+# -----------------------------------
+# A multipart body is parsed as it arrives: the file part goes straight to a
+# temporary file in UPLOAD_DIR through a fixed-size write buffer and is hashed on
+# the way, so memory per upload stays constant whatever the file size. Non-PDF
+# content is rejected from its first bytes and oversized bodies as soon as they
+# cross the limit.
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_UPLOAD_PAGES = int(os.getenv("MAX_UPLOAD_PAGES", "20"))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+PDF_MAGIC = b"%PDF-"
+# Other form fields (name, age, gender) are small and kept in memory up to this size
+MAX_FORM_FIELD_BYTES = 1024
+# Except the patient context (JSON with symptoms, history, medications, ...)
+MAX_CONTEXT_FIELD_BYTES = 16 * 1024
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class PDFUploadReceiver:
+    """Incremental multipart/form-data parser for one PDF in the "file" field."""
+
+    def __init__(self, content_type: str, upload_dir: str = UPLOAD_DIR, max_bytes: int = MAX_UPLOAD_BYTES):
+        from python_multipart.multipart import MultipartParser, parse_options_header
+
+        mime, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if mime != b"multipart/form-data" or not boundary:
+            raise UploadRejected(400, "Expected a multipart/form-data body.")
+
+        self._parse_options_header = parse_options_header
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.fields: Dict[str, str] = {}
+        self.size = 0
+        self.path: Optional[str] = None
+        self.file = None
+        self.sha = hashlib.sha256()
+        self._head = b""  # first bytes of the file part, until the PDF magic is checked
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field_name: Optional[str] = None
+        self._field_value = b""
+        self._in_file = False
+        self._file_done = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._append_header("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._append_header("_header_value", data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        })
+
+    def _append_header(self, attr: str, data: bytes) -> None:
+        value = getattr(self, attr) + data
+        if len(value) > MAX_FORM_FIELD_BYTES:
+            raise UploadRejected(400, "Multipart header too large.")
+        setattr(self, attr, value)
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+        self._field_name = None
+        self._field_value = b""
+
+    def _on_header_end(self) -> None:
+        if self._header_field.strip().lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = self._parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name == "file":
+            if self._file_done:
+                raise UploadRejected(400, "Only one file can be uploaded at a time.")
+            os.makedirs(self.upload_dir, exist_ok=True)
+            self.path = os.path.join(self.upload_dir, f".incoming-{uuid.uuid4().hex}.part")
+            self.file = open(self.path, "wb", buffering=UPLOAD_CHUNK_BYTES)
+            self._in_file = True
+        else:
+            self._field_name = name
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        if not self._in_file:
+            self._field_value += chunk
+            limit = MAX_CONTEXT_FIELD_BYTES if self._field_name == "patient_context" else MAX_FORM_FIELD_BYTES
+            if len(self._field_value) > limit:
+                raise UploadRejected(400, f"Form field '{self._field_name}' is too large.")
+            return
+
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"File exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit.")
+        if len(self._head) < len(PDF_MAGIC):
+            self._head += chunk[:len(PDF_MAGIC) - len(self._head)]
+            if len(self._head) == len(PDF_MAGIC) and self._head != PDF_MAGIC:
+                raise UploadRejected(415, "Only PDF files can be uploaded.")
+        self.sha.update(chunk)
+        self.file.write(chunk)
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+            self.file.close()
+        elif self._field_name:
+            self.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
+
+    def feed(self, chunk: bytes) -> None:
+        self.parser.write(chunk)
+
+    def finish(self) -> Dict[str, Any]:
+        """Complete the upload. Returns the temporary path, content hash, size and form fields."""
+        self.parser.finalize()
+        if not self._file_done:
+            raise UploadRejected(400, "No complete 'file' part in the upload.")
+        if self._head != PDF_MAGIC:
+            raise UploadRejected(415, "Only PDF files can be uploaded.")
+        return {"path": self.path, "content_hash": self.sha.hexdigest(), "bytes": self.size, "fields": self.fields}
+
+    def discard(self) -> None:
+        if self.file and not self.file.closed:
+            self.file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def check_page_count(pdf_path: str, max_pages: int = MAX_UPLOAD_PAGES) -> int:
+    """Page count of a received upload; raises UploadRejected if unreadable or too long."""
+    from pdf2image import pdfinfo_from_path
+
+    try:
+        pages = int(pdfinfo_from_path(pdf_path)["Pages"])
+    except Exception as e:
+        raise UploadRejected(400, f"The PDF could not be read ({e}).")
+    if pages > max_pages:
+        raise UploadRejected(413, f"The PDF has {pages} pages; at most {max_pages} are accepted.")
+    return pages
+
+
+# -----------------------------------
+# Partial JSON Repair
+# -----------------------------------
+
+def _close_json(text: str) -> str:
+    """Close an unterminated string and any open brackets at the end of text."""
+    stack: List[str] = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",").rstrip()
+    if text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(stack))
+
+
+def _comma_positions(text: str) -> List[int]:
+    positions, in_string, escaped = [], False, False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            positions.append(i)
+    return positions
+
+
+def repair_json(content: str, max_attempts: int = 20) -> Optional[Any]:
+    """
+    Best-effort recovery of a truncated or slightly malformed JSON object from
+    LLM output: drops code fences and trailing commas, closes open strings and
+    brackets, and if needed cuts back to earlier element boundaries.
+    """
+    start = content.find("{")
+    if start == -1:
+        return None
+    text = re.sub(r"```\s*$", "", content[start:].strip())
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+
+    try:
+        # A complete object followed by trailing prose
+        return json.JSONDecoder().raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+
+    candidates = [text] + [text[:pos] for pos in reversed(_comma_positions(text))]
+    for candidate in candidates[:max_attempts]:
+        try:
+            return json.loads(_close_json(candidate))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+# -----------------------------------
+# Background Sweeper
+# -----------------------------------
+
+def sweep_failed_ingestions(mongo_uri: Optional[str] = None, db_name: str = DB_NAME) -> int:
+    """Retry every failed ingestion whose backoff has elapsed. Returns the number recovered."""
+    from preprocessing import MedicalReportProcessor
+
+    recovered = 0
+    processors: Dict[str, MedicalReportProcessor] = {}
+    store = IngestionStore(get_db(mongo_uri, db_name))
+    for job in list(store.retryable_jobs()):
+        username = job["username"]
+        if username not in processors:
+            processors[username] = MedicalReportProcessor(username, mongo_uri=mongo_uri, db_name=db_name)
+        if processors[username].run_ingestion(job):
+            recovered += 1
+    return recovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retry failed report ingestions from their last completed stage.")
+    parser.add_argument("--mongo-uri", default=None, help="Defaults to MONGO_URI")
+    parser.add_argument("--interval", type=int, default=0, help="Seconds between sweeps; 0 runs once")
+    args = parser.parse_args()
+
+    while True:
+        recovered = sweep_failed_ingestions(mongo_uri=args.mongo_uri)
+        print(f"Sweep complete: {recovered} ingestion(s) recovered.")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from analytes import analyte_matcher, normalize_name
+
+# -----------------------------------
+# Abnormality Flags
+# -----------------------------------
+
+FLAG_NORMAL = "N"
+FLAG_HIGH = "H"
+FLAG_LOW = "L"
+FLAG_CRITICAL_HIGH = "HH"
+FLAG_CRITICAL_LOW = "LL"
+
+ABNORMAL_FLAGS = [FLAG_HIGH, FLAG_LOW, FLAG_CRITICAL_HIGH, FLAG_CRITICAL_LOW]
+
+# A value is critical when it lies beyond these multiples of its reference bounds
+CRITICAL_HIGH_FACTOR = 2.0
+CRITICAL_LOW_FACTOR = 0.5
+
+# First signed decimal number in a string, e.g. "<0.5" -> 0.5, "13.2 g/dL" -> 13.2
+_NUMBER_PATTERN = r"([-+]?\d*\.?\d+)"
+
+
+def parse_numeric(values: pd.Series) -> pd.Series:
+    """Extract the first number from each string, NaN where there is none."""
+    cleaned = values.fillna("").astype(str).str.replace(",", "", regex=False)
+    return pd.to_numeric(cleaned.str.extract(_NUMBER_PATTERN, expand=False), errors="coerce")
+
+
+def compute_flags(values, lower, upper) -> np.ndarray:
+    """
+    Classify each value against its reference bounds.
+
+    Returns an object array of FLAG_* codes, or None where the value or
+    both bounds are missing.
+    """
+    values = np.asarray(values, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+
+    with np.errstate(invalid="ignore"):
+        conditions = [
+            np.isnan(values) | (np.isnan(lower) & np.isnan(upper)),
+            values > upper * CRITICAL_HIGH_FACTOR,
+            values < lower * CRITICAL_LOW_FACTOR,
+            values > upper,
+            values < lower,
+        ]
+    choices = [None, FLAG_CRITICAL_HIGH, FLAG_CRITICAL_LOW, FLAG_HIGH, FLAG_LOW]
+    return np.select(conditions, choices, default=FLAG_NORMAL).astype(object)
+
+
+def parse_report_date(value: Optional[str]) -> Optional[datetime]:
+    """Parse a report date string such as "12/03/2024 10:15 AM" (day first)."""
+    if not value:
+        return None
+    timestamp = pd.to_datetime(value, dayfirst=True, errors="coerce")
+    return None if pd.isna(timestamp) else timestamp.to_pydatetime()
+
+
+def parse_tests(tests: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Turn the LLM "Tests" list into one row per test with numeric values,
+    numeric reference bounds and a precomputed flag. Names are mapped to
+    canonical analytes; unmatched ones keep their normalized name and are
+    marked with analyte_matched=False.
+    """
+    df = pd.DataFrame({
+        "test_name": [t.get("Name") for t in tests],
+        "result": [t.get("Result") for t in tests],
+        "unit": [t.get("Unit") for t in tests],
+        "lower": [(t.get("Reference Interval") or {}).get("Lower", "") for t in tests],
+        "upper": [(t.get("Reference Interval") or {}).get("Upper", "") for t in tests],
+    })
+
+    matched = df["test_name"].map(analyte_matcher.match)
+    df["analyte_matched"] = matched.notna()
+    df["canonical_name"] = matched.fillna(df["test_name"].map(normalize_name))
+    # Blank units of matched analytes get the registry default
+    fill_unit = (df["unit"].fillna("").astype(str).str.strip() == "") & df["analyte_matched"]
+    df.loc[fill_unit, "unit"] = matched[fill_unit].map(analyte_matcher.default_unit)
+    df["reference_interval"] = df["lower"].fillna("").astype(str) + " - " + df["upper"].fillna("").astype(str)
+    df["result_value"] = parse_numeric(df["result"])
+    df["ref_lower"] = parse_numeric(df["lower"])
+    df["ref_upper"] = parse_numeric(df["upper"])
+    df["flag"] = compute_flags(df["result_value"], df["ref_lower"], df["ref_upper"])
+
+    return df.drop(columns=["lower", "upper"])
+
+
+def to_documents(df: pd.DataFrame, **fields: Any) -> List[Dict[str, Any]]:
+    """Convert a frame to MongoDB documents, mapping NaN to None and adding constant fields."""
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    for record in records:
+        record.update(fields)
+    return records
+
+
+# -----------------------------------
+# Longitudinal Trends
+# -----------------------------------
+
+def compute_trends(tests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Build per-analyte time series from test documents spanning several reports.
+
+    Each point carries the change since the previous result, the rate of change
+    per day and the current run of consecutive out-of-range results.
+    """
+    if not tests:
+        return []
+
+    df = pd.DataFrame(tests, columns=["report_id", "canonical_name", "test_name", "unit",
+                                      "collected_at", "result_value", "flag"])
+    df["collected_at"] = pd.to_datetime(df["collected_at"])
+    df["result_value"] = pd.to_numeric(df["result_value"], errors="coerce")
+    df = df.sort_values(["canonical_name", "collected_at"], kind="stable").reset_index(drop=True)
+
+    grouped = df.groupby("canonical_name", sort=False)
+    df["delta"] = grouped["result_value"].diff()
+    elapsed_days = grouped["collected_at"].diff().dt.total_seconds() / 86400
+    df["rate_per_day"] = df["delta"] / elapsed_days.replace(0, np.nan)
+
+    # A new run starts at every in-range result and at every analyte boundary
+    abnormal = df["flag"].isin(ABNORMAL_FLAGS)
+    run_break = ~abnormal | (df["canonical_name"] != df["canonical_name"].shift())
+    df["out_of_range_streak"] = abnormal.astype(int).groupby(run_break.cumsum()).cumsum()
+
+    df = df.astype(object).where(df.notna(), None)
+
+    trends = []
+    for analyte, series in df.groupby("canonical_name", sort=False):
+        values = [v for v in series["result_value"] if v is not None]
+        trends.append({
+            "analyte": analyte,
+            "test_name": series["test_name"].iloc[-1],
+            "unit": series["unit"].iloc[-1],
+            "count": len(series),
+            "latest_value": series["result_value"].iloc[-1],
+            "change": values[-1] - values[0] if len(values) > 1 else None,
+            "current_streak": series["out_of_range_streak"].iloc[-1],
+            "max_streak": max(series["out_of_range_streak"]),
+            "points": [
+                {
+                    "report_id": row["report_id"],
+                    "collected_at": row["collected_at"],
+                    "value": row["result_value"],
+                    "flag": row["flag"],
+                    "delta": row["delta"],
+                    "rate_per_day": row["rate_per_day"],
+                    "out_of_range_streak": row["out_of_range_streak"]
+                }
+                for row in series.to_dict("records")
+            ]
+        })
+    return trends
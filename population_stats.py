@@ -0,0 +1,379 @@
+import math
+import time
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import DB_NAME, NOT_DELETED, get_db
+
+# -----------------------------------
+# Population Reference Statistics
+# -----------------------------------
+# One document per (analyte, unit, age band, gender) holding the count, sum and
+# sum of squares of all results plus a log-bucketed quantile sketch (DDSketch
+# style). Every field is additive, so a report's results are added with a single
+# $inc per group when it is stored and subtracted the same way when it is purged.
+
+AGE_BAND_YEARS = 10
+# Ages at or above this share the last band
+MAX_AGE_BAND = 80
+# Quantiles read from the sketch are within this relative error of the true value
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Columns a result is grouped by; also the fields of each statistics document
+GROUP_FIELDS = ["analyte", "unit", "age_band", "gender"]
+
+REBUILD_BATCH_SIZE = 50000
+# A running rebuild holds a lock; reports stored meanwhile are deferred and
+# removals journaled, and both are replayed once the rebuilt statistics are live
+REBUILD_LOCK_ID = "rebuild"
+# Time for updates that started before the lock (or its release) to land
+REBUILD_GRACE_SECONDS = 5
+# A lock older than this was left by a crashed rebuild and is ignored
+REBUILD_LOCK_TIMEOUT_SECONDS = 6 * 3600
+
+
+def age_band(age: Any) -> str:
+    try:
+        years = int(float(age))
+    except (TypeError, ValueError):
+        return "unknown"
+    if years >= MAX_AGE_BAND:
+        return f"{MAX_AGE_BAND}+"
+    start = max(years, 0) // AGE_BAND_YEARS * AGE_BAND_YEARS
+    return f"{start}-{start + AGE_BAND_YEARS - 1}"
+
+
+def normalize_gender(gender: Any) -> str:
+    value = str(gender or "").strip().lower()
+    return {"m": "male", "f": "female"}.get(value, value or "unknown")
+
+
+def normalize_unit(unit: Any) -> str:
+    return str(unit or "").strip().lower()
+
+
+def stats_key(analyte: str, unit: Optional[str], band: str, gender: str) -> str:
+    return "|".join([analyte, normalize_unit(unit), band, gender])
+
+
+def bucket_keys(values: np.ndarray) -> np.ndarray:
+    """Sketch bucket of each value: p<i>/n<i> covers |v| in (gamma^(i-1), gamma^i], z is zero."""
+    magnitude = np.abs(values)
+    index = np.ceil(np.log(np.where(magnitude > 0, magnitude, 1)) / math.log(SKETCH_GAMMA)).astype(int)
+    sign = np.where(values > 0, "p", np.where(values < 0, "n", "z"))
+    return np.where(sign == "z", "z", np.char.add(sign, index.astype(str)))
+
+
+def bucket_value(bucket: str) -> float:
+    """Representative value of a bucket (the point with the smallest relative error)."""
+    if bucket == "z":
+        return 0.0
+    value = 2 * SKETCH_GAMMA ** int(bucket[1:]) / (SKETCH_GAMMA + 1)
+    return value if bucket[0] == "p" else -value
+
+
+def aggregate(df: pd.DataFrame) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Per-group count, sum, sum of squares and bucket counts of a frame with
+    canonical_name, unit, result_value, age_band and gender columns, keyed by
+    (analyte, unit, age band, gender). The fields stay separate, so OCR'd units
+    containing "|" cannot break the group.
+    """
+    df = df[df["result_value"].notna() & (df["canonical_name"].fillna("") != "")]
+    if df.empty:
+        return {}
+
+    values = df["result_value"].astype(float)
+    frame = pd.DataFrame({
+        "analyte": df["canonical_name"],
+        "unit": df["unit"].map(normalize_unit),
+        "age_band": df["age_band"],
+        "gender": df["gender"],
+        "value": values,
+        "sq": values ** 2,
+        "bucket": bucket_keys(values.to_numpy())
+    })
+
+    totals = frame.groupby(GROUP_FIELDS).agg(count=("value", "size"), sum=("value", "sum"), sum_sq=("sq", "sum"))
+    buckets = frame.groupby([*GROUP_FIELDS, "bucket"]).size()
+
+    groups = {
+        group: {"count": int(count), "sum": float(total), "sum_sq": float(sum_sq), "buckets": {}}
+        for group, count, total, sum_sq in totals.itertuples()
+    }
+    for (*group, bucket), count in buckets.items():
+        groups[tuple(group)]["buckets"][bucket] = int(count)
+    return groups
+
+
+def stats_updates(groups: Dict[tuple, Dict[str, Any]], sign: int = 1) -> List[UpdateOne]:
+    updates = []
+    for (analyte, unit, band, gender), group in groups.items():
+        increments = {"count": sign * group["count"], "sum": sign * group["sum"], "sum_sq": sign * group["sum_sq"]}
+        increments.update({f"buckets.{bucket}": sign * count for bucket, count in group["buckets"].items()})
+        updates.append(UpdateOne(
+            {"_id": stats_key(analyte, unit, band, gender)},
+            {"$inc": increments, "$setOnInsert": {"analyte": analyte, "unit": unit, "age_band": band, "gender": gender}},
+            upsert=True
+        ))
+    return updates
+
+
+def apply_report_stats(db, tests_df: pd.DataFrame, age: Any, gender: Any, sign: int = 1) -> None:
+    """Add (sign=1) or remove (sign=-1) one report's results."""
+    if tests_df.empty:
+        return
+    df = tests_df[["canonical_name", "unit", "result_value"]].assign(
+        age_band=age_band(age), gender=normalize_gender(gender)
+    )
+    updates = stats_updates(aggregate(df), sign)
+    if updates:
+        db["population_stats"].bulk_write(updates, ordered=False)
+
+
+def rebuild_running(db) -> bool:
+    cutoff = datetime.utcnow() - timedelta(seconds=REBUILD_LOCK_TIMEOUT_SECONDS)
+    return db["population_stats_meta"].count_documents({"_id": REBUILD_LOCK_ID, "started_at": {"$gte": cutoff}}) > 0
+
+
+def record_report_stats(db, report_id: str, tests_df: pd.DataFrame, age: Any, gender: Any) -> None:
+    """Count a newly stored report and mark it, or defer it while a rebuild runs."""
+    if rebuild_running(db):
+        db["patients"].update_one({"report_id": report_id}, {"$set": {"stats_deferred": True}})
+        return
+    apply_report_stats(db, tests_df, age, gender)
+    db["patients"].update_one({"report_id": report_id}, {"$set": {"stats_recorded": True}})
+
+
+def report_tests(db, report_id: str) -> List[Dict[str, Any]]:
+    return list(db["tests"].find(
+        {"report_id": report_id},
+        {"_id": 0, "canonical_name": 1, "unit": 1, "result_value": 1}
+    ))
+
+
+def results_frame(tests: List[Dict[str, Any]]) -> pd.DataFrame:
+    return pd.DataFrame(tests).reindex(columns=["canonical_name", "unit", "result_value"])
+
+
+def remove_report_stats(db, patient: Dict[str, Any]) -> None:
+    """Subtract a stored report's results, if they were counted, and clear its markers."""
+    journal = rebuild_running(db)
+    if patient.get("stats_recorded") or journal:
+        tests = report_tests(db, patient["report_id"])
+        if tests and journal:
+            # The live statistics are being replaced; the rebuild subtracts this
+            # report after the swap if it counted it
+            db["population_stats_journal"].insert_one({
+                "report_id": patient["report_id"], "version": patient.get("version"),
+                "age": patient.get("age"), "gender": patient.get("gender"), "tests": tests
+            })
+        elif tests:
+            apply_report_stats(db, results_frame(tests), patient.get("age"), patient.get("gender"), sign=-1)
+    db["patients"].update_one({"report_id": patient["report_id"], "version": patient.get("version")},
+                              {"$unset": {"stats_recorded": "", "stats_deferred": ""}})
+
+
+def replay_deferred_stats(db) -> int:
+    """Count reports deferred during a rebuild that the rebuild did not already count."""
+    replayed = 0
+    for patient in db["patients"].find({"stats_deferred": True, **NOT_DELETED},
+                                       {"_id": 0, "report_id": 1, "version": 1}):
+        claimed = db["patients"].find_one_and_update(
+            {"report_id": patient["report_id"], "version": patient.get("version"), "stats_deferred": True},
+            {"$unset": {"stats_deferred": ""}}
+        )
+        if not claimed or claimed.get("stats_recorded"):
+            continue
+        tests = report_tests(db, claimed["report_id"])
+        if tests:
+            apply_report_stats(db, results_frame(tests), claimed.get("age"), claimed.get("gender"))
+        db["patients"].update_one({"report_id": claimed["report_id"], "version": claimed.get("version")},
+                                  {"$set": {"stats_recorded": True}})
+        replayed += 1
+    return replayed
+
+
+# -----------------------------------
+# Reading Statistics
+# -----------------------------------
+
+def summarize(doc: Dict[str, Any], value: Optional[float] = None) -> Dict[str, Any]:
+    count = doc.get("count", 0)
+    buckets = sorted(
+        ((bucket_value(bucket), n) for bucket, n in doc.get("buckets", {}).items() if n > 0),
+        key=lambda item: item[0]
+    )
+    summary: Dict[str, Any] = {
+        "analyte": doc.get("analyte"),
+        "unit": doc.get("unit"),
+        "age_band": doc.get("age_band"),
+        "gender": doc.get("gender"),
+        "count": count
+    }
+    if count <= 0 or not buckets:
+        return summary
+
+    mean = doc["sum"] / count
+    summary["mean"] = round(mean, 4)
+    summary["std"] = round(math.sqrt(max(doc["sum_sq"] / count - mean ** 2, 0.0)), 4)
+
+    cumulative = np.cumsum([n for _, n in buckets])
+    summary["quantiles"] = {
+        f"p{int(q * 100)}": round(buckets[min(int(np.searchsorted(cumulative, q * cumulative[-1])), len(buckets) - 1)][0], 4)
+        for q in QUANTILES
+    }
+
+    if value is not None:
+        # Compared at sketch resolution: results in the value's own bucket count as half
+        position = bucket_value(str(bucket_keys(np.array([value], dtype=float))[0]))
+        below = sum(n for v, n in buckets if v < position)
+        equal = sum(n for v, n in buckets if v == position)
+        summary["value"] = value
+        summary["percentile"] = round(float(100 * (below + equal / 2) / cumulative[-1]), 1)
+    return summary
+
+
+# -----------------------------------
+# Full Rebuild
+# -----------------------------------
+
+def rebuild_population_stats(mongo_uri: Optional[str] = None, db_name: str = DB_NAME,
+                             batch_size: int = REBUILD_BATCH_SIZE,
+                             grace_seconds: float = REBUILD_GRACE_SECONDS) -> int:
+    """
+    Recompute all statistics from the tests collection in columnar batches and
+    swap them in atomically. Reports stored or removed while this runs are
+    replayed afterwards, so no concurrent update is lost. Returns the number of groups.
+    """
+    db = get_db(mongo_uri, db_name)
+    meta = db["population_stats_meta"]
+    started_at = datetime.utcnow()
+    meta.delete_one({"_id": REBUILD_LOCK_ID,
+                     "started_at": {"$lt": started_at - timedelta(seconds=REBUILD_LOCK_TIMEOUT_SECONDS)}})
+    try:
+        meta.insert_one({"_id": REBUILD_LOCK_ID, "started_at": started_at})
+    except DuplicateKeyError:
+        raise RuntimeError("A population statistics rebuild is already running")
+
+    try:
+        db["population_stats_journal"].drop()
+        time.sleep(grace_seconds)
+        groups, scanned = _rebuild_snapshot(db, started_at, batch_size)
+        _sync_markers(db, scanned, batch_size)
+        _replay_journal(db, scanned)
+    finally:
+        db["population_stats_journal"].drop()
+        meta.delete_one({"_id": REBUILD_LOCK_ID})
+
+    time.sleep(grace_seconds)
+    replayed = replay_deferred_stats(db)
+    if replayed:
+        print(f"Replayed population statistics of {replayed} report(s) stored during the rebuild.")
+    return groups
+
+
+def _rebuild_snapshot(db, started_at: datetime, batch_size: int):
+    """Build and swap in the statistics of reports stored before the lock; returns (groups, scanned versions)."""
+    # Reports created after the lock are deferred by record_report_stats instead. ObjectIds
+    # have second resolution, so the lock's own second is included; its reports are
+    # complete after the grace period
+    boundary = ObjectId.from_datetime(started_at.replace(microsecond=0) + timedelta(seconds=1))
+    demographics: Dict[str, tuple] = {}
+    scanned: Dict[str, Any] = {}
+    for patient in db["patients"].find(
+        {**NOT_DELETED, "_id": {"$lt": boundary}},
+        {"_id": 0, "report_id": 1, "age": 1, "gender": 1, "version": 1}
+    ):
+        demographics[patient["report_id"]] = (age_band(patient.get("age")), normalize_gender(patient.get("gender")))
+        scanned[patient["report_id"]] = patient.get("version")
+
+    totals: Dict[tuple, Dict[str, Any]] = defaultdict(lambda: {"count": 0, "sum": 0.0, "sum_sq": 0.0, "buckets": defaultdict(int)})
+    cursor = db["tests"].find(
+        {"result_value": {"$ne": None}},
+        {"_id": 0, "report_id": 1, "canonical_name": 1, "unit": 1, "result_value": 1}
+    ).batch_size(batch_size)
+
+    def flush(batch):
+        df = pd.DataFrame(batch).reindex(columns=["report_id", "canonical_name", "unit", "result_value"])
+        df = df[df["report_id"].isin(demographics.keys())]
+        if df.empty:
+            return
+        bands = df["report_id"].map(demographics)
+        df = df.assign(age_band=bands.str[0], gender=bands.str[1])
+        for key, group in aggregate(df).items():
+            total = totals[key]
+            total["count"] += group["count"]
+            total["sum"] += group["sum"]
+            total["sum_sq"] += group["sum_sq"]
+            for bucket, count in group["buckets"].items():
+                total["buckets"][bucket] += count
+
+    batch: List[Dict[str, Any]] = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    staging = db["population_stats_rebuild"]
+    staging.drop()
+    docs = []
+    for (analyte, unit, band, gender), total in totals.items():
+        docs.append({"_id": stats_key(analyte, unit, band, gender), "analyte": analyte, "unit": unit, "age_band": band, "gender": gender,
+                     "count": total["count"], "sum": total["sum"], "sum_sq": total["sum_sq"],
+                     "buckets": dict(total["buckets"])})
+    if docs:
+        staging.insert_many(docs)
+        staging.rename("population_stats", dropTarget=True)
+    else:
+        db["population_stats"].drop()
+    return len(docs), scanned
+
+
+def _sync_markers(db, scanned: Dict[str, Any], batch_size: int) -> None:
+    """Mark exactly the scanned report versions as counted and clear the marker of every other."""
+    updates: List[UpdateOne] = []
+    for patient in db["patients"].find({}, {"_id": 0, "report_id": 1, "version": 1, "stats_recorded": 1}):
+        report_id, version = patient["report_id"], patient.get("version")
+        counted = report_id in scanned and scanned[report_id] == version
+        if counted != bool(patient.get("stats_recorded")):
+            change = {"$set": {"stats_recorded": True}} if counted else {"$unset": {"stats_recorded": ""}}
+            updates.append(UpdateOne({"report_id": report_id, "version": version}, change))
+        if len(updates) >= batch_size:
+            db["patients"].bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        db["patients"].bulk_write(updates, ordered=False)
+
+
+def _replay_journal(db, scanned: Dict[str, Any]) -> None:
+    """Subtract reports removed during the rebuild that the rebuild counted."""
+    for entry in db["population_stats_journal"].find({}, {"_id": 0}):
+        if entry["report_id"] in scanned and scanned[entry["report_id"]] == entry.get("version"):
+            apply_report_stats(db, results_frame(entry["tests"]), entry.get("age"), entry.get("gender"), sign=-1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild population reference statistics from all stored tests.")
+    parser.add_argument("--mongo-uri", default=None, help="Defaults to MONGO_URI")
+    parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    groups = rebuild_population_stats(mongo_uri=args.mongo_uri, batch_size=args.batch_size)
+    print(f"Rebuilt population statistics: {groups} group(s).")
+
+
+if __name__ == "__main__":
+    main()
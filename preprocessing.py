@@ -1,31 +1,103 @@
 import re
 import os
 import json
-import uuid
+import time
+import subprocess
 import requests
-from pdf2image import convert_from_path
+from datetime import datetime
 from PIL import Image
 import pytesseract
-from pymongo import MongoClient
+from pdf2image import pdfinfo_from_path
+from pymongo import ASCENDING, TEXT, UpdateOne
 from dotenv import load_dotenv
 
+from database import DB_NAME, get_client
+
+from lab_values import parse_tests, parse_report_date, to_documents
+from population_stats import record_report_stats, remove_report_stats
+from ocr_preprocessing import OCRPreprocessingConfig, rasterize_page
+from profiling import profile, stage
+from usage import QuotaExceeded, check_quota, record_usage
+from chatbot import schedule_initial_analysis
+from ingestion import (
+    IngestionStore, repair_json,
+    STAGE_UPLOADED, STAGE_TEXT_EXTRACTED, STAGE_PARSED, STAGE_STORED
+)
+
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+PARSER_MODEL = "compound-beta"
+
+# A page whose text layer has fewer alphanumeric characters than this is treated as scanned
+MIN_TEXT_LAYER_CHARS = 50
+
 class MedicalReportProcessor:
-    def __init__(self, username, mongo_uri="mongodb://localhost:27017", db_name="mediway"):
+    # (mongo_uri, db_name) pairs whose indexes were already ensured by this process
+    _indexed_databases = set()
+
+    def __init__(self, username, mongo_uri=None, db_name=DB_NAME, ocr_config=None, max_pages=1):
         self.username = username  # From Streamlit session
-        self.client = MongoClient(mongo_uri)
+        self.ocr_config = ocr_config or OCRPreprocessingConfig()
+        self.max_pages = max_pages
+        self.client = get_client(mongo_uri)  # Shared per process instead of one client per upload
         self.db = self.client[db_name]
         self.patients = self.db["patients"]
         self.tests = self.db["tests"]
+        self.unmatched_analytes = self.db["unmatched_analytes"]
+        self.ingestions = IngestionStore(self.db)
+        self.last_content_hash = None  # Lets callers offer a retry of the last upload
+
+        if (mongo_uri, db_name) not in MedicalReportProcessor._indexed_databases:
+            self.ensure_indexes()
+            MedicalReportProcessor._indexed_databases.add((mongo_uri, db_name))
+
+    def ensure_indexes(self):
+        self.ingestions.ensure_indexes()
+        self.patients.create_index("report_id")
+        # Listing a user's reports newest first and finding those pending purge
+        self.patients.create_index([("username", ASCENDING), ("reported_date", ASCENDING)])
+        # Indexes backing the abnormal-only and per-analyte flag queries
+        self.tests.create_index([("report_id", ASCENDING), ("flag", ASCENDING)])
+        self.tests.create_index([("username", ASCENDING), ("test_name", ASCENDING), ("flag", ASCENDING)])
+        self.tests.create_index([("username", ASCENDING), ("canonical_name", ASCENDING), ("collected_at", ASCENDING)])
+        # Report search: flag/date filters and free-text matching of test names
+        self.tests.create_index([("username", ASCENDING), ("flag", ASCENDING), ("collected_at", ASCENDING)])
+        self.tests.create_index(
+            [("username", ASCENDING), ("canonical_name", TEXT), ("test_name", TEXT)],
+            name="test_name_search", default_language="none"
+        )
+
+    def count_pages(self, pdf_file):
+        try:
+            return int(pdfinfo_from_path(pdf_file)["Pages"])
+        except Exception as e:
+            print(f"Error reading PDF info: {e}")
+            return 1
 
-    def extract_first_page_as_image(self, pdf_file, output_file):
+    def extract_text_layer(self, pdf_file, page):
+        # Digitally generated PDFs carry a text layer; poppler's pdftotext (already
+        # required by pdf2image) reads it with column layout preserved.
         try:
-            images = convert_from_path(pdf_file, dpi=300, first_page=1, last_page=1)
-            images[0].save(output_file, "PNG")
-            print(f"First page successfully saved as an image: {output_file}")
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-f", str(page), "-l", str(page), pdf_file, "-"],
+                capture_output=True, text=True, check=True, timeout=30
+            )
+            return result.stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Error reading PDF text layer: {e}")
+            return ""
+
+    @staticmethod
+    def has_text_layer(text):
+        return sum(c.isalnum() for c in text or "") >= MIN_TEXT_LAYER_CHARS
+
+    def extract_page_as_image(self, pdf_file, output_file, page=1):
+        try:
+            image = rasterize_page(pdf_file, page=page, config=self.ocr_config)
+            image.save(output_file, "PNG")
+            print(f"Page {page} successfully saved as an image: {output_file}")
             return True
         except Exception as e:
             print(f"Error extracting PDF page: {e}")
@@ -41,7 +113,39 @@ class MedicalReportProcessor:
             print(f"Error extracting text from image: {e}")
             return None
 
-    def parse_report_text_llm(self, text):
+    def extract_report_text(self, pdf_path, temp_image_path):
+        """
+        Extract text page by page, reading the embedded text layer where there is
+        one and falling back to rasterize + OCR for scanned pages.
+
+        Returns the combined text and per-page records of the path taken and time spent.
+        """
+        page_texts, pages = [], []
+        for page in range(1, min(self.count_pages(pdf_path), self.max_pages) + 1):
+            start = time.perf_counter()
+            with stage("text_layer"):
+                text = self.extract_text_layer(pdf_path, page)
+            method = "text_layer"
+
+            if not self.has_text_layer(text):
+                method = "ocr"
+                text = None
+                with stage("ocr"):
+                    if self.extract_page_as_image(pdf_path, temp_image_path, page):
+                        text = self.extract_text_from_image(temp_image_path)
+
+            pages.append({
+                "page": page,
+                "method": method,
+                "seconds": round(time.perf_counter() - start, 3),
+                "chars": len(text or "")
+            })
+            if text:
+                page_texts.append(text)
+
+        return "\n\n".join(page_texts), pages
+
+    def parse_report_text_llm(self, text, report_id=None):
         if not GROQ_API_KEY:
             print("GROQ_API_KEY not found.")
             return None
@@ -80,50 +184,84 @@ Ensure:
 Raw OCR Text:
 \\n\"\"\"{text}\"\"\"
 """
+        start = time.perf_counter()
+        usage, ok = None, False
         try:
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROQ_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "compound-beta",
-                    "messages": [
-                        {"role": "system", "content": "You extract structured data from medical reports."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.1,
-                    "max_tokens": 2048
-                }
-            )
+            with stage("llm"):
+                response = requests.post(
+                    "https://api.groq.com/openai/v1/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {GROQ_API_KEY}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": PARSER_MODEL,
+                        "messages": [
+                            {"role": "system", "content": "You extract structured data from medical reports."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        "temperature": 0.1,
+                        "max_tokens": 2048
+                    },
+                    timeout=120
+                )
 
             print("==RAW LLM RESPONSE==")
             print(f"Status Code: {response.status_code}")
             print(response.text)
 
             result = response.json()
+            usage = result.get("usage")
             if "choices" not in result:
                 raise ValueError("Missing 'choices' in response")
 
             content = result["choices"][0]["message"]["content"]
-
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                json_match = re.search(r"\{.*\}", content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                    return json.loads(json_str)
-                raise ValueError("No valid JSON block found in LLM response.")
+            with stage("json_parse"):
+                parsed = self.parse_llm_json(content)
+            ok = True
+            return parsed
 
         except Exception as e:
             print("LLM parsing failed:", e)
             return None
+        finally:
+            record_usage(self.username, report_id, "ingestion", PARSER_MODEL, usage,
+                         (time.perf_counter() - start) * 1000, ok=ok)
 
-    def insert_data(self, data, report_id, name, age, gender):
+    @staticmethod
+    def parse_llm_json(content):
         try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            json_match = re.search(r"\{.*\}", content, re.DOTALL)
+            if json_match:
+                try:
+                    return json.loads(json_match.group(0))
+                except json.JSONDecodeError:
+                    pass
+            # Truncated or slightly malformed output is repaired before counting as a failure
+            repaired = repair_json(content)
+            if repaired is not None:
+                print("Recovered LLM response with partial JSON repair.")
+                return repaired
+            raise ValueError("No valid JSON block found in LLM response.")
+
+    def insert_data(self, data, report_id, name, age, gender, ingestion_stats=None):
+        try:
+            # Clear rows left by an earlier failed attempt so retries stay idempotent;
+            # the version still moves forward so cached copies of a partial report are invalidated
+            previous = self.patients.find_one_and_delete({"report_id": report_id})
+            if previous:
+                try:
+                    remove_report_stats(self.db, previous)
+                except Exception as e:
+                    print(f"Population statistics of {report_id} not subtracted: {e}")
+            self.tests.delete_many({"report_id": report_id})
+            version = (previous or {}).get("version", 0) + 1
+
             patient = data["Patient Details"]
+            # Trends are ordered by collection date; fall back to ingestion time when unparseable
+            collected_at = parse_report_date(patient.get("Collected")) or datetime.utcnow()
             patient_doc = {
                 "report_id": report_id,
                 "username": self.username,
@@ -131,53 +269,143 @@ Raw OCR Text:
                 "age": age,
                 "gender": gender,
                 "collected_date": patient.get("Collected"),
-                "reported_date": patient.get("Reported")
+                "reported_date": patient.get("Reported"),
+                "collected_at": collected_at,
+                "ingestion": ingestion_stats or {},
+                "version": version
             }
             self.patients.insert_one(patient_doc)
 
-            for test in data["Tests"]:
-                self.tests.insert_one({
-                    "report_id": report_id,
-                    "username": self.username,
-                    "test_name": test.get("Name"),
-                    "result": test.get("Result"),
-                    "unit": test.get("Unit"),
-                    "reference_interval": f"{test['Reference Interval'].get('Lower', '')} - {test['Reference Interval'].get('Upper', '')}"
-                })
+            tests_df = parse_tests(data.get("Tests", []))
+            test_docs = to_documents(tests_df, report_id=report_id, username=self.username, collected_at=collected_at)
+            if test_docs:
+                self.tests.insert_many(test_docs)
+            self.record_unmatched_analytes(tests_df)
+
+            # Population statistics are updated incrementally; the marker lets a
+            # retry or a purge subtract exactly what was added. The report is already
+            # stored, so a failure here only leaves it for the next rebuild to count
+            try:
+                record_report_stats(self.db, report_id, tests_df, age, gender)
+            except Exception as e:
+                print(f"Population statistics of {report_id} not recorded: {e}")
 
             print(f"Data committed to MongoDB with report_id: {report_id}")
+            return True
 
         except Exception as e:
             print(f"MongoDB error: {e}")
+            return False
 
-    def process_report(self, pdf_path, name, age, gender, temp_image_path=None):
+    def record_unmatched_analytes(self, tests_df):
+        # Names missing from the analyte registry are counted for later curation
+        unmatched = tests_df.loc[~tests_df["analyte_matched"], ["canonical_name", "test_name"]]
+        unmatched = unmatched[unmatched["canonical_name"] != ""].drop_duplicates("canonical_name")
+        if unmatched.empty:
+            return
+
+        now = datetime.utcnow()
+        self.unmatched_analytes.bulk_write([
+            UpdateOne(
+                {"_id": row.canonical_name},
+                {"$inc": {"count": 1}, "$set": {"example": row.test_name, "last_seen": now}},
+                upsert=True
+            )
+            for row in unmatched.itertuples()
+        ], ordered=False)
+        print(f"Unmatched analyte names: {', '.join(unmatched['test_name'].astype(str))}")
+
+    def process_report(self, pdf_path, name, age, gender, temp_image_path=None, profile_run=False, patient_context=None):
+        """
+        profile_run=True saves a sampled profile and per-stage timings of this ingestion (see profiling.py).
+        patient_context is the context the initial analysis is generated with once the report is stored.
+        """
         print(f"Processing report: {pdf_path}")
-        report_id = str(uuid.uuid4())  # Generate unique report_id
-
-        if not temp_image_path:
-            temp_image_path = f"temp_page_{report_id[:8]}.png"
-
-        print(f"[DEBUG] Using temp image file: {temp_image_path}")
-
-        if not self.extract_first_page_as_image(pdf_path, temp_image_path):
+        if profile_run:
+            with profile("ingestion"):
+                return self._process_report(pdf_path, name, age, gender, temp_image_path, patient_context)
+        return self._process_report(pdf_path, name, age, gender, temp_image_path, patient_context)
+
+    def _process_report(self, pdf_path, name, age, gender, temp_image_path=None, patient_context=None):
+        metadata = {"name": name, "age": age, "gender": gender, "patient_context": patient_context or {}}
+        with stage("upload"):
+            job = self.ingestions.save_upload(pdf_path, self.username, metadata)
+        self.last_content_hash = job["content_hash"]
+        return self.run_ingestion(job, temp_image_path)
+
+    def retry_ingestion(self, content_hash, temp_image_path=None):
+        job = self.ingestions.get(self.username, content_hash)
+        if not job:
+            print(f"No ingestion found for {content_hash}")
             return None
+        return self.run_ingestion(job, temp_image_path)
 
-        text = self.extract_text_from_image(temp_image_path)
-        if not text:
-            return None
+    def run_ingestion(self, job, temp_image_path=None):
+        """Run the remaining stages of an ingestion job, resuming after the last completed one."""
+        report_id = job["report_id"]
+        content_hash = job["content_hash"]
+        stats = job.get("ingestion_stats", {})
 
-        parsed_data = self.parse_report_text_llm(text)
-        if not parsed_data:
-            print("LLM parsing failed, skipping report.")
-            return None
+        if job["stage"] == STAGE_STORED:
+            print(f"Report already stored with report_id: {report_id}")
+            return report_id
 
-        self.insert_data(parsed_data, report_id, name, age, gender)
+        if job["stage"] == STAGE_UPLOADED:
+            raw_path = self.ingestions.raw_path(content_hash)
+            if not os.path.exists(raw_path):
+                self.ingestions.record_failure(job, "Raw upload is missing; please upload the report again.")
+                return None
 
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-            print(f"Temporary image removed: {temp_image_path}")
+            if not temp_image_path:
+                temp_image_path = f"temp_page_{report_id[:8]}.png"
+            print(f"[DEBUG] Using temp image file: {temp_image_path}")
 
-        print(f"Report processing complete: {pdf_path}")
+            start = time.perf_counter()
+            try:
+                text, pages = self.extract_report_text(raw_path, temp_image_path)
+            finally:
+                if os.path.exists(temp_image_path):
+                    os.remove(temp_image_path)
+                    print(f"Temporary image removed: {temp_image_path}")
+
+            stats = {"pages": pages, "extraction_seconds": round(time.perf_counter() - start, 3)}
+            print(f"Text extraction: {stats}")
+            if not text:
+                self.ingestions.record_failure(job, "No text could be extracted from the report.")
+                return None
+            self.ingestions.record_stage(job, STAGE_TEXT_EXTRACTED, page_text=text, ingestion_stats=stats)
+
+        if job["stage"] == STAGE_TEXT_EXTRACTED:
+            try:
+                check_quota(self.username)
+            except QuotaExceeded:
+                self.ingestions.record_failure(job, "Daily AI usage limit reached; please retry tomorrow.")
+                return None
+            start = time.perf_counter()
+            parsed_data = self.parse_report_text_llm(job["page_text"], report_id)
+            if not parsed_data:
+                self.ingestions.record_failure(job, "LLM parsing failed.")
+                return None
+            stats["parse_seconds"] = round(time.perf_counter() - start, 3)
+            self.ingestions.record_stage(job, STAGE_PARSED, parsed_data=parsed_data, ingestion_stats=stats)
+
+        if job["stage"] == STAGE_PARSED:
+            metadata = job.get("metadata", {})
+            with stage("mongo"):
+                stored = self.insert_data(
+                    job["parsed_data"], report_id,
+                    metadata.get("name"), metadata.get("age"), metadata.get("gender"),
+                    ingestion_stats=stats
+                )
+            if not stored:
+                self.ingestions.record_failure(job, "Storing the parsed report failed.")
+                return None
+            self.ingestions.record_stage(job, STAGE_STORED)
+            self.ingestions.discard_raw(content_hash)
+            # The first analysis is generated while the user is still on the upload screen
+            schedule_initial_analysis(report_id, self.username, metadata.get("patient_context"))
+
+        print(f"Report processing complete: {report_id}")
         return report_id
 
 
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+# -----------------------------------
+# On-demand Profiling
+# -----------------------------------
+# profile() samples the stacks of one request or ingestion while it runs and
+# writes them as collapsed stacks (flamegraph.pl / speedscope format) next to a
+# per-stage wall/CPU breakdown. Code marks its stages with stage("ocr") etc.;
+# with no active profile a stage costs one context-variable lookup.
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+_active_profile: ContextVar[Optional["Profile"]] = ContextVar("active_profile", default=None)
+
+
+class Profile:
+    def __init__(self, name: str, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.name = name
+        self.profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}_{name}_{uuid.uuid4().hex[:6]}"
+        self.interval = interval
+        self.samples: Counter = Counter()
+        # thread id -> stack of open stage names; threads are sampled while inside a
+        # stage, root threads (the one that started the profile) throughout
+        self.thread_stages: Dict[int, List[str]] = defaultdict(list)
+        self.root_threads = set()
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0})
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.name}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        self.wall_ms = (time.perf_counter() - self.started) * 1000
+        self.cpu_ms = (time.process_time() - self.cpu_started) * 1000
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                active = [(tid, list(stack)) for tid, stack in self.thread_stages.items()
+                          if stack or tid in self.root_threads]
+            for tid, stack in active:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join([self.name, *stack, *reversed(calls)])] += 1
+
+    def enter_stage(self, name: str) -> str:
+        with self.lock:
+            stack = self.thread_stages[threading.get_ident()]
+            stack.append(name)
+            return "/".join(stack)
+
+    def exit_stage(self, path: str, wall_ms: float, cpu_ms: float) -> None:
+        with self.lock:
+            self.thread_stages[threading.get_ident()].pop()
+            stats = self.stages[path]
+            stats["calls"] += 1
+            stats["wall_ms"] += wall_ms
+            stats["cpu_ms"] += cpu_ms
+
+    def save(self, directory: str = PROFILE_DIR) -> str:
+        """Write <id>.collapsed and <id>.json; returns the path prefix."""
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, self.profile_id)
+        with open(prefix + ".collapsed", "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        # Top-level stages can overlap when several threads work at once; the remainder is clamped at zero
+        stage_wall = sum(s["wall_ms"] for path, s in self.stages.items() if "/" not in path)
+        summary = {
+            "name": self.name,
+            "wall_ms": round(self.wall_ms, 1),
+            "cpu_ms": round(self.cpu_ms, 1),
+            "unattributed_wall_ms": round(max(self.wall_ms - stage_wall, 0.0), 1),
+            "samples": sum(self.samples.values()),
+            "sample_interval_ms": self.interval * 1000,
+            "stages": {
+                path: {"calls": s["calls"], "wall_ms": round(s["wall_ms"], 1), "cpu_ms": round(s["cpu_ms"], 1)}
+                for path, s in sorted(self.stages.items(), key=lambda item: -item[1]["wall_ms"])
+            }
+        }
+        with open(prefix + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        return prefix
+
+
+@contextmanager
+def profile(name: str, directory: str = PROFILE_DIR, sample_caller: bool = True) -> Iterator[Profile]:
+    """
+    Profile the block. The calling thread is sampled throughout unless
+    sample_caller is False (an event loop thread that only awaits); stages
+    entered in other threads that inherit the context are sampled as well.
+    """
+    current = Profile(name)
+    if sample_caller:
+        current.root_threads.add(threading.get_ident())
+        current.thread_stages[threading.get_ident()] = []
+    token = _active_profile.set(current)
+    current.start()
+    try:
+        yield current
+    finally:
+        current.stop()
+        _active_profile.reset(token)
+        print(f"Profile saved: {current.save(directory)}.collapsed / .json")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    current = _active_profile.get()
+    if current is None:
+        yield
+        return
+
+    path = current.enter_stage(name)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        current.exit_stage(path, (time.perf_counter() - wall_start) * 1000, (time.thread_time() - cpu_start) * 1000)
@@ -0,0 +1,122 @@
+import os
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from database import DB_NAME, conversation_cache, get_db
+
+# -----------------------------------
+# Background Purge of Deleted Reports
+# -----------------------------------
+# delete_report_and_related_data only marks the report deleted and queues a purge
+# job. This worker subtracts the report from the population statistics, then
+# removes everything keyed by it: tests, conversations and their archive, cached
+# answers and finally the patient document itself.
+
+PURGE_INTERVAL_SECONDS = int(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+# A job claimed by a worker that died is picked up again after this long
+PURGE_LEASE_SECONDS = 300
+MAX_PURGE_ATTEMPTS = 5
+
+# Collections whose documents reference the report by report_id
+RELATED_COLLECTIONS = ["tests", "conversations", "conversation_archive", "semantic_cache"]
+
+
+def ensure_indexes(db) -> None:
+    db["purge_jobs"].create_index("report_id", unique=True)
+    db["purge_jobs"].create_index([("status", ASCENDING), ("claimed_at", ASCENDING)])
+
+
+def purge_report(db, report_id: str) -> None:
+    from population_stats import remove_report_stats
+
+    patient = db["patients"].find_one({"report_id": report_id, "deleted": True})
+    if patient:
+        # Before the tests go, since the subtraction reads their values
+        remove_report_stats(db, patient)
+    for name in RELATED_COLLECTIONS:
+        db[name].delete_many({"report_id": report_id})
+    # Last, so an interrupted purge still finds the report marked deleted
+    db["patients"].delete_one({"report_id": report_id, "deleted": True})
+    conversation_cache.pop(report_id, None)
+
+
+def claim_job(db):
+    now = datetime.utcnow()
+    return db["purge_jobs"].find_one_and_update(
+        {
+            "attempts": {"$lt": MAX_PURGE_ATTEMPTS},
+            "$or": [
+                {"status": "pending"},
+                {"status": "running", "claimed_at": {"$lt": now - timedelta(seconds=PURGE_LEASE_SECONDS)}}
+            ]
+        },
+        {"$set": {"status": "running", "claimed_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def run_purge_jobs(mongo_uri: Optional[str] = None, db_name: str = DB_NAME, limit: int = 100) -> int:
+    """Purge up to limit queued reports. Returns the number purged."""
+    db = get_db(mongo_uri, db_name)
+    purged = 0
+    for _ in range(limit):
+        job = claim_job(db)
+        if not job:
+            break
+        try:
+            purge_report(db, job["report_id"])
+            db["purge_jobs"].delete_one({"_id": job["_id"]})
+            purged += 1
+        except Exception as e:
+            print(f"Purge of report {job['report_id']} failed: {e}")
+            db["purge_jobs"].update_one({"_id": job["_id"]}, {"$set": {"status": "pending", "error": str(e)}})
+    return purged
+
+
+def start_purge_worker(interval: int = PURGE_INTERVAL_SECONDS) -> Optional[threading.Thread]:
+    """Run the purge loop in a daemon thread of the current process. interval 0 disables it."""
+    if not interval:
+        return None
+
+    def loop():
+        indexes_ensured = False
+        while True:
+            # Retried like the jobs themselves, so a database that is down at startup
+            # delays purging instead of ending the thread
+            try:
+                if not indexes_ensured:
+                    ensure_indexes(get_db())
+                    indexes_ensured = True
+                run_purge_jobs()
+            except Exception as e:
+                print(f"Purge worker error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="purge-worker", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge data of deleted reports.")
+    parser.add_argument("--mongo-uri", default=None, help="Defaults to MONGO_URI")
+    parser.add_argument("--interval", type=int, default=0, help="Seconds between runs; 0 runs once")
+    args = parser.parse_args()
+
+    ensure_indexes(get_db(args.mongo_uri))
+    while True:
+        purged = run_purge_jobs(mongo_uri=args.mongo_uri)
+        print(f"Purge complete: {purged} report(s) removed.")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
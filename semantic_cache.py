@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING
+
+# -----------------------------------
+# Semantic Answer Cache (opt-in)
+# -----------------------------------
+# Near-duplicate questions about the same report ("is my cholesterol bad?" /
+# "is my cholesterol high?") are answered from earlier replies instead of a new
+# LLM round trip. Entries are scoped per report and per report-version/context
+# hash, so a changed report or patient context never reuses an old answer.
+# Follow-up questions that refer back to the conversation ("what about that
+# one?") are neither looked up nor stored.
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Same embedding model as evaluation/scoring.py
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Number of per-report vector indexes kept in memory
+MAX_CACHED_REPORTS = 512
+# Questions shorter than this many words usually lean on the conversation ("and LDL?")
+MIN_CACHEABLE_WORDS = 4
+# Words that refer back to earlier turns; such questions are answered from the conversation
+_FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|their|above|previous|earlier|same|again|else|"
+    r"what about|how about)\b|^(and|also|but|so|then)\b",
+    re.IGNORECASE
+)
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question depends on earlier turns, so a cached answer may not fit it."""
+    text = question.strip()
+    return len(text.split()) < MIN_CACHEABLE_WORDS or bool(_FOLLOW_UP_PATTERN.search(text))
+
+
+class SemanticCache:
+    def __init__(self, collection, threshold: float = SEMANTIC_CACHE_THRESHOLD, enabled: bool = SEMANTIC_CACHE_ENABLED):
+        self.collection = collection
+        self.threshold = threshold
+        self.enabled = enabled
+        self._model = None
+        self._lock = threading.Lock()
+        # (report_id, scope) -> (embedding matrix, answers, original latencies in ms)
+        self._indexes: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, List[str], List[float]]]" = OrderedDict()
+        self.stats = {"lookups": 0, "hits": 0, "follow_ups": 0, "latency_saved_ms": 0.0, "embedding_ms": 0.0}
+
+        if self.enabled:
+            self.collection.create_index([("report_id", ASCENDING), ("scope", ASCENDING)])
+
+    def _get_model(self):
+        if self._model is None:
+            # Loaded on first use so the backend starts without the embedding stack
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        return self._model
+
+    def embed(self, text: str) -> np.ndarray:
+        start = time.perf_counter()
+        embedding = self._get_model().encode(text, normalize_embeddings=True)
+        self.stats["embedding_ms"] += (time.perf_counter() - start) * 1000
+        return np.asarray(embedding, dtype=np.float32)
+
+    def _index(self, report_id: str, scope: str) -> Tuple[np.ndarray, List[str], List[float]]:
+        key = (report_id, scope)
+        with self._lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+
+        entries = list(self.collection.find(
+            {"report_id": report_id, "scope": scope},
+            {"_id": 0, "embedding": 1, "answer": 1, "latency_ms": 1}
+        ))
+        matrix = np.array([e["embedding"] for e in entries], dtype=np.float32) if entries else np.empty((0, 0), np.float32)
+        index = (matrix, [e["answer"] for e in entries], [e.get("latency_ms", 0.0) for e in entries])
+
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > MAX_CACHED_REPORTS:
+                self._indexes.popitem(last=False)
+        return index
+
+    def lookup(self, report_id: str, scope: str, question: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Return (cached answer or None, question embedding). The embedding is
+        handed back so a miss can be stored without encoding the question twice.
+        """
+        if not self.enabled:
+            return None, None
+        if is_follow_up(question):
+            with self._lock:
+                self.stats["follow_ups"] += 1
+            return None, None
+
+        embedding = self.embed(question)
+        matrix, answers, latencies = self._index(report_id, scope)
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            if not answers:
+                return None, embedding
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None, embedding
+            self.stats["hits"] += 1
+            self.stats["latency_saved_ms"] += latencies[best]
+        return answers[best], embedding
+
+    def store(self, report_id: str, scope: str, question: str, answer: str,
+              latency_ms: float, embedding: Optional[np.ndarray] = None) -> None:
+        if not self.enabled or is_follow_up(question):
+            return
+        if embedding is None:
+            embedding = self.embed(question)
+
+        self.collection.insert_one({
+            "report_id": report_id,
+            "scope": scope,
+            "question": question,
+            "answer": answer,
+            "embedding": embedding.tolist(),
+            "latency_ms": latency_ms,
+            "created_at": datetime.utcnow()
+        })
+
+        key = (report_id, scope)
+        with self._lock:
+            if key in self._indexes:
+                matrix, answers, latencies = self._indexes[key]
+                self._indexes[key] = (
+                    np.vstack([matrix, embedding[None, :]]) if answers else embedding[None, :],
+                    answers + [answer],
+                    latencies + [latency_ms]
+                )
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "lookups": lookups,
+            "hits": self.stats["hits"],
+            "follow_ups_skipped": self.stats["follow_ups"],
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "latency_saved_ms": round(self.stats["latency_saved_ms"], 1),
+            "avg_embedding_ms": round(self.stats["embedding_ms"] / lookups, 2) if lookups else 0.0,
+            "reports_in_memory": len(self._indexes)
+        }
@@ -0,0 +1,49 @@
+import pytest
+
+from analytes import analyte_matcher, canonical_test_name
+
+
+@pytest.mark.parametrize("name, canonical", [
+    ("Hemoglobin (HGB)", "hemoglobin"),
+    ("Haemoglobin", "hemoglobin"),
+    ("Hemoglobn", "hemoglobin"),
+    ("Creatinin", "creatinine"),
+    ("Trigylcerides", "triglycerides"),
+    ("Potasium", "potassium"),
+    ("Alkaline Phosphatse", "alkaline phosphatase"),
+    ("Vit D3", "vitamin d"),
+])
+def test_aliases_and_typos_match(name, canonical):
+    assert analyte_matcher.match(name) == canonical
+
+
+@pytest.mark.parametrize("name", [
+    # Capped edit distances that used to score exactly the threshold
+    "Magnesium", "Lipase", "Amylase", "Cortisol", "Apo B",
+    # Near spellings of different analytes
+    "Vitamin A", "Vitamin E", "Vitamin K", "Vitamin B6",
+    "Reverse T3", "Urine Glucose", "HDL/LDL Ratio",
+])
+def test_distinct_analytes_do_not_match(name):
+    assert analyte_matcher.match(name) is None
+
+
+def test_unmatched_names_fall_back_to_normalized_name():
+    assert canonical_test_name("HDL/LDL Ratio") == "hdl ldl ratio"
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("TSH", "tsh"),
+    ("vit D3", "vitamin d"),
+    ("Hemoglobin (HGB)", "hemoglobin"),
+    ("Hemoglobn", None),
+    ("liver", None),
+    ("cholesterol", None),
+    ("T3", None),
+])
+def test_match_exact_specific(name, expected):
+    assert analyte_matcher.match_exact(name, specific=True) == expected
+
+
+def test_match_exact_shared_name_still_matches_without_specific():
+    assert analyte_matcher.match_exact("cholesterol") == "total cholesterol"
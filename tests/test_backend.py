@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "_client_for", lambda mongo_uri: client)
+    return client[database.DB_NAME]
+
+
+@pytest.fixture
+def api(db):
+    import backend
+    return TestClient(backend.app)
+
+
+def test_pending_initial_analysis_answers_202_without_waiting(api, db):
+    from chatbot import context_hash
+
+    db["patients"].insert_one({"report_id": "r1", "version": 1, "initial_analysis_pending": {
+        "context_hash": context_hash(None), "started_at": datetime.utcnow()
+    }})
+    response = api.get("/analyze/r1")
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+    assert response.headers["Retry-After"]
+
+
+def test_quota_is_checked_before_admission(api, db, monkeypatch):
+    import backend
+    from usage import QuotaExceeded
+
+    def over_quota(username):
+        raise QuotaExceeded(username, 100, 100)
+
+    admitted = []
+    monkeypatch.setattr(backend, "check_quota", over_quota)
+    monkeypatch.setattr(backend.admission, "admit", admitted.append)
+    db["patients"].insert_one({"report_id": "r1", "version": 1})
+
+    response = api.get("/analyze/r1", headers={"X-Username": "alice"})
+    assert response.status_code == 429
+    assert admitted == []
+
+
+def search_filter(q=None, analyte=None, start=None, end=None):
+    from backend import build_search_filter
+    return build_search_filter("alice", q, analyte, None, False, start, end)
+
+
+def test_exact_analyte_query_uses_the_analyte_index_and_anything_else_the_text_index(db):
+    assert search_filter(q="TSH") == {"username": "alice", "canonical_name": "tsh"}
+    assert search_filter(q="cholesterol") == {"username": "alice", "$text": {"$search": "cholesterol"}}
+    assert search_filter(q="  liver   panel ")["$text"] == {"$search": '"liver panel"'}
+
+
+def test_quotes_in_the_query_cannot_break_out_of_the_phrase(db):
+    assert search_filter(q='liver" -panel "x')["$text"] == {"$search": '"liver -panel x"'}
+    assert "$text" not in search_filter(q='""')
+
+
+def test_analyte_filter_with_a_query_keeps_both(db):
+    from backend import canonical_test_name
+
+    combined = search_filter(q="TSH", analyte="vit D3")
+    assert combined["canonical_name"] == canonical_test_name("vit D3")
+    assert combined["$text"] == {"$search": "TSH"}
+
+
+def test_date_bounds_cover_the_whole_end_day(db):
+    from datetime import date
+
+    bounds = search_filter(start=date(2024, 1, 1), end=date(2024, 1, 31))["collected_at"]
+    assert bounds == {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)}
+    assert search_filter(end=date(2024, 1, 31))["collected_at"] == {"$lt": datetime(2024, 2, 1)}
+
+
+def test_deleted_reports_are_excluded_until_purged(db):
+    db["patients"].insert_many([
+        {"report_id": "r1", "username": "alice"},
+        {"report_id": "r2", "username": "alice", "deleted": True},
+        {"report_id": "r3", "username": "bob", "deleted": True}
+    ])
+    assert search_filter(q="TSH")["report_id"] == {"$nin": ["r2"]}
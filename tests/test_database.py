@@ -0,0 +1,92 @@
+import mongomock
+import pytest
+
+import database
+
+
+@pytest.fixture
+def patients(monkeypatch):
+    collection = mongomock.MongoClient().db.patients
+    monkeypatch.setattr(database, "patients_collection", collection)
+    return collection
+
+
+def test_user_reports_key_changes_on_upload_and_deletion(patients):
+    patients.insert_one({"username": "alice", "report_id": "r1"})
+    before = database.user_reports_key("alice")
+
+    patients.insert_one({"username": "alice", "report_id": "r2"})
+    after_upload = database.user_reports_key("alice")
+    assert after_upload != before
+
+    patients.update_one({"report_id": "r2"}, {"$set": {"deleted": True}})
+    assert database.user_reports_key("alice") == before
+
+
+def test_user_reports_key_ignores_other_users(patients):
+    patients.insert_one({"username": "alice", "report_id": "r1"})
+    before = database.user_reports_key("alice")
+    patients.insert_one({"username": "bob", "report_id": "r2"})
+    assert database.user_reports_key("alice") == before
+
+
+@pytest.fixture
+def conversations(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "conversations_collection", client.db.conversations)
+    monkeypatch.setattr(database, "conversation_archive_collection", client.db.conversation_archive)
+    monkeypatch.setattr(database, "_conversation_indexes_ensured", False)
+    database.conversation_cache.clear()
+    return client.db.conversations
+
+
+def test_conversation_window_is_capped_and_versioned(conversations):
+    for turn in range(database.MAX_HISTORY_ENTRIES):
+        database.update_conversation_history("r1", f"question {turn}", f"answer {turn}")
+
+    doc = conversations.find_one({"report_id": "r1"})
+    assert doc["version"] == database.MAX_HISTORY_ENTRIES
+    assert len(doc["conversation_data"]) == database.MAX_HISTORY_ENTRIES
+    assert database.get_conversation_history("r1")[-1]["content"] == f"answer {database.MAX_HISTORY_ENTRIES - 1}"
+
+
+def test_clearing_bumps_the_version(conversations):
+    database.update_conversation_history("r1", "question", "answer")
+    database.clear_conversation_history("r1")
+    doc = conversations.find_one({"report_id": "r1"})
+    assert doc["conversation_data"] == [] and doc["version"] == 2
+    assert database.get_conversation_history("r1") == []
+
+
+def test_index_failure_does_not_fail_the_chat_save(conversations, monkeypatch):
+    from pymongo.errors import OperationFailure
+
+    def fail(*args, **kwargs):
+        raise OperationFailure("index build failed", code=67)
+
+    monkeypatch.setattr(database.conversation_archive_collection, "create_index", fail)
+    database.update_conversation_history("r1", "question", "answer")
+    assert conversations.find_one({"report_id": "r1"})["version"] == 1
+    assert database._conversation_indexes_ensured is False
+
+
+def test_changed_retention_updates_the_ttl_index_in_place():
+    from pymongo.errors import OperationFailure
+
+    class Collection:
+        name = "conversation_archive"
+
+        def __init__(self):
+            self.database = self
+            self.commands = []
+
+        def create_index(self, field, expireAfterSeconds):
+            raise OperationFailure("An equivalent index already exists with different options", code=85)
+
+        def command(self, *args, **kwargs):
+            self.commands.append((args, kwargs))
+
+    target = Collection()
+    database.ensure_ttl_index(target, "archived_at", 30 * 86400)
+    assert target.commands == [(("collMod", "conversation_archive"),
+                                {"index": {"keyPattern": {"archived_at": 1}, "expireAfterSeconds": 30 * 86400}})]
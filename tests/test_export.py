@@ -0,0 +1,35 @@
+import mongomock
+import pytest
+
+import database
+import export
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "patients_collection", client.db.patients)
+    monkeypatch.setattr(export, "tests_collection", client.db.tests)
+    client.db.patients.insert_many([
+        {"username": "alice", "report_id": "r1"},
+        {"username": "alice", "report_id": "r2", "deleted": True},
+        {"username": "bob", "report_id": "r3", "deleted": True},
+    ])
+    client.db.tests.insert_many([
+        {"username": "alice", "report_id": "r1", "test_name": "TSH"},
+        {"username": "alice", "report_id": "r2", "test_name": "TSH"},
+        {"username": "bob", "report_id": "r3", "test_name": "TSH"},
+    ])
+    return client.db
+
+
+def exported_reports(query):
+    return sorted(doc["report_id"] for batch in export.iter_test_batches(query) for doc in batch)
+
+
+def test_export_of_one_user_leaves_out_deleted_reports(db):
+    assert exported_reports(export.export_filter(username="alice")) == ["r1"]
+
+
+def test_export_of_all_users_leaves_out_deleted_reports(db):
+    assert exported_reports(export.export_filter()) == ["r1"]
@@ -0,0 +1,101 @@
+import hashlib
+import os
+
+import mongomock
+import pytest
+
+from ingestion import (MAX_CONTEXT_FIELD_BYTES, MAX_FORM_FIELD_BYTES, STAGE_PARSED, STAGE_STORED, STAGE_TEXT_EXTRACTED,
+                       STATUS_COMPLETE, IngestionStore, PDFUploadReceiver, UploadRejected)
+
+BOUNDARY = "testboundary"
+PDF = b"%PDF-1.4\n" + b"0" * 5000
+
+
+def form(fields=None, file_data=PDF):
+    body = b""
+    for name, value in (fields or {}).items():
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n').encode() + value + b"\r\n"
+    if file_data is not None:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="r.pdf"\r\n'
+                 "Content-Type: application/pdf\r\n\r\n").encode() + file_data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def receiver(tmp_path, **kwargs):
+    return PDFUploadReceiver(f"multipart/form-data; boundary={BOUNDARY}", upload_dir=str(tmp_path), **kwargs)
+
+
+def feed(upload, body, chunk_size):
+    for start in range(0, len(body), chunk_size):
+        upload.feed(body[start:start + chunk_size])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 20])
+def test_pdf_is_received_whatever_the_chunking(tmp_path, chunk_size):
+    upload = receiver(tmp_path)
+    feed(upload, form({"age": b"42"}), chunk_size)
+    result = upload.finish()
+
+    assert result["bytes"] == len(PDF)
+    assert result["content_hash"] == hashlib.sha256(PDF).hexdigest()
+    assert result["fields"] == {"age": "42"}
+    with open(result["path"], "rb") as f:
+        assert f.read() == PDF
+
+
+def test_non_pdf_is_rejected_even_with_the_magic_split_across_chunks(tmp_path):
+    upload = receiver(tmp_path)
+    with pytest.raises(UploadRejected) as rejected:
+        feed(upload, form(file_data=b"%PDX-1.4 not a pdf"), 2)
+    assert rejected.value.status_code == 415
+
+
+def test_oversized_file_is_rejected_and_discarded(tmp_path):
+    upload = receiver(tmp_path, max_bytes=1024)
+    with pytest.raises(UploadRejected) as rejected:
+        feed(upload, form(), 256)
+    assert rejected.value.status_code == 413
+
+    upload.discard()
+    assert os.listdir(tmp_path) == []
+
+
+def test_form_field_limits(tmp_path):
+    with pytest.raises(UploadRejected) as rejected:
+        feed(receiver(tmp_path), form({"name": b"x" * (MAX_FORM_FIELD_BYTES + 1)}), 512)
+    assert rejected.value.status_code == 400
+
+    context = b'{"history": "' + b"x" * (MAX_CONTEXT_FIELD_BYTES - 64) + b'"}'
+    upload = receiver(tmp_path)
+    feed(upload, form({"patient_context": context}), 512)
+    assert upload.finish()["fields"]["patient_context"] == context.decode()
+
+
+def test_missing_file_part_is_rejected(tmp_path):
+    upload = receiver(tmp_path)
+    feed(upload, form({"age": b"42"}, file_data=None), 64)
+    with pytest.raises(UploadRejected) as rejected:
+        upload.finish()
+    assert rejected.value.status_code == 400
+
+
+def test_non_multipart_body_is_rejected(tmp_path):
+    with pytest.raises(UploadRejected):
+        PDFUploadReceiver("application/json", upload_dir=str(tmp_path))
+
+
+def test_intermediate_artifacts_are_dropped_once_the_report_is_stored(tmp_path):
+    store = IngestionStore(mongomock.MongoClient().db, upload_dir=str(tmp_path))
+    pdf = tmp_path / "r.pdf"
+    pdf.write_bytes(PDF)
+    job = store.save_upload(str(pdf), "alice", {})
+
+    store.record_stage(job, STAGE_TEXT_EXTRACTED, page_text="Glucose 5.1 mmol/L")
+    store.record_stage(job, STAGE_PARSED, parsed_data={"tests": []})
+    assert store.get("alice", job["content_hash"])["parsed_data"] == {"tests": []}
+
+    store.record_stage(job, STAGE_STORED)
+    saved = store.get("alice", job["content_hash"])
+    assert saved["status"] == STATUS_COMPLETE
+    assert "page_text" not in saved and "parsed_data" not in saved
+    assert "page_text" not in job and "parsed_data" not in job
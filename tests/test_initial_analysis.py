@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import chatbot
+from chatbot import context_hash, generate_initial_analysis
+
+
+@pytest.fixture
+def patients(monkeypatch):
+    collection = mongomock.MongoClient().db.patients
+    monkeypatch.setattr(chatbot, "patients_collection", collection)
+    monkeypatch.setattr(chatbot, "analyze_report",
+                        lambda report_id, patient_context=None, **kwargs: f"analysis for {patient_context}")
+    collection.insert_one({"report_id": "r1", "version": 1})
+    return collection
+
+
+def set_pending(patients, patient_context):
+    patients.update_one({"report_id": "r1"}, {"$set": {"initial_analysis_pending": {
+        "context_hash": context_hash(patient_context), "started_at": datetime.utcnow()
+    }}})
+
+
+def stored_context_hash(patients):
+    return patients.find_one({"report_id": "r1"}).get("initial_analysis", {}).get("context_hash")
+
+
+def test_scheduled_analysis_is_stored_while_pending(patients):
+    context = {"symptoms": ["fatigue"]}
+    set_pending(patients, context)
+    generate_initial_analysis("r1", context, scheduled=True)
+    assert stored_context_hash(patients) == context_hash(context)
+    assert "initial_analysis_pending" not in patients.find_one({"report_id": "r1"})
+
+
+def test_scheduled_analysis_does_not_overwrite_on_demand_one(patients):
+    upload_context, newer_context = {"symptoms": ["fatigue"]}, {"symptoms": ["headache"]}
+    set_pending(patients, upload_context)
+    generate_initial_analysis("r1", newer_context)
+    generate_initial_analysis("r1", upload_context, scheduled=True)
+    assert stored_context_hash(patients) == context_hash(newer_context)
@@ -0,0 +1,20 @@
+from lab_values import parse_tests
+
+
+def test_blank_units_of_unmatched_tests_are_left_alone():
+    df = parse_tests([
+        {"Name": "Hb", "Result": "13.2", "Unit": "g/dL"},
+        {"Name": "Zzzz", "Result": "1", "Unit": ""},
+        {"Name": "Yyyy", "Result": "abc", "Unit": ""},
+    ])
+    assert list(df["unit"]) == ["g/dL", "", ""]
+    assert list(df["analyte_matched"]) == [True, False, False]
+
+
+def test_blank_units_of_matched_tests_get_the_default_unit():
+    df = parse_tests([
+        {"Name": "Zzzz", "Result": "1", "Unit": ""},
+        {"Name": "Hemoglobin", "Result": "13.2", "Unit": ""},
+        {"Name": "Serum Creatinine", "Result": "0.9", "Unit": "mg/dl"},
+    ])
+    assert list(df["unit"]) == ["", "g/dL", "mg/dl"]
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import population_stats
+from population_stats import record_report_stats, remove_report_stats, stats_key, results_frame
+
+
+def _bulk_write(self, requests, ordered=True):
+    # mongomock's bulk_write does not accept current pymongo operations
+    for op in requests:
+        self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", _bulk_write)
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(population_stats, "get_db", lambda *args, **kwargs: database)
+    return database
+
+
+def store_report(db, report_id, value, version=1):
+    tests = [{"report_id": report_id, "canonical_name": "tsh", "unit": "uIU/mL", "result_value": value}]
+    db["patients"].insert_one({"report_id": report_id, "age": 35, "gender": "F", "version": version})
+    db["tests"].insert_many([dict(test) for test in tests])
+    record_report_stats(db, report_id, results_frame(tests), 35, "F")
+
+
+def purge_report(db, report_id):
+    remove_report_stats(db, db["patients"].find_one({"report_id": report_id}))
+    db["tests"].delete_many({"report_id": report_id})
+    db["patients"].delete_one({"report_id": report_id})
+
+
+def tsh_stats(db):
+    return db["population_stats"].find_one({"_id": stats_key("tsh", "uIU/mL", "30-39", "female")}) or {}
+
+
+def rebuild():
+    return population_stats.rebuild_population_stats(grace_seconds=0)
+
+
+def test_rebuild_marks_only_scanned_reports(db):
+    store_report(db, "r1", 2.0)
+    store_report(db, "r2", 3.0)
+    db["patients"].update_one({"report_id": "r2"}, {"$set": {"deleted": True}})
+
+    assert rebuild() == 1
+    assert tsh_stats(db)["count"] == 1
+    assert db["patients"].find_one({"report_id": "r1"})["stats_recorded"] is True
+    assert "stats_recorded" not in db["patients"].find_one({"report_id": "r2"})
+
+
+def test_updates_during_rebuild_are_replayed(db, monkeypatch):
+    store_report(db, "r1", 2.0)
+    store_report(db, "r2", 3.0)
+    snapshot = population_stats._rebuild_snapshot
+
+    def concurrent_updates(*args):
+        result = snapshot(*args)
+        # After the swap but before the lock is released
+        store_report(db, "r3", 4.0)
+        purge_report(db, "r2")
+        return result
+
+    monkeypatch.setattr(population_stats, "_rebuild_snapshot", concurrent_updates)
+    rebuild()
+
+    stats = tsh_stats(db)
+    assert stats["count"] == 2
+    assert stats["sum"] == pytest.approx(6.0)
+    patient = db["patients"].find_one({"report_id": "r3"})
+    assert patient["stats_recorded"] is True and "stats_deferred" not in patient
+    assert db["population_stats_meta"].count_documents({}) == 0
+
+
+def test_rebuild_refuses_to_run_twice(db):
+    db["population_stats_meta"].insert_one({"_id": population_stats.REBUILD_LOCK_ID, "started_at": datetime.utcnow()})
+    with pytest.raises(RuntimeError):
+        rebuild()
+
+
+def test_units_containing_the_key_separator_are_grouped(db):
+    from lab_values import parse_tests
+
+    tests_df = parse_tests([{"Name": "Hemoglobin", "Result": "13.5", "Unit": "g/d|",
+                             "Reference Interval": {"Lower": "12", "Upper": "16"}}])
+    db["patients"].insert_one({"report_id": "r1", "age": 35, "gender": "F", "version": 1})
+    db["tests"].insert_many(tests_df.assign(report_id="r1").to_dict("records"))
+    record_report_stats(db, "r1", tests_df, 35, "F")
+
+    key = stats_key("hemoglobin", "g/d|", "30-39", "female")
+    doc = db["population_stats"].find_one({"_id": key})
+    assert doc["count"] == 1 and doc["unit"] == "g/d|"
+    assert rebuild() == 1
+    assert db["population_stats"].find_one({"_id": key})["count"] == 1
+
+
+def test_stats_failure_does_not_fail_a_stored_report(db, monkeypatch):
+    from preprocessing import MedicalReportProcessor
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("stats unavailable")
+
+    processor = MedicalReportProcessor.__new__(MedicalReportProcessor)
+    processor.db, processor.username = db, "alice"
+    processor.patients, processor.tests = db["patients"], db["tests"]
+    monkeypatch.setattr("preprocessing.record_report_stats", fail)
+    monkeypatch.setattr(processor, "record_unmatched_analytes", lambda tests_df: None, raising=False)
+
+    data = {"Patient Details": {"Collected": "01/02/2024"},
+            "Tests": [{"Name": "TSH", "Result": "2.1", "Unit": "uIU/mL"}]}
+    assert processor.insert_data(data, "r1", "Alice", 35, "F") is True
+    assert db["tests"].count_documents({"report_id": "r1"}) == 1
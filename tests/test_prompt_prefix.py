@@ -0,0 +1,32 @@
+import mongomock
+import pytest
+
+import chatbot
+
+
+@pytest.fixture
+def report(monkeypatch):
+    patients = mongomock.MongoClient().db.patients
+    patients.insert_one({"report_id": "r1", "version": 1})
+    stored = {"Patient Details": {"Name": "Alice Smith"}, "Tests": [{"Name": "TSH", "Result": "2.1"}]}
+    monkeypatch.setattr(chatbot, "patients_collection", patients)
+    monkeypatch.setattr(chatbot, "fetch_patient_data", lambda report_id: stored)
+    monkeypatch.setattr(chatbot, "PROMPT_PREFIX_CACHE", True)
+    chatbot.invalidate_prompt_prefix("r1")
+    return patients, stored
+
+
+def background(prefix):
+    return prefix[0][1]["content"]
+
+
+def test_reingested_report_gets_a_new_prefix(report):
+    patients, stored = report
+    assert '"2.1"' in background(chatbot.get_prompt_prefix("r1"))
+
+    stored["Tests"][0]["Result"] = "7.9"
+    assert '"2.1"' in background(chatbot.get_prompt_prefix("r1"))  # same version: cached
+
+    patients.update_one({"report_id": "r1"}, {"$inc": {"version": 1}})
+    assert '"7.9"' in background(chatbot.get_prompt_prefix("r1"))
+    assert '"7.9"' in background(chatbot.get_prompt_prefix("r1", report_version=2))
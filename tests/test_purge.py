@@ -0,0 +1,28 @@
+import threading
+import time
+
+import mongomock
+
+import purge
+
+
+def test_purge_worker_survives_an_unreachable_database_at_startup(monkeypatch):
+    db = mongomock.MongoClient().db
+    calls = {"get_db": 0}
+    ran = threading.Event()
+
+    def get_db(*args, **kwargs):
+        calls["get_db"] += 1
+        if calls["get_db"] == 1:
+            raise ConnectionError("server selection timeout")
+        return db
+
+    real_sleep = time.sleep
+    monkeypatch.setattr(purge, "get_db", get_db)
+    monkeypatch.setattr(purge, "run_purge_jobs", lambda: ran.set())
+    monkeypatch.setattr(purge.time, "sleep", lambda seconds: real_sleep(0.01))
+
+    thread = purge.start_purge_worker(interval=3600)
+    assert ran.wait(2)
+    assert thread.is_alive()
+    assert "report_id_1" in db["purge_jobs"].index_information()
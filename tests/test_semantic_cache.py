@@ -0,0 +1,53 @@
+import mongomock
+import numpy as np
+import pytest
+
+from semantic_cache import SemanticCache, is_follow_up
+
+
+@pytest.mark.parametrize("question", [
+    "Is my cholesterol high?",
+    "Should I worry about my vitamin D level?",
+    "What does a high TSH mean for me?",
+])
+def test_standalone_questions_are_cacheable(question):
+    assert not is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "And LDL?",
+    "What about that one?",
+    "Is it dangerous for someone my age?",
+    "Can you explain those results in simpler words?",
+])
+def test_follow_up_questions_bypass_the_cache(question):
+    assert is_follow_up(question)
+
+
+class FakeModel:
+    def encode(self, text, normalize_embeddings=True):
+        vector = np.array([len(text), text.count("cholesterol"), 1.0], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def cache():
+    semantic_cache = SemanticCache(mongomock.MongoClient().db.semantic_cache, enabled=True)
+    semantic_cache._model = FakeModel()
+    return semantic_cache
+
+
+def test_near_duplicate_hits_within_a_conversation(cache):
+    answer, embedding = cache.lookup("r1", "1:ctx", "Is my cholesterol high?")
+    assert answer is None
+    cache.store("r1", "1:ctx", "Is my cholesterol high?", "It is slightly high.", 900.0, embedding)
+
+    answer, _ = cache.lookup("r1", "1:ctx", "Is my cholesterol high?")
+    assert answer == "It is slightly high."
+
+
+def test_follow_ups_are_neither_looked_up_nor_stored(cache):
+    cache.store("r1", "1:ctx", "What about that one?", "It is normal.", 900.0)
+    assert cache.collection.count_documents({}) == 0
+    assert cache.lookup("r1", "1:ctx", "What about that one?") == (None, None)
+    assert cache.metrics()["follow_ups_skipped"] == 1
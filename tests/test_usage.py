@@ -0,0 +1,82 @@
+import mongomock
+import pytest
+
+import usage
+from usage import QuotaExceeded, check_quota, record_usage, usage_summary
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(usage, "usage_collection", database.llm_usage)
+    monkeypatch.setattr(usage, "usage_daily_collection", database.llm_usage_daily)
+    monkeypatch.setattr(usage, "users_collection", database.users)
+    monkeypatch.setattr(usage, "_usage_indexes_ensured", False)
+    monkeypatch.setattr(usage, "LLM_DAILY_TOKEN_QUOTA", 1000)
+    return database
+
+
+def record(username, prompt_tokens, completion_tokens, endpoint="chat", ok=True):
+    record_usage(username, "r1", endpoint, "model-a",
+                 {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}, 120.0, ok=ok)
+
+
+def test_calls_are_rolled_up_per_day_endpoint_and_model(db):
+    record("alice", 100, 50)
+    record("alice", 200, 25, ok=False)
+    record("alice", 10, 5, endpoint="initial_analysis")
+
+    assert db.llm_usage.count_documents({"u": "alice"}) == 3
+    chat = db.llm_usage_daily.find_one({"username": "alice", "endpoint": "chat"})
+    assert (chat["calls"], chat["errors"], chat["prompt_tokens"], chat["completion_tokens"]) == (2, 1, 300, 75)
+
+    summary = usage_summary("alice")
+    assert summary["quota"]["used_today"] == 390
+    assert summary["quota"]["remaining_today"] == 610
+    assert len(summary["daily"]) == 2
+
+
+def test_quota_is_enforced_once_used_up(db):
+    record("alice", 600, 300)
+    check_quota("alice")
+
+    record("alice", 80, 20)
+    with pytest.raises(QuotaExceeded) as exceeded:
+        check_quota("alice")
+    assert (exceeded.value.used, exceeded.value.limit) == (1000, 1000)
+    assert exceeded.value.retry_after > 0
+    check_quota("bob")
+
+
+def test_user_override_and_zero_disable_the_default_quota(db, monkeypatch):
+    record("alice", 1500, 0)
+    db.users.insert_one({"username": "alice", "llm_daily_token_quota": 5000})
+    check_quota("alice")
+
+    db.users.update_one({"username": "alice"}, {"$set": {"llm_daily_token_quota": 0}})
+    record("alice", 10000, 0)
+    check_quota("alice")
+    assert usage_summary("alice")["quota"]["daily_tokens"] is None
+
+    db.users.delete_one({"username": "alice"})
+    monkeypatch.setattr(usage, "LLM_DAILY_TOKEN_QUOTA", 0)
+    check_quota("alice")
+
+
+def test_over_quota_chat_answers_429_without_an_llm_call(db, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import backend
+    import database
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "_client_for", lambda mongo_uri: client)
+    monkeypatch.setattr(backend, "check_quota", check_quota)
+    monkeypatch.setattr(backend, "analyze_report", lambda *args, **kwargs: pytest.fail("LLM called over quota"))
+    client[database.DB_NAME].patients.insert_one({"report_id": "r1", "version": 1})
+    record("alice", 1000, 0)
+
+    response = TestClient(backend.app).post("/chat/r1", json={"message": "Is my cholesterol high?"},
+                                            headers={"X-Username": "alice"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
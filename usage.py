@@ -0,0 +1,136 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from database import collection, users_collection
+
+# -----------------------------------
+# LLM Token Usage and Daily Quotas
+# -----------------------------------
+# Every LLM call appends one small event to llm_usage (short field names, see
+# record_usage) and adds its tokens to a pre-aggregated rollup in llm_usage_daily,
+# one document per (UTC day, user, endpoint, model). Quotas are checked against
+# the rollups before the upstream call, so a user can exceed the limit by at most
+# the call that crosses it.
+
+# Tokens (prompt + completion) per user per UTC day; 0 disables the quota.
+# A user document may override it with llm_daily_token_quota.
+LLM_DAILY_TOKEN_QUOTA = int(os.getenv("LLM_DAILY_TOKEN_QUOTA", "200000"))
+# Days raw usage events are kept; rollups are kept forever
+LLM_USAGE_RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", "90"))
+
+usage_collection = collection("llm_usage")
+usage_daily_collection = collection("llm_usage_daily")
+
+_usage_indexes_ensured = False
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, username: str, used: int, limit: int):
+        super().__init__(f"{username} used {used} of {limit} tokens today")
+        self.used = used
+        self.limit = limit
+        self.retry_after = seconds_until_reset()
+
+
+def _ensure_usage_indexes() -> None:
+    global _usage_indexes_ensured
+    if not _usage_indexes_ensured:
+        usage_daily_collection.create_index([("username", 1), ("day", 1)])
+        usage_collection.create_index([("u", 1), ("ts", 1)])
+        if LLM_USAGE_RETENTION_DAYS:
+            usage_collection.create_index("ts", expireAfterSeconds=LLM_USAGE_RETENTION_DAYS * 86400)
+        _usage_indexes_ensured = True
+
+
+def usage_day(moment: Optional[datetime] = None) -> str:
+    return (moment or datetime.utcnow()).strftime("%Y-%m-%d")
+
+
+def seconds_until_reset() -> int:
+    now = datetime.utcnow()
+    tomorrow = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return max(1, int((tomorrow - now).total_seconds()))
+
+
+def daily_quota(username: str) -> int:
+    user = users_collection.find_one({"username": username}, {"_id": 0, "llm_daily_token_quota": 1})
+    if user and user.get("llm_daily_token_quota") is not None:
+        return int(user["llm_daily_token_quota"])
+    return LLM_DAILY_TOKEN_QUOTA
+
+
+def tokens_used_today(username: str) -> int:
+    totals = list(usage_daily_collection.aggregate([
+        {"$match": {"username": username, "day": usage_day()}},
+        {"$group": {"_id": None, "tokens": {"$sum": {"$add": ["$prompt_tokens", "$completion_tokens"]}}}}
+    ]))
+    return int(totals[0]["tokens"]) if totals else 0
+
+
+def check_quota(username: Optional[str]) -> None:
+    """Raise QuotaExceeded if the user has no tokens left today."""
+    if not username:
+        return
+    limit = daily_quota(username)
+    if limit <= 0:
+        return
+    used = tokens_used_today(username)
+    if used >= limit:
+        raise QuotaExceeded(username, used, limit)
+
+
+def record_usage(username: Optional[str], report_id: Optional[str], endpoint: str, model: str,
+                 usage: Optional[Dict[str, Any]], latency_ms: float, ok: bool = True) -> None:
+    """Append one call and add it to the daily rollup. Failures are logged, never raised."""
+    usage = usage or {}
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    now = datetime.utcnow()
+    username = username or "unknown"
+    day = usage_day(now)
+    try:
+        _ensure_usage_indexes()
+        # u=user, r=report, e=endpoint, m=model, p/c=prompt/completion tokens, ms=latency
+        usage_collection.insert_one({
+            "u": username, "r": report_id, "e": endpoint, "m": model,
+            "p": prompt_tokens, "c": completion_tokens, "ms": round(latency_ms), "ok": ok, "ts": now
+        })
+        usage_daily_collection.update_one(
+            {"_id": "|".join([day, username, endpoint, model])},
+            {
+                "$inc": {
+                    "calls": 1,
+                    "errors": 0 if ok else 1,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "latency_ms": round(latency_ms)
+                },
+                "$setOnInsert": {"day": day, "username": username, "endpoint": endpoint, "model": model}
+            },
+            upsert=True
+        )
+    except Exception as e:
+        print("Error recording LLM usage:", e)
+
+
+def usage_summary(username: str, days: int = 7) -> Dict[str, Any]:
+    """Daily token totals of a user, per endpoint and model, with today's quota status."""
+    since = usage_day(datetime.utcnow() - timedelta(days=max(days, 1) - 1))
+    rollups: List[Dict[str, Any]] = list(usage_daily_collection.find(
+        {"username": username, "day": {"$gte": since}},
+        {"_id": 0, "username": 0}
+    ).sort("day", -1))
+
+    limit = daily_quota(username)
+    used = sum(r["prompt_tokens"] + r["completion_tokens"] for r in rollups if r["day"] == usage_day())
+    return {
+        "username": username,
+        "quota": {
+            "daily_tokens": limit or None,
+            "used_today": used,
+            "remaining_today": max(limit - used, 0) if limit else None,
+            "resets_in_seconds": seconds_until_reset()
+        },
+        "daily": rollups
+    }
@@ -1,25 +1,134 @@
 # utils.py
 
-import tempfile
-import os
+import json
+import time
+import uuid
 import requests
 import streamlit as st
 
 API_BASE_URL = "http://127.0.0.1:8080"  # or your FastAPI URL
 
-def save_uploaded_file(uploaded_file):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(uploaded_file.getvalue())
-        return tmp.name
+# Reports kept per browser session for If-None-Match revalidation, most recent last
+REPORT_CACHE_SIZE = 20
+
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# How long the dashboard waits for a background ingestion before offering a retry
+INGESTION_POLL_LIMIT_SECONDS = 300
+INGESTION_POLL_SECONDS = 2
+
+def _multipart_body(boundary, fields, file_obj, filename):
+    # Generated part by part, so requests streams the PDF in chunks instead of
+    # building the whole multipart body in memory
+    for name, value in fields.items():
+        yield f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+           "Content-Type: application/pdf\r\n\r\n").encode()
+    while True:
+        chunk = file_obj.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+def upload_report(uploaded_file, username, patient_context):
+    """Stream a PDF to POST /upload; returns its 202 body (content_hash, report_id, ...) or None."""
+    boundary = uuid.uuid4().hex
+    fields = {
+        "name": patient_context.get("name", ""),
+        "age": patient_context.get("age", 0),
+        "gender": patient_context.get("gender", ""),
+        "patient_context": json.dumps(patient_context)
+    }
+    filename = (uploaded_file.name or "report.pdf").replace('"', "")
+    uploaded_file.seek(0)
+    try:
+        response = requests.post(
+            f"{API_BASE_URL}/upload",
+            params={"username": username},
+            data=_multipart_body(boundary, fields, uploaded_file, filename),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        )
+        if response.status_code == 202:
+            return response.json()
+        is_json = response.headers.get("content-type", "").startswith("application/json")
+        st.error(f"Upload rejected: {response.json().get('detail') if is_json else response.text}")
+    except Exception as e:
+        st.error(f"API connection error: {e}")
+    return None
+
+def wait_for_ingestion(content_hash, username):
+    """Poll GET /ingestions/{content_hash} until the report is stored or failed; the last job seen."""
+    deadline = time.monotonic() + INGESTION_POLL_LIMIT_SECONDS
+    job = None
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(f"{API_BASE_URL}/ingestions/{content_hash}", params={"username": username})
+            if response.status_code == 200:
+                job = response.json()
+                if job.get("status") in ("complete", "failed"):
+                    return job
+        except Exception as e:
+            st.error(f"API connection error: {e}")
+            return job
+        time.sleep(INGESTION_POLL_SECONDS)
+    return job
+
+def retry_ingestion(content_hash, username):
+    """Resume a failed ingestion from its last completed stage; the report ID, or None."""
+    try:
+        response = requests.post(f"{API_BASE_URL}/ingestions/{content_hash}/retry", params={"username": username})
+        if response.status_code == 200:
+            return response.json().get("report_id")
+        st.error(f"Retry failed: {response.text}")
+    except Exception as e:
+        st.error(f"API connection error: {e}")
+    return None
+
+def _report_cache():
+    # report_id -> (etag, report data), scoped to the Streamlit session so users never share entries
+    return st.session_state.setdefault("report_cache", {})
+
+def _cache_report(report_id, etag, data):
+    cache = _report_cache()
+    cache.pop(report_id, None)
+    cache[report_id] = (etag, data)
+    while len(cache) > REPORT_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+
+def report_version(report_id):
+    """ETag of the last fetched copy of a report; changes whenever the stored report does."""
+    cached = _report_cache().get(report_id)
+    return cached[0] if cached else None
 
 def fetch_report_data(report_id):
+    cached = _report_cache().get(report_id)
+    headers = {"If-None-Match": cached[0]} if cached else {}
     try:
-        response = requests.get(f"{API_BASE_URL}/report/{report_id}")
+        response = requests.get(f"{API_BASE_URL}/report/{report_id}", headers=headers)
+        if response.status_code == 304 and cached:
+            _cache_report(report_id, *cached)
+            return cached[1]
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            if response.headers.get("ETag"):
+                _cache_report(report_id, response.headers["ETag"], data)
+            return data
         else:
+            _report_cache().pop(report_id, None)
             st.error(f"Error fetching report: {response.text}")
             return None
     except Exception as e:
         st.error(f"API connection error: {e}")
         return None
+
+def search_reports(username, **filters):
+    """Reports matching the filters of GET /users/{username}/search, or None on error."""
+    params = {key: value for key, value in filters.items() if value not in (None, "", False)}
+    try:
+        response = requests.get(f"{API_BASE_URL}/users/{username}/search", params=params)
+        if response.status_code == 200:
+            return response.json()
+        st.error(f"Error searching reports: {response.text}")
+    except Exception as e:
+        st.error(f"API connection error: {e}")
+    return None